@@ -0,0 +1,37 @@
+# ############################################################################
+#
+# conftest.py
+#
+# fixtures of the tests: a small synthetic library (see SyntheticLibrary)
+# loaded in a helper.
+#
+# ############################################################################
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ultrastar.appenv import AppEnv
+from ultrastar.songhelper import UltraStarHelper
+from ultrastar.synthlib import SyntheticLibrary
+
+
+@pytest.fixture
+def library(tmp_path):
+    "the generated library (songs with all their tags)"
+    lib = SyntheticLibrary(str(tmp_path), songs=40, missing_ratio=0, playlists=3, playlist_size=5)
+    lib.config_file = lib.generate()
+    return lib
+
+
+@pytest.fixture
+def helper(library):
+    "a helper with the library loaded (database on disk)"
+    helper = UltraStarHelper(AppEnv.config(library.config_file))
+    helper.load_db()
+    yield helper
+    helper.scrubber.shutdown()
+    helper.db.close()
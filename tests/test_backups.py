@@ -0,0 +1,56 @@
+import os
+import sqlite3
+
+
+def song_file(helper):
+    row = helper.db.execute("select path from songs order by id limit 1").fetchone()
+    return row[0]
+
+
+def test_backup_is_committed_by_the_caller(helper):
+    fname = song_file(helper)
+    helper.db.commit()
+    helper.do_backup(fname)
+    assert os.path.exists("%s.bak" % fname)
+
+    other = sqlite3.connect(helper.config.dbfile)
+    assert other.execute("select count(*) from backups").fetchone()[0] == 0
+    helper.db.commit()
+    assert other.execute("select count(*) from backups where path=?", (fname,)).fetchone()[0] == 1
+    other.close()
+
+
+def test_backup_rolled_back_with_the_change(helper):
+    fname = song_file(helper)
+    helper.db.commit()
+    helper.do_backup(fname)
+    helper.db.rollback()
+    assert helper.db.execute("select count(*) from backups").fetchone()[0] == 0
+
+
+def test_restore_from_the_manifest(helper):
+    fname = song_file(helper)
+    with open(fname, encoding=helper.config.encoding) as f:
+        original = f.read()
+    helper.update_config(fname, "genre", "Restored")
+    helper.db.commit()
+    with open(fname, encoding=helper.config.encoding) as f:
+        assert "#GENRE:Restored" in f.read()
+
+    counts = helper.restore_backup()
+    assert counts['restored'] == 1
+    with open(fname, encoding=helper.config.encoding) as f:
+        assert f.read() == original
+    assert not helper.db.in_transaction
+
+
+def test_restore_doesnt_walk_the_songs_dir(helper, monkeypatch):
+    # a .bak file that is not in the manifest
+    fname = song_file(helper)
+    with open("%s.bak" % fname, "w") as f:
+        f.write("not in the manifest")
+
+    def walk(*args, **kwargs):
+        raise AssertionError("the songs dir was walked")
+    monkeypatch.setattr(helper, "scan_songs_dir", walk)
+    assert helper.restore_backup() == { 'restored': 0, 'unchanged': 0, 'missing': 0 }
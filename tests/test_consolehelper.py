@@ -0,0 +1,11 @@
+from ultrastar.consolehelper import ConsoleHelper
+
+
+def test_console_uses_the_current_connection(helper):
+    console = ConsoleHelper(helper)
+    old = helper.db
+    helper.db = helper.open_db()
+    old.close()
+
+    assert console.console_get_db() is helper.db
+    assert any(field.startswith("title ") for field in console.console_db_get_fields())
@@ -0,0 +1,24 @@
+import os
+import json
+
+from ultrastar.exporter import PlaylistExporter
+
+
+def test_export_resolves_in_order(helper, tmp_path):
+    ids = [ row[0] for row in helper.db.execute("select id from songs order by id desc limit 4") ]
+    queries = { 'by query': "select id from songs order by id limit 3",
+                'by ids': ids }
+    files = PlaylistExporter(helper).export(queries, formats=[ 'upl', 'json' ], outdir=str(tmp_path / "out"))
+    assert len(files) == 4
+
+    with open(str(tmp_path / "out" / "by ids.json"), encoding="utf-8") as f:
+        assert [ song['id'] for song in json.load(f)['songs'] ] == ids
+    with open(str(tmp_path / "out" / "by query.json"), encoding="utf-8") as f:
+        assert [ song['id'] for song in json.load(f)['songs'] ] == [ 1, 2, 3 ]
+    assert os.path.exists(os.path.sep.join([ helper.config.full_playlist_dir, "by query.upl" ]))
+
+
+def test_export_leaves_no_transaction_open(helper, tmp_path):
+    helper.db.commit()
+    PlaylistExporter(helper).export({ 'one': "select id from songs limit 2" }, outdir=str(tmp_path))
+    assert not helper.db.in_transaction
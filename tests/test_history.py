@@ -0,0 +1,60 @@
+import os
+import glob
+
+import pytest
+
+
+def songs(helper, n):
+    return helper.db.execute("select * from songs order by id limit ?", (n,)).fetchall()
+
+
+def read(song, encoding):
+    with open(song['path'], encoding=encoding) as f:
+        return f.read()
+
+
+def test_numeric_change_rolls_back(helper):
+    history = helper.history
+    before = [ song['bpm'] for song in songs(helper, 3) ]
+    batch_id = history.begin("set bpm=120")
+    history.apply(batch_id, [ (song, 'bpm', 120) for song in songs(helper, 3) ])
+    assert [ song['bpm'] for song in songs(helper, 3) ] == [ 120.0 ] * 3
+
+    assert history.rollback(batch_id) is not None
+    assert [ song['bpm'] for song in songs(helper, 3) ] == before
+    assert not helper.db.in_transaction
+
+
+def test_apply_is_atomic(helper, monkeypatch):
+    history = helper.history
+    first, second = songs(helper, 2)
+    text = read(first, helper.config.encoding)
+    helper.db.commit()
+
+    update_song_file = helper.update_song_file
+    calls = []
+    def fail_second(dirname, field, value, backup=True):
+        calls.append(dirname)
+        if dirname == second['dirname']:
+            raise OSError("disk full")
+        update_song_file(dirname, field=field, value=value, backup=backup)
+    monkeypatch.setattr(helper, "update_song_file", fail_second)
+
+    batch_id = history.begin("set genre=Broken")
+    with pytest.raises(OSError):
+        history.apply(batch_id, [ (first, 'genre', "Broken"), (second, 'genre', "Broken") ])
+
+    assert not helper.db.in_transaction
+    assert [ song['genre'] for song in songs(helper, 2) ] == [ first['genre'], second['genre'] ]
+    assert helper.db.execute("select count(*) from history").fetchone()[0] == 0
+    # the file already written has its old value again
+    assert "#GENRE:%s" % first['genre'] in read(first, helper.config.encoding)
+    assert read(first, helper.config.encoding).count("#GENRE:") == text.count("#GENRE:")
+
+
+def test_set_doesnt_write_backup_files(helper):
+    song = songs(helper, 1)[0]
+    batch_id = helper.history.begin("set genre=Pop")
+    helper.history.apply(batch_id, [ (song, 'genre', "Pop") ])
+    assert glob.glob(os.path.join(song['dirname'], "*.bak")) == []
+    assert "#GENRE:Pop" in read(song, helper.config.encoding)
@@ -0,0 +1,22 @@
+import time
+import threading
+
+from ultrastar.jobs import JobManager
+
+
+def wait(job):
+    deadline = time.monotonic() + 5
+    while job.finished is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_eviction_keeps_running_jobs():
+    jobs = JobManager(max_jobs=2)
+    release = threading.Event()
+    running = jobs.start("refresh", lambda job: release.wait(5))
+    for i in range(4):
+        wait(jobs.start("quick-%d" % i, lambda job: None))
+
+    assert jobs.get(running.id) is running
+    assert len(jobs.list()) == 2
+    release.set()
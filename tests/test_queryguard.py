@@ -0,0 +1,49 @@
+import sqlite3
+import threading
+
+import pytest
+
+from ultrastar.queryguard import QueryInterrupted
+
+
+SLOW = "with recursive n(i) as (select 1 union all select i + 1 from n) select count(*) from n"
+
+
+def test_read_only_is_per_thread(helper):
+    guard = helper.query_guard
+    done = []
+    def write():
+        helper.db.execute("update songs set bpm = bpm where id = (select min(id) from songs)")
+        helper.db.rollback()
+        done.append(True)
+
+    with guard.guard(read_only=True):
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join()
+    assert done == [ True ]
+    assert not helper.db.execute("pragma query_only").fetchone()[0]
+
+
+def test_read_only_denies_cached_statements(helper):
+    guard = helper.query_guard
+    sql = "update songs set bpm = bpm where id = (select min(id) from songs)"
+    helper.db.execute(sql)
+    helper.db.rollback()
+
+    with pytest.raises(sqlite3.OperationalError, match="read only"):
+        with guard.guard(read_only=True):
+            helper.db.execute(guard.statement(sql))
+
+    # the same sentence runs again outside the guard
+    helper.db.execute(sql)
+    helper.db.rollback()
+
+
+def test_budget_stops_the_query(helper):
+    guard = helper.query_guard
+    guard.budget = 0.2
+    with pytest.raises(QueryInterrupted):
+        with guard.guard():
+            helper.db.execute(guard.statement(SLOW)).fetchone()
+    assert helper.db.execute("select count(*) from songs").fetchone()[0] == 40
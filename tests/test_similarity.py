@@ -0,0 +1,37 @@
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from ultrastar.similarity import IndexNotReady
+
+
+def test_not_built_in_the_query(helper):
+    with pytest.raises(IndexNotReady):
+        helper.similarity.similar(1)
+    assert helper.similarity.refresh() == 40
+    assert len(helper.similarity.similar(1, 5)) == 5
+
+
+def test_one_build_at_a_time(helper, monkeypatch):
+    similarity = helper.similarity
+    similarity.refresh()
+    builds = []
+    build = similarity.build
+    def slow_build(*args, **kwargs):
+        builds.append(1)
+        time.sleep(0.2)
+        return build(*args, **kwargs)
+    monkeypatch.setattr(similarity, "build", slow_build)
+
+    helper.bump_data_version()
+    # the previous index is used while the new one is built
+    assert similarity.stale() and len(similarity.similar(1, 3)) == 3
+    threads = [ threading.Thread(target=similarity.refresh) for i in range(4) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert builds == [ 1 ] and not similarity.stale()
@@ -0,0 +1,26 @@
+import sqlite3
+
+
+def test_resolve_fuzzy_entries(helper):
+    song = helper.db.execute("select id, artist, title from songs order by id limit 1").fetchone()
+    resolved = helper.songindex.resolve([ (song['artist'], song['title']),
+                                          (song['artist'], song['title'] + "x"),
+                                          ("nobody here", "no such song at all") ])
+    assert resolved[0] == (song['id'], 1.0)
+    assert resolved[1][0] == song['id'] and 0.75 <= resolved[1][1] < 1.0
+    assert resolved[2][0] is None
+
+
+def test_resolve_leaves_no_transaction_open(helper):
+    song = helper.db.execute("select id, artist, title from songs order by id limit 1").fetchone()
+    helper.db.commit()
+    helper.songindex.resolve([ (song['artist'], song['title'] + "x") ])
+    assert not helper.db.in_transaction
+
+    # a commit of another connection is seen by the helper's one
+    other = sqlite3.connect(helper.config.dbfile)
+    other.execute("update songs set title='changed elsewhere' where id=?", (song['id'],))
+    other.commit()
+    other.close()
+    title = helper.db.execute("select title from songs where id=?", (song['id'],)).fetchone()[0]
+    assert title == "changed elsewhere"
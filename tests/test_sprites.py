@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+
+
+def test_refresh_outside_the_request(helper):
+    sprites = helper.sprites
+    assert sprites.current() is None
+    assert sprites.stale()
+    assert sprites.refresh() > 0
+    assert not sprites.stale()
+    assert sprites.current()['tiles']
+    # nothing changed
+    assert sprites.refresh() == 0
+
+
+def test_one_update_at_a_time(helper):
+    sprites = helper.sprites
+    assert sprites.lock_file()
+    # another process holds the lock
+    assert sprites.refresh() == 0 and sprites.stale()
+    sprites.unlock_file()
+    assert sprites.refresh() > 0
+    assert not os.path.exists(os.path.join(sprites.sprite_dir, sprites.LOCK))
@@ -25,6 +25,32 @@ class AppEnvConfig:
         self.do_backup = True
         self.dbfile = "songs.db"
         self.encoding = "iso-8859-15"
+        self.slow_query_ms = 100
+        self.slow_query_log = None
+        self.artist_cover = "largest"
+        self.export_dir = None
+        self.result_cache_bytes = 64 * 1024 * 1024
+        self.query_budget = 30
+        self.query_read_only = False
+        self.query_indicator = 2
+        self.response_cache_bytes = 32 * 1024 * 1024
+        self.fragment_cache_entries = 4096
+        self.ingest_batch = 500
+        self.use_catalog = False
+        self.in_memory = False
+        self.playlist_match_threshold = 0.75
+        self.persist_interval = 300
+        self.persist_writes = 100
+        self.catalog_file = None
+        self.similarity_file = None
+        self.sprite_dir = None
+        self.sprite_size = 160
+        self.integrity_file = None
+        self.scrub = False
+        self.scrub_bandwidth = 1024 * 1024
+        self.scrub_interval = 7
+        self.scrub_batch = 100
+        self.scrub_idle = 60
 
         if kwargs:
             for key,value in kwargs.items():
@@ -34,6 +60,16 @@ class AppEnvConfig:
 
         self.full_songs_dir = os.path.sep.join([self.ultrastar_dir, self.songs_dir])
         self.full_playlist_dir = os.path.sep.join([self.ultrastar_dir, self.playlist_dir])
+        if not self.catalog_file:
+            self.catalog_file = "%s.catalog" % self.dbfile
+        if not self.similarity_file:
+            self.similarity_file = "%s.similar.npz" % self.dbfile
+        if not self.sprite_dir:
+            self.sprite_dir = "%s.sprites" % self.dbfile
+        if not self.integrity_file:
+            self.integrity_file = "%s.integrity" % self.dbfile
+        if not self.export_dir:
+            self.export_dir = os.path.sep.join([self.ultrastar_dir, "exports"])
 
 
 
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# backups.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# manifest of the backup (.bak) files: every backup done is stored in the
+# database with the hash of the original contents, so the restore doesn't
+# need to walk the songs directory, runs in parallel, can be resumed if
+# interrupted and skips the files that already have the original contents.
+#
+# ############################################################################
+
+import os
+import shutil
+import hashlib
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import sys
+sys.path.append('..')
+
+from ultrastar.helper import Helper
+
+
+class BackupManifest:
+
+    # kept between loads (as the played table)
+    SQL_BACKUPS = """
+        create table if not exists backups(
+            id integer primary key AUTOINCREMENT,
+            path text not null unique,
+            backup text not null,
+            hash text not null,
+            backed_up_at timestamp not null,
+            restored_at timestamp
+        );
+        """
+
+    def __init__(self, helper):
+        self.helper = helper
+        self.config = helper.config
+        self.verbose = helper.verbose or 0
+        self.lock = threading.Lock()
+        self.table_ready = None
+
+    @staticmethod
+    def file_hash(filename):
+        "sha1 of the file contents, None if the file doesn't exist"
+        h = hashlib.sha1()
+        try:
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    h.update(chunk)
+        except FileNotFoundError:
+            return None
+        return h.hexdigest()
+
+    def ensure_table(self):
+        db = self.helper.db
+        if self.table_ready is not db:
+            db.execute(BackupManifest.SQL_BACKUPS)
+            self.table_ready = db
+
+    def do_backup(self, filename, ext="bak"):
+        """backup the file (see Helper.do_backup) and store it in the manifest.
+        If the file was restored, it's marked again as pending.
+
+        Args:
+            filename (str): the file that is going to be modified
+            ext (str, optional): extension of the backup. Defaults to "bak".
+        """
+        Helper.do_backup(filename, ext)
+        if not self.helper.db:
+            return
+        self.record(filename, "%s.%s" % (filename, ext))
+
+    def record(self, filename, backup):
+        """store the backup in the manifest, in the transaction of the caller
+        (that commits it with the change the backup was done for)"""
+        if not os.path.exists(backup):
+            return
+        now = datetime.datetime.now().isoformat(" ")
+        with self.lock:
+            self.ensure_table()
+            cursor = self.helper.db.cursor()
+            cursor.execute("select id from backups where path=?", (filename,))
+            if cursor.fetchone():
+                cursor.execute("update backups set restored_at=null where path=?", (filename,))
+            else:
+                cursor.execute("insert into backups(path, backup, hash, backed_up_at) values (?, ?, ?, ?)",
+                               (filename, backup, BackupManifest.file_hash(backup), now))
+            cursor.close()
+
+    def pending(self):
+        "the backups not restored yet"
+        with self.lock:
+            self.ensure_table()
+            cursor = self.helper.db.cursor()
+            cursor.execute("select id, path, backup, hash from backups where restored_at is null order by id")
+            rows = list(map(lambda x: dict(x), cursor.fetchall()))
+            cursor.close()
+        return rows
+
+    def restore_one(self, entry, dry_run, delete_backup):
+        """restore a file from its backup (runs in the thread pool)
+
+        Returns:
+            str: restored, unchanged (already has the original contents) or missing (no backup file)
+        """
+        if not os.path.exists(entry['backup']):
+            return "missing"
+        if BackupManifest.file_hash(entry['path']) == entry['hash']:
+            status = "unchanged"
+        else:
+            status = "restored"
+            if not dry_run:
+                tmpfile = "%s.%d-%d.tmp" % (entry['path'], os.getpid(), threading.get_ident())
+                shutil.copy2(entry['backup'], tmpfile)
+                os.replace(tmpfile, entry['path'])
+        if delete_backup and not dry_run:
+            os.remove(entry['backup'])
+        return status
+
+    def restore(self, dry_run=False, delete_backup=False, workers=8):
+        """restore the pending backups of the manifest. Each file restored is
+        marked in the manifest, so an interrupted restore goes on from there.
+
+        Args:
+            dry_run (bool, optional): only show what would be restored. Defaults to False.
+            delete_backup (bool, optional): delete the backup files. Defaults to False.
+            workers (int, optional): threads copying files. Defaults to 8.
+
+        Returns:
+            dict: count of files by status (restored, unchanged, missing)
+        """
+        entries = self.pending()
+        counts = { 'restored': 0, 'unchanged': 0, 'missing': 0 }
+        cursor = self.helper.db.cursor()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = dict((executor.submit(self.restore_one, entry, dry_run, delete_backup), entry)
+                           for entry in entries)
+            for done, future in enumerate(as_completed(futures), 1):
+                entry = futures[future]
+                status = future.result()
+                counts[status] += 1
+                if self.verbose > 1 or dry_run:
+                    print("%s%s: %s" % ("(dry run) " if dry_run else "", status, entry['path']))
+                if dry_run:
+                    continue
+                with self.lock:
+                    if delete_backup or status == "missing":
+                        cursor.execute("delete from backups where id=?", (entry['id'],))
+                    else:
+                        cursor.execute("update backups set restored_at=? where id=?",
+                                       (datetime.datetime.now().isoformat(" "), entry['id']))
+                    if done % 100 == 0:
+                        self.helper.db.commit()
+        cursor.close()
+        self.helper.db.commit()
+
+        if self.verbose > 0:
+            print("backup restore: %d restored, %d unchanged, %d missing" %
+                  (counts['restored'], counts['unchanged'], counts['missing']))
+        return counts
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# batch.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# non interactive mode of the console: runs the sql sentences and console
+# commands of a script (or stdin) against the database, without loading the
+# library, and writes the rows as csv, ndjson or a text table while they are
+# read from the cursor (memory doesn't grow with the results).
+#
+# ############################################################################
+
+import csv
+import json
+import re
+import sqlite3
+import traceback
+
+import sys
+sys.path.append('..')
+
+from ultrastar.resultcache import ResultRow
+from ultrastar.resultset import ResultSet
+
+
+class BatchError(Exception):
+    "a statement of the script failed"
+    def __init__(self, number, statement, error):
+        super().__init__("statement %d failed: %s\n%s" % (number, error, statement))
+        self.number = number
+        self.statement = statement
+        self.error = error
+
+
+class RowWriter:
+    "writes the rows of each result (header, rows, end)"
+
+    def __init__(self, out):
+        self.out = out
+
+    def begin(self, columns):
+        pass
+
+    def row(self, values):
+        pass
+
+    def end(self):
+        self.out.flush()
+
+
+class CsvWriter(RowWriter):
+    def __init__(self, out):
+        super().__init__(out)
+        self.writer = csv.writer(out, lineterminator="\n")
+
+    def begin(self, columns):
+        self.writer.writerow(columns)
+
+    def row(self, values):
+        self.writer.writerow(values)
+
+
+class NdjsonWriter(RowWriter):
+    def begin(self, columns):
+        self.columns = columns
+
+    def row(self, values):
+        self.out.write(json.dumps(dict(zip(self.columns, values)), ensure_ascii=False, default=str))
+        self.out.write("\n")
+
+
+class TableWriter(RowWriter):
+    "the widths come from the first rows (the next ones are not buffered)"
+
+    SAMPLE = 100
+    MAX_WIDTH = 60
+
+    def begin(self, columns):
+        self.columns = columns
+        self.sample = []
+        self.widths = None
+
+    @staticmethod
+    def text(value):
+        return "NULL" if value is None else str(value)
+
+    def flush_sample(self):
+        self.widths = [ min(TableWriter.MAX_WIDTH, max([ len(name) ] + [ len(TableWriter.text(row[i])) for row in self.sample ]))
+                        for i, name in enumerate(self.columns) ]
+        self.write_line(self.columns)
+        self.out.write("-+-".join("-" * width for width in self.widths) + "\n")
+        for row in self.sample:
+            self.write_line(row)
+        self.sample = []
+
+    def write_line(self, values):
+        self.out.write(" | ".join(TableWriter.text(value).ljust(width) for value, width in zip(values, self.widths)).rstrip())
+        self.out.write("\n")
+
+    def row(self, values):
+        if self.widths is None:
+            self.sample.append(values)
+            if len(self.sample) >= TableWriter.SAMPLE:
+                self.flush_sample()
+        else:
+            self.write_line(values)
+
+    def end(self):
+        if self.widths is None:
+            self.flush_sample()
+        super().end()
+
+
+class BatchRunner:
+
+    EXIT_OK = 0
+    EXIT_ERROR = 1
+    EXIT_USAGE = 2
+    EXIT_INTERRUPTED = 130
+
+    FORMATS = { 'csv': CsvWriter, 'ndjson': NdjsonWriter, 'table': TableWriter }
+
+    # first word of the sql sentences (the other lines are console commands)
+    SQL_WORDS = [ 'select', 'with', 'values', 'insert', 'update', 'delete', 'replace',
+                  'create', 'drop', 'alter', 'pragma', 'explain', 'analyze', 'vacuum',
+                  'begin', 'commit', 'end', 'rollback', 'savepoint', 'release', 'reindex' ]
+
+    def __init__(self, console, format="table", out=None, keep_going=False):
+        """
+        Args:
+            console (ConsoleHelper): the console (its commands are available to the script)
+            format (str, optional): csv, ndjson or table. Defaults to "table".
+            out (file, optional): where the rows are written. Defaults to sys.stdout.
+            keep_going (bool, optional): run the next statements after an error. Defaults to False.
+        """
+        self.console = console
+        self.helper = console.helper
+        self.verbose = self.helper.verbose or 0
+        self.out = out or sys.stdout
+        self.writer = BatchRunner.FORMATS[format](self.out)
+        self.keep_going = keep_going
+        self.batch_size = 500
+        # a transaction opened by the script (the sentences are not committed one by one)
+        self.transaction = False
+
+    @staticmethod
+    def first_word(text):
+        match = re.match(r"\s*([A-Za-z]+)", text)
+        return match.group(1).lower() if match else ""
+
+    @staticmethod
+    def is_sql(text):
+        return BatchRunner.first_word(text) in BatchRunner.SQL_WORDS
+
+    @staticmethod
+    def statements(lines):
+        """split the script in statements: sql sentences end with ; (and can
+        span many lines), console commands are one line. Empty lines and
+        comments (-- or #) are skipped
+
+        Yields:
+            tuple: (line number, statement, is sql)
+        """
+        buffer = []
+        start = 0
+        for number, line in enumerate(lines, 1):
+            if buffer:
+                buffer.append(line)
+                text = "".join(buffer)
+                if sqlite3.complete_statement(text):
+                    yield start, text.strip(), True
+                    buffer = []
+                continue
+            stripped = line.strip()
+            if not stripped or stripped.startswith("--") or stripped.startswith("#"):
+                continue
+            if BatchRunner.is_sql(stripped):
+                if sqlite3.complete_statement(stripped):
+                    yield number, stripped, True
+                else:
+                    buffer = [ line ]
+                    start = number
+            else:
+                yield number, stripped, False
+        if buffer:
+            # the last sentence without ;
+            yield start, "".join(buffer).strip(), True
+
+    def write_rows(self, columns, rows):
+        "stream rows (tuples, ResultRow, sqlite3.Row or dicts)"
+        self.writer.begin(columns)
+        count = 0
+        for row in rows:
+            if isinstance(row, dict):
+                row = [ row.get(name) for name in columns ]
+            self.writer.row(tuple(row))
+            count += 1
+        self.writer.end()
+        return count
+
+    def run_sql(self, sql):
+        guard = self.helper.query_guard
+        cursor = self.helper.db.cursor()
+        cursor.row_factory = None
+        try:
+            with guard.guard():
+                cursor.execute(guard.statement(sql))
+            if cursor.description is None:
+                # the sentence changed the data
+                changed = cursor.rowcount
+                word = BatchRunner.first_word(sql)
+                if word in ('begin', 'savepoint'):
+                    self.transaction = True
+                elif word in ('commit', 'end', 'rollback'):
+                    self.transaction = False
+                elif not self.transaction:
+                    self.helper.db.commit()
+                self.helper.bump_data_version()
+                if self.verbose > 0:
+                    print("%d rows changed" % changed, file=sys.stderr)
+                return changed
+
+            def rows():
+                while True:
+                    with guard.guard():
+                        batch = cursor.fetchmany(self.batch_size)
+                    if not batch:
+                        break
+                    yield from batch
+            return self.write_rows([ d[0] for d in cursor.description ], rows())
+        finally:
+            cursor.close()
+
+    def run_command(self, command):
+        "evaluate a console command, and write its result"
+        environment = self.console.environment
+        try:
+            code = compile(command, "<batch>", "eval")
+        except SyntaxError:
+            exec(compile(command, "<batch>", "exec"), environment)
+            return None
+        result = eval(code, environment)
+        if result is None:
+            return None
+
+        if isinstance(result, ResultSet):
+            cursor = self.helper.db.cursor()
+            cursor.execute("select * from (%s) limit 0" % result.query, result.params)
+            columns = [ d[0] for d in cursor.description ]
+            cursor.close()
+            return self.write_rows(columns, iter(result))
+        if isinstance(result, dict):
+            return self.write_rows(list(result.keys()), [ result ])
+        if isinstance(result, (list, tuple)) and result:
+            first = result[0]
+            if isinstance(first, dict):
+                return self.write_rows(list(first.keys()), result)
+            if isinstance(first, (ResultRow, sqlite3.Row)):
+                return self.write_rows(list(first.keys()), result)
+            if isinstance(first, (list, tuple)):
+                return self.write_rows([ "c%d" % i for i in range(len(first)) ], result)
+            return self.write_rows([ "result" ], [ (value,) for value in result ])
+        return self.write_rows([ "result" ], [ (result,) ])
+
+    def run(self, lines):
+        """run the statements of the script
+
+        Args:
+            lines (iterable): the lines of the script (a file, stdin...)
+
+        Returns:
+            int: the exit status (EXIT_OK, EXIT_ERROR if a statement failed, EXIT_INTERRUPTED)
+        """
+        status = BatchRunner.EXIT_OK
+        for number, statement, is_sql in BatchRunner.statements(lines):
+            try:
+                if is_sql:
+                    self.run_sql(statement)
+                else:
+                    self.run_command(statement)
+            except (Exception, KeyboardInterrupt) as e:
+                error = BatchError(number, statement, "%s: %s" % (e.__class__.__name__, e))
+                print(error, file=sys.stderr)
+                if self.verbose > 1:
+                    traceback.print_exc()
+                if self.helper.db.in_transaction:
+                    self.helper.db.rollback()
+                self.transaction = False
+                if isinstance(e, KeyboardInterrupt):
+                    return BatchRunner.EXIT_INTERRUPTED
+                status = BatchRunner.EXIT_ERROR
+                if not self.keep_going:
+                    break
+        return status
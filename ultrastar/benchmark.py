@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# benchmark.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# Times the operations of the project and stores the results as json, so
+# different runs can be compared to catch regressions
+#
+# ############################################################################
+
+import json
+import time
+import platform
+import datetime
+import statistics
+
+
+class Benchmark:
+    def __init__(self, params=None, verbose=0):
+        self.params = params or {}
+        self.verbose = verbose
+        self.results = {}
+
+    def run(self, name, func, repeat=3, setup=None):
+        """time func() repeat times and store the statistics under name
+
+        Args:
+            name (str): the name of the benchmark
+            func (callable): the function to time
+            repeat (int, optional): number of runs. Defaults to 3.
+            setup (callable, optional): called (untimed) before each run. Defaults to None.
+
+        Returns:
+            dict: the statistics (seconds)
+        """
+        timings = []
+        for i in range(repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+
+        result = {
+            'repeat': repeat,
+            'min': min(timings),
+            'max': max(timings),
+            'mean': statistics.mean(timings),
+            'median': statistics.median(timings),
+        }
+        self.results[name] = result
+        if self.verbose > 0:
+            print("%-32s median %10.3f ms  min %10.3f ms" % (name, result['median'] * 1000, result['min'] * 1000))
+        return result
+
+    def record(self, name, **values):
+        """store arbitrary values (e.g. memory peaks) under name"""
+        self.results[name] = values
+        if self.verbose > 0:
+            print("%-32s %s" % (name, ", ".join("%s=%s" % (k, v) for k, v in values.items())))
+        return values
+
+    def as_dict(self):
+        return {
+            'meta': {
+                'timestamp': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'params': self.params,
+            },
+            'results': self.results
+        }
+
+    def save(self, fname):
+        """save the results as json
+
+        Args:
+            fname (str): the output file
+        """
+        with open(fname, 'w') as f:
+            json.dump(self.as_dict(), f, indent=4)
+
+    def compare(self, fname, threshold=0.2):
+        """compare the results with a previous run
+
+        Args:
+            fname (str): the json file of the baseline run
+            threshold (float, optional): allowed slowdown ratio. Defaults to 0.2.
+
+        Returns:
+            list: list of (name, baseline, current, ratio) of the regressions
+        """
+        with open(fname) as f:
+            baseline = json.load(f)['results']
+
+        regressions = []
+        for name, result in self.results.items():
+            if name not in baseline or 'median' not in result or 'median' not in baseline[name]:
+                continue
+            old = baseline[name]['median']
+            new = result['median']
+            ratio = new / old if old else 0
+            if self.verbose > 0:
+                print("%-32s %10.3f ms -> %10.3f ms (x%.2f)" % (name, old * 1000, new * 1000, ratio))
+            if ratio > 1 + threshold:
+                regressions.append((name, old, new, ratio))
+        return regressions
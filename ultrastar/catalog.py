@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# catalog.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# read only snapshot of the songs table in a compact binary file, built once
+# and memory mapped by the web workers: fixed width records (sorted by id)
+# followed by a table with the strings (each distinct string stored once).
+# All the processes mapping the file share the same pages.
+#
+# ############################################################################
+
+import os
+import mmap
+import time
+import struct
+import threading
+
+import sys
+sys.path.append('..')
+
+from ultrastar.helper import Helper
+
+
+class Catalog:
+
+    MAGIC = b"USCATLG1"
+    VERSION = 1
+
+    # magic, version, record size, records, strings offset, build time
+    HEADER = struct.Struct("<8sIIQQd")
+
+    NUMBERS = [ ('id', 'I'), ('duration', 'd'),
+                ('multi', 'B'), ('has_cover', 'B'), ('has_video', 'B'),
+                ('genre_id', 'I'), ('edition_id', 'I'), ('language_id', 'I') ]
+
+    # stored as (offset, length) in the strings table
+    STRINGS = [ 'title', 'artist', 'artist_norm', 'language', 'edition', 'genre',
+                'year', 'mp3', 'cover', 'video', 'videogap', 'bpm', 'gap', 'path', 'dirname' ]
+
+    # numeric columns that can hold text (e.g. UNKNOWN when the tag is missing)
+    MIXED = [ 'year', 'videogap', 'bpm' ]
+
+    RECORD = struct.Struct("<" + "".join(code for name, code in NUMBERS) + "II" * len(STRINGS))
+    ID = struct.Struct("<I")
+
+    def __init__(self, fname):
+        """map the catalog file (read only)
+
+        Args:
+            fname (str): the catalog file (see Catalog.build)
+        """
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, count, strings, built = Catalog.HEADER.unpack_from(self.mm, 0)
+        if magic != Catalog.MAGIC or version != Catalog.VERSION or record_size != Catalog.RECORD.size:
+            self.mm.close()
+            raise ValueError("%s is not a catalog file (or was built by another version)" % fname)
+        self.count = count
+        self.strings = strings
+        self.built = built
+        self.records = Catalog.HEADER.size
+
+    @staticmethod
+    def build(db, fname):
+        """write the snapshot of the songs table (atomic: the workers mapping
+        the previous file keep reading it until they reopen it)
+
+        Args:
+            db (sqlconn): the database
+            fname (str): the catalog file
+
+        Returns:
+            int: number of songs
+        """
+        columns = [ name for name, code in Catalog.NUMBERS ] + Catalog.STRINGS
+        cursor = db.cursor()
+        cursor.execute("select %s from songs order by id" % ", ".join(columns))
+
+        table = bytearray()
+        offsets = {}
+
+        def add_string(value):
+            value = "" if value is None else str(value)
+            ref = offsets.get(value)
+            if ref is None:
+                data = value.encode('utf-8')
+                ref = offsets[value] = (len(table), len(data))
+                table.extend(data)
+            return ref
+
+        records = bytearray()
+        count = 0
+        numbers = len(Catalog.NUMBERS)
+        for row in cursor:
+            values = [ row[i] or 0 for i in range(numbers) ]
+            for i in range(numbers, len(columns)):
+                values.extend(add_string(row[i]))
+            records.extend(Catalog.RECORD.pack(*values))
+            count += 1
+        cursor.close()
+
+        header = Catalog.HEADER.pack(Catalog.MAGIC, Catalog.VERSION, Catalog.RECORD.size, count,
+                                     Catalog.HEADER.size + len(records), time.time())
+        tmpfile = "%s.%d-%d.tmp" % (fname, os.getpid(), threading.get_ident())
+        try:
+            with open(tmpfile, 'wb') as f:
+                f.write(header)
+                f.write(records)
+                f.write(table)
+            os.replace(tmpfile, fname)
+        finally:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+        return count
+
+    def changed(self):
+        "true if the file was built again since it was mapped"
+        try:
+            st = os.stat(self.fname)
+        except OSError:
+            return False
+        return (st.st_ino, st.st_mtime_ns, st.st_size) != self.stat
+
+    def reopen(self):
+        """the catalog mapping the current file (self if it didn't change)"""
+        if not self.changed():
+            return self
+        return Catalog(self.fname)
+
+    def string(self, offset, length):
+        start = self.strings + offset
+        return self.mm[start:start + length].decode('utf-8')
+
+    @staticmethod
+    def number(value):
+        "the value of a MIXED column as the database returns it"
+        for convert in (int, float):
+            try:
+                return convert(value)
+            except ValueError:
+                pass
+        return value
+
+    def field(self, index, name):
+        "a string field of the song at the given position, without reading the others"
+        pos = len(Catalog.NUMBERS) + 2 * Catalog.STRINGS.index(name)
+        values = Catalog.RECORD.unpack_from(self.mm, self.records + index * Catalog.RECORD.size)
+        return self.string(values[pos], values[pos + 1])
+
+    def record(self, index):
+        """the song at the given position
+
+        Returns:
+            dict: the song (the columns of the songs table stored in the catalog)
+        """
+        values = Catalog.RECORD.unpack_from(self.mm, self.records + index * Catalog.RECORD.size)
+        song = dict(zip((name for name, code in Catalog.NUMBERS), values))
+        pos = len(Catalog.NUMBERS)
+        for name in Catalog.STRINGS:
+            song[name] = self.string(values[pos], values[pos + 1])
+            pos += 2
+        for name in Catalog.MIXED:
+            song[name] = Catalog.number(song[name])
+        return song
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.record(index)
+
+    def get(self, id):
+        """the song with the given id (binary search, records are sorted by id)
+
+        Returns:
+            dict: the song, or None
+        """
+        id = int(id)
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if Catalog.ID.unpack_from(self.mm, self.records + mid * Catalog.RECORD.size)[0] < id:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.count:
+            song = self.record(low)
+            if song['id'] == id:
+                return song
+        return None
+
+    def songs(self, artist=None, search=None):
+        """the songs of an artist and/or with the search string in the title
+        (as the /data route queries)
+
+        Args:
+            artist (str, optional): the artist (any variant of the name). Defaults to None.
+            search (str, optional): case insensitive substring of the title. Defaults to None.
+
+        Returns:
+            list: list of dicts, sorted by title when filtering by artist
+        """
+        norm = Helper.normalize(artist) if artist else None
+        search = search.casefold() if search else None
+        songs = []
+        for index in range(self.count):
+            if norm is not None and self.field(index, 'artist_norm') != norm:
+                continue
+            if search is not None and search not in self.field(index, 'title').casefold():
+                continue
+            songs.append(self.record(index))
+        if norm is not None:
+            songs.sort(key=lambda song: song['title'])
+        return songs
+
+    def close(self):
+        self.mm.close()
@@ -15,11 +15,14 @@ import code
 import inspect
 import ultrastar.literals
 from ultrastar.helper import Helper
+from ultrastar.playlistgen import PlaylistGenerator
+from ultrastar.exporter import PlaylistExporter
+from ultrastar.resultcache import ResultCache
+from ultrastar.resultset import ResultSet
 
 class ConsoleHelper(code.InteractiveConsole):
     def __init__(self, helper):
         self.helper = helper
-        self.db = helper.db
         self.config = helper.config
         self.environment = None
         self.banner = None
@@ -65,7 +68,20 @@ class ConsoleHelper(code.InteractiveConsole):
         self.environment["commands"] = self.console_print_commands
         self.environment["set"] = self.console_db_set_field
         self.environment["refresh_db"] = self.console_db_refresh_db
+        self.environment["restore_backup"] = self.console_restore_backup
+        self.environment["history"] = self.console_history
+        self.environment["rollback"] = self.console_rollback
+        self.environment["regenerate_headers"] = self.console_regenerate_headers
         self.environment["create_playlist"] = self.console_create_playlist
+        self.environment["generate_playlist"] = self.console_generate_playlist
+        self.environment["export_playlists"] = self.console_export_playlists
+        self.environment["slow_queries"] = self.console_slow_queries
+        self.environment["cache_stats"] = self.console_cache_stats
+        self.environment["facets"] = self.console_facets
+        self.environment["limits"] = self.console_limits
+        self.environment["scrub"] = self.console_scrub
+        self.environment["integrity"] = self.console_integrity
+        self.environment["similar"] = self.console_similar
 
         self.environment["seconds_to_str"] = Helper.seconds_to_str
         
@@ -85,37 +101,64 @@ class ConsoleHelper(code.InteractiveConsole):
         raise SystemExit
   
     
-    def console_get_input(self, input):
-        """if string, run the query and return the items, but if not, return the array
+    def console_get_input(self, input, params=()):
+        """if string, return a lazy result of the query (iterate it, len(), slices,
+        .show(page), .all()), but if not, return the array
 
         Args:
             input (str / list): if str run the query, if list pass it
+            params (tuple / dict): the parameters of the query, if any
 
         Returns:
-            list: the items
+            ResultSet / list: the items
         """
 
         if isinstance(input, str):
-            return self.console_db_get_results(input)
+            if not ResultCache.is_read(ResultCache.normalize(input)):
+                return self.console_db_get_results(input, params)
+            return ResultSet(self.helper, input, params)
         return input
 
+    def get_id_batches(self, input, ordered=True, size=500):
+        """yield the song ids of the input (sql query, ResultSet or list) in batches
+
+        Args:
+            input (str / ResultSet / list): the songs
+            ordered (bool, optional): keep the order of the query. If false, ids are pulled
+                                      by id ranges, so the rows can be updated meanwhile. Defaults to True.
+            size (int, optional): ids per batch. Defaults to 500.
+
+        Yields:
+            list: list of ids
+        """
+        items = self.console_get_input(input)
+        if isinstance(items, ResultSet) and not ordered:
+            yield from items.id_batches(size)
+            return
+
+        ids = []
+        for item in items:
+            ids.append(item if isinstance(item, int) else item['id'])
+            if len(ids) >= size:
+                yield ids
+                ids = []
+        if ids:
+            yield ids
 
-    def console_db_get_results(self, query):
-        """execute a query in the database and returns it
+
+    def console_db_get_results(self, query, params=()):
+        """execute a query in the database and returns it. Results of the
+        queries are cached until the data changes
 
         Args:
             query (str): sql valid query
+            params (tuple / dict): the parameters of the query
 
         Returns:
-            list: a list of dicts with the results
+            tuple: read only rows, accessed as row['field'] (dict(row) to get a dict)
         """
 
-        cursor = self.db.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        rows = list(map(lambda x: dict(x), rows))
-        cursor.close()
-        return rows
+        return self.helper.result_cache.execute(query, params)
 
     def console_db_get_fields(self):
         """return the column names of the SONGS table
@@ -124,7 +167,7 @@ class ConsoleHelper(code.InteractiveConsole):
             list: a list of strings with the fields
         """
 
-        cursor = self.db.cursor()
+        cursor = self.helper.db.cursor()
         cursor.execute("PRAGMA table_info(songs)");
         rows = cursor.fetchall()
         fields = []
@@ -139,32 +182,94 @@ class ConsoleHelper(code.InteractiveConsole):
 
 
     def console_db_set_field(self, input, field, value):
-        """Update the song configuration changing a existing given attribute
+        """Update the song configuration changing a existing given attribute.
+        The old values are kept in the history (see history() and rollback())
 
         Args:
             input (str): the name of the field (see fields() for the list of the available fields)
             field (str): the value of the name (e.g. input=genre, field="Rock")
             value (str): the new value for the input (e.g. value="Pop")
+
+        Returns:
+            int: the id of the batch of changes
         """
         
-        items = self.console_get_input(input)
-
-        cursor = self.db.cursor()
-        for i in items:
-            cursor.execute("update songs set %s=? where id=?" % field, [value,i['id']])
-            # save file
-            cursor.execute("select * from songs where id = ?", [i['id']])
-            song = cursor.fetchone()
-            if not song:
-                print("warning, can't update song %s (%s:%s)" % (i['id'], field, value))
-                continue
-            self.helper.update_song_file(i['dirname'],field=field, value=value)
+        history = self.helper.history
+        batch_id = history.begin("set %s=%s" % (field, value))
+        cursor = self.helper.db.cursor()
+        # ids are pulled by id ranges, so updating the rows doesn't affect the query
+        for ids in self.get_id_batches(input, ordered=False):
+            cursor.execute("select * from songs where id in (%s)" % ",".join("?" * len(ids)), ids)
+            songs = dict((song['id'], song) for song in cursor.fetchall())
+            changes = []
+            for id in ids:
+                song = songs.get(id)
+                if not song:
+                    print("warning, can't update song %s (%s:%s)" % (id, field, value))
+                    continue
+                changes.append((song, field, value))
+            history.apply(batch_id, changes)
         cursor.close()
+        # the batch, if no song was changed
+        self.helper.db.commit()
+        return batch_id
+
+    def console_history(self, batch_id=None, limit=20):
+        """show the last batches of changes done with set(), or the changes of a batch
+
+        Args:
+            batch_id (int, optional): show the changes of this batch. Defaults to None.
+            limit (int, optional): number of batches. Defaults to 20.
+
+        Returns:
+            list: list of dicts with the batches or the changes
+        """
+        if batch_id is not None:
+            return self.helper.history.changes(batch_id)
+        return self.helper.history.batches(limit)
+
+    def console_rollback(self, batch_id=None, force=False):
+        """undo a batch of set() changes: the old values are restored in the
+        database and in the files of the affected songs
+
+        Args:
+            batch_id (int, optional): the batch (see history()). Defaults to None (the last one).
+            force (bool, optional): also restore the fields changed again after the batch. Defaults to False.
+
+        Returns:
+            int: the id of the rollback batch (it can be rolled back too)
+        """
+        return self.helper.history.rollback(batch_id, force)
+
+    def console_regenerate_headers(self, batch_id=None):
+        """write again the fields changed by a batch into the song files, from the database
+
+        Args:
+            batch_id (int, optional): the batch (see history()). Defaults to None (the last one).
+
+        Returns:
+            int: number of songs written
+        """
+        return self.helper.history.regenerate(batch_id)
 
     def console_db_refresh_db(self):
         """Reloads the database from songs files"""
         self.helper.refresh_db()
 
+    def console_restore_backup(self, dry_run=True, delete_backup=False):
+        """restores the song files from the backups manifest (only the files
+        changed since the backup). Use dry_run=False to really restore them,
+        and refresh_db() after it.
+
+        Args:
+            dry_run (bool, optional): only show the files that would be restored. Defaults to True.
+            delete_backup (bool, optional): delete the backup files. Defaults to False.
+
+        Returns:
+            dict: count of files by status (restored, unchanged, missing)
+        """
+        return self.helper.restore_backup(delete_backup=delete_backup, dry_run=dry_run)
+
     def console_create_playlist(self, input, name):
         """creates a new playlist file with the selection as input (list of songs or sql query)
 
@@ -172,23 +277,175 @@ class ConsoleHelper(code.InteractiveConsole):
             input (str/list): sql query or list of songs dicts
             name (str): name of the playlist (valid filename)
         """
-        items = self.console_get_input(input)
-        cursor = self.db.cursor()
+        # resolve the ids with one query per batch, keeping the order
         songs = []
-        for i in items:
-            cursor.execute("select * from songs where id = ?", [i['id']])
-            song = cursor.fetchone()
-            songs.append({'artist': song['artist'], 'title': song['title']})
+        cursor = self.helper.db.cursor()
+        for ids in self.get_id_batches(input, ordered=True):
+            cursor.execute("select id, artist, title from songs where id in (%s)" % ",".join("?" * len(ids)), ids)
+            found = dict((song['id'], {'artist': song['artist'], 'title': song['title']}) for song in cursor.fetchall())
+            songs += [ found[id] for id in ids if id in found ]
+        cursor.close()
+
         self.helper.store_playlist(songs, name)
 
-    
+    def console_generate_playlist(self, name, duration=3600, max_per_artist=2, genres=None,
+                                  languages=None, duets=None, years=None, year_spread=True,
+                                  exclude_recent=None, where=None, seed=None):
+        """generates a playlist from the songs database with the given constraints,
+        and stores it (songs are logged as played, see exclude_recent)
+
+        Args:
+            name (str): name of the playlist (valid filename)
+            duration (float): target duration in seconds (e.g. 3600)
+            max_per_artist (int): max songs of the same artist
+            genres (dict): genre mix (e.g. {"Pop": 0.5, "Rock": 0.25})
+            languages (dict): language mix (e.g. {"Spanish": 0.5, "English": 0.5})
+            duets (float): ratio of duets (e.g. 0.2)
+            years (tuple): (min, max) years
+            year_spread (bool): spread the songs over the decades
+            exclude_recent (float): exclude songs played in the last days
+            where (str): extra sql condition (e.g. "edition like 'SingStar%'")
+            seed (int): random seed to get the same playlist
+
+        Returns:
+            list: the songs of the playlist (dicts)
+        """
+        generator = PlaylistGenerator(self.helper)
+        songs = generator.generate(duration=duration, max_per_artist=max_per_artist,
+                                   genres=genres, languages=languages, duets=duets,
+                                   years=years, year_spread=year_spread,
+                                   exclude_recent=exclude_recent, where=where, seed=seed)
+        if not songs:
+            print("no songs match the constraints")
+            return []
+
+        self.helper.store_playlist([ song._asdict() for song in songs ], name)
+        generator.log_played(songs, name)
+        total = sum(song.duration for song in songs)
+        print("Playlist %s: %d songs, %s" % (name, len(songs), Helper.seconds_to_str(total, trim=True)))
+        return [ song._asdict() for song in songs ]
+
+    def console_export_playlists(self, queries, formats=None, outdir=None):
+        """exports many playlists at once, resolving all the songs in one pass
+
+        Args:
+            queries (dict): name -> sql query returning the id column, or list of songs
+            formats (list): any of "upl", "m3u8", "json" (default ["upl"])
+            outdir (str): directory for the m3u8 and json files (default export_dir)
+
+        Returns:
+            list: the files written
+        """
+        return PlaylistExporter(self.helper).export(queries, formats=formats, outdir=outdir)
+
+    def console_facets(self, genre=None, edition=None, language=None, year=None,
+                       multi=None, duration=None, decade=None):
+        """count the songs matching the filters, and the songs per genre, edition,
+        language, decade and duet inside them (cached until the data changes)
+
+        Args:
+            genre (str/list): genre(s) (e.g. "Pop" or ["Pop","Rock"])
+            edition (str/list): edition(s)
+            language (str/list): language(s), any variant (e.g. "Español")
+            year (tuple): (min, max) year, None for open ends
+            multi (bool): only duets (True) or only singles (False)
+            duration (tuple): (min, max) duration in seconds
+            decade (int/list): decade(s) (e.g. 1980)
+
+        Returns:
+            dict: { 'count': songs, 'facets': { facet: [ { id, name, songs } ] } }
+        """
+        return self.helper.facets.query(genre=genre, edition=edition, language=language,
+                                        year=year, multi=multi, duration=duration,
+                                        decade=decade)
+
+    def console_similar(self, id, k=10):
+        """the k songs most similar to a song (year, bpm, duration, genre, edition,
+        language, duets and notes). The index is built the first time (needs numpy)
+
+        Args:
+            id (int): the song id
+            k (int, optional): number of songs. Defaults to 10.
+
+        Returns:
+            list: list of (similarity, id, artist, title)
+        """
+        # the index of the current data
+        self.helper.similarity.refresh()
+        return [ (song['similarity'], song['id'], song['artist'], song['title'])
+                 for song in self.helper.similarity.similar_songs(id, k) ]
+
+    def console_limits(self, budget=None, read_only=None, indicator=None):
+        """show or change the limits of the queries of get(): a query longer than
+        the budget (or ctrl+c) is stopped and the console can be used again
+
+        Args:
+            budget (float, optional): max seconds of a query, 0 for no limit
+            read_only (bool, optional): the queries can't change the data
+            indicator (float, optional): show the elapsed time and rows of the queries longer than this, 0 to never show it
+
+        Returns:
+            dict: the current limits
+        """
+        guard = self.helper.query_guard
+        if budget is not None:
+            guard.budget = budget
+        if read_only is not None:
+            guard.read_only = read_only
+        if indicator is not None:
+            guard.indicator = indicator
+        return guard.settings()
+
+    def console_scrub(self, limit=100):
+        """check the songs not checked in the last scrub_interval days (the oldest
+        first): mp3 frames, cover, video and song file header against the database
+
+        Args:
+            limit (int, optional): max songs to check. Defaults to 100.
+
+        Returns:
+            int: number of songs checked (see integrity())
+        """
+        return self.helper.scrubber.run(limit)
+
+    def console_integrity(self, status="fail", limit=None):
+        """the songs with problems found by scrub() (or the background scrubber)
+
+        Args:
+            status (str, optional): "fail", "ok" or None for all. Defaults to "fail".
+            limit (int, optional): max songs. Defaults to None (all).
+
+        Returns:
+            list: list of (id, artist, title, checked_at, problems)
+        """
+        report = self.helper.scrubber.report(status, limit)
+        return [ (item['id'], item['artist'], item['title'], item['checked_at'], "; ".join(item['problems']))
+                 for item in report['items'] ]
+
+    def console_cache_stats(self):
+        """return the statistics of the query result cache and the facets cache
+
+        Returns:
+            dict: entries, size, hits, misses... of each cache
+        """
+        return { 'results': self.helper.result_cache.stats(),
+                 'facets': self.helper.facets.stats() }
+
+    def console_slow_queries(self):
+        """return the queries slower than the slow_query_ms threshold (last 100)
+
+        Returns:
+            list: a list of dicts with timestamp, ms, sql and params
+        """
+        return list(self.helper.metrics.slow_queries)
+
     def console_get_db(self):
         """Returns the database connection
 
         Returns:
             sqlconn: the database connection
         """
-        return self.db
+        return self.helper.db
 
     def console_get_LANGUAGES(self):
         """get the available language list
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# dimensions.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# lookup tables for genre, edition and language. The variants of a value
+# (english / spanish names, case, accents) are folded to a canonical one
+# using the literals, and the songs per value are precomputed.
+#
+# ############################################################################
+
+import sys
+sys.path.append('..')
+
+from ultrastar.literals import *
+from ultrastar.helper import Helper
+
+
+class Dimensions:
+
+    # dimension -> table with the values
+    TABLES = { 'genre': 'genres', 'edition': 'editions', 'language': 'languages' }
+
+    SQL_VALUES = """
+        create table %s(
+            id integer primary key AUTOINCREMENT,
+            name text not null unique,
+            canonical integer not null default 0,
+            songs integer not null default 0
+        );
+        """
+
+    SQL_ALIASES = """
+        create table aliases(
+            dimension text not null,
+            alias text not null,
+            value_id integer not null,
+            primary key(dimension, alias)
+        );
+        """
+
+    SQL_VIEW = """
+        create view songs_canonical as
+            select songs.*, genres.name as genre_name, editions.name as edition_name,
+                   languages.name as language_name
+            from songs
+            left join genres on genres.id = songs.genre_id
+            left join editions on editions.id = songs.edition_id
+            left join languages on languages.id = songs.language_id;
+        """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.aliases = {}  # dimension -> { normalized alias: value id }
+
+    @staticmethod
+    def canonical_values():
+        """the canonical values of each dimension, with their aliases
+
+        Returns:
+            dict: dimension -> list of (canonical name, [aliases])
+        """
+        languages = []
+        for en, es in zip(LANGUAGES['en'], LANGUAGES['es']):
+            languages.append((en, [ en, es ]))
+
+        return {
+            'genre': [ (genre, [ genre ]) for genre in GENRES ],
+            'edition': [ (edition, [ edition ]) for edition in EDITIONS ],
+            'language': languages,
+        }
+
+    def drop_tables(self, cursor):
+        cursor.execute("drop view if exists songs_canonical;")
+        cursor.execute("drop table if exists aliases;")
+        for table in Dimensions.TABLES.values():
+            cursor.execute("drop table if exists %s;" % table)
+
+    def create_tables(self, cursor):
+        """create and seed the dimension tables with the canonical values.
+        The songs table must exist (for the view)
+        """
+        for table in Dimensions.TABLES.values():
+            cursor.execute(Dimensions.SQL_VALUES % table)
+        cursor.execute(Dimensions.SQL_ALIASES)
+        cursor.execute(Dimensions.SQL_VIEW)
+
+        for dimension, values in Dimensions.canonical_values().items():
+            table = Dimensions.TABLES[dimension]
+            for name, aliases in values:
+                cursor.execute("insert or ignore into %s(name, canonical) values (?, 1)" % table, (name,))
+                cursor.execute("select id from %s where name=?" % table, (name,))
+                value_id = cursor.fetchone()[0]
+                for alias in aliases:
+                    cursor.execute("insert or ignore into aliases(dimension, alias, value_id) values (?, ?, ?)",
+                                   (dimension, Helper.normalize(alias), value_id))
+        self.aliases = {}
+
+    def create_indexes(self, cursor):
+        for dimension in Dimensions.TABLES.keys():
+            cursor.execute("create index if not exists songs_%s_id on songs(%s_id);" % (dimension, dimension))
+
+    def load(self):
+        """load the alias map from the database"""
+        self.aliases = dict((dimension, {}) for dimension in Dimensions.TABLES.keys())
+        cursor = self.db.cursor()
+        cursor.execute("select dimension, alias, value_id from aliases")
+        for row in cursor.fetchall():
+            self.aliases[row[0]][row[1]] = row[2]
+        cursor.close()
+
+    def resolve(self, dimension, value):
+        """get the id of the canonical value of a dimension. Unknown values are
+        added to the dimension table
+
+        Args:
+            dimension (str): genre, edition or language
+            value (str): the value (any of its variants)
+
+        Returns:
+            int: the id of the value
+        """
+        if not self.aliases:
+            self.load()
+
+        alias = Helper.normalize(value)
+        value_id = self.aliases[dimension].get(alias)
+        if value_id is not None:
+            return value_id
+
+        table = Dimensions.TABLES[dimension]
+        cursor = self.db.cursor()
+        cursor.execute("insert or ignore into %s(name) values (?)" % table, (str(value).strip(),))
+        cursor.execute("select id from %s where name=?" % table, (str(value).strip(),))
+        value_id = cursor.fetchone()[0]
+        cursor.execute("insert or ignore into aliases(dimension, alias, value_id) values (?, ?, ?)",
+                       (dimension, alias, value_id))
+        cursor.close()
+        self.aliases[dimension][alias] = value_id
+        return value_id
+
+    def lookup(self, dimension, value):
+        """get the id of the canonical value of a dimension, without adding it
+
+        Args:
+            dimension (str): genre, edition or language
+            value (str): the value (any of its variants)
+
+        Returns:
+            int: the id of the value, or None if unknown
+        """
+        if not self.aliases:
+            self.load()
+        return self.aliases[dimension].get(Helper.normalize(value))
+
+    def resolve_songs(self, dimension=None):
+        """fill the <dimension>_id column of the songs from the text column
+
+        Args:
+            dimension (str, optional): the dimension to fill. Defaults to None (all).
+        """
+        dimensions = [ dimension ] if dimension else Dimensions.TABLES.keys()
+        cursor = self.db.cursor()
+        for dimension in dimensions:
+            cursor.execute("select distinct %s from songs" % dimension)
+            for row in cursor.fetchall():
+                cursor.execute("update songs set %s_id=? where %s=?" % (dimension, dimension),
+                               (self.resolve(dimension, row[0]), row[0]))
+        cursor.close()
+
+    def update_counts(self, dimension=None, ids=None):
+        """precompute the number of songs of each value
+
+        Args:
+            dimension (str, optional): the dimension to update. Defaults to None (all).
+            ids (list, optional): the values to update. Defaults to None (all).
+        """
+        dimensions = [ dimension ] if dimension else Dimensions.TABLES.keys()
+        cursor = self.db.cursor()
+        for dimension in dimensions:
+            table = Dimensions.TABLES[dimension]
+            sql = "update %s set songs = (select count(*) from songs where songs.%s_id = %s.id)" % (table, dimension, table)
+            if ids is None:
+                cursor.execute(sql)
+            else:
+                ids = list(ids)
+                cursor.execute("%s where id in (%s)" % (sql, ",".join("?" * len(ids))), ids)
+        cursor.close()
+
+    def get_counts(self, dimension, all_values=False):
+        """the precomputed number of songs of each value of a dimension
+
+        Args:
+            dimension (str): genre, edition or language
+            all_values (bool, optional): include the values without songs. Defaults to False.
+
+        Returns:
+            list: list of dicts (id, name, songs) sorted by songs
+        """
+        cursor = self.db.cursor()
+        cursor.execute("select id, name, songs from %s %s order by songs desc, name" %
+                       (Dimensions.TABLES[dimension], "" if all_values else "where songs > 0"))
+        rows = list(map(lambda x: dict(x), cursor.fetchall()))
+        cursor.close()
+        return rows
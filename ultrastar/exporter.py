@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# exporter.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# exports many playlists at once (ultrastar .upl, m3u8 and json). All the
+# songs are resolved with a single join against the union of the queries,
+# and the files are written concurrently with atomic renames.
+#
+# ############################################################################
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import sys
+sys.path.append('..')
+
+from ultrastar.helper import Helper
+
+
+class PlaylistExporter:
+
+    FORMATS = [ 'upl', 'm3u8', 'json' ]
+
+    def __init__(self, helper):
+        self.helper = helper
+        self.config = helper.config
+        self.verbose = helper.verbose or 0
+
+    @staticmethod
+    def filename(name):
+        "the playlist name as a file name"
+        for c in [ os.path.sep, '/', '\\', ':' ]:
+            name = name.replace(c, '_')
+        return name
+
+    # playlists resolved by each query (sqlite allows 500 terms in a compound select)
+    CHUNK = 200
+
+    def resolve(self, queries):
+        """get the songs of all the playlists, with a join of the songs and
+        the union of the queries (a read only query: no temp tables, so no
+        transaction is left open on the shared connection)
+
+        Args:
+            queries (dict): name -> sql query (must return the id column) or list of ids / song dicts
+
+        Returns:
+            dict: name -> list of song dicts, in the order of the query
+        """
+        playlists = dict((name, []) for name in queries.keys())
+        cursor = self.helper.db.cursor()
+        items = list(queries.items())
+        for i in range(0, len(items), PlaylistExporter.CHUNK):
+            selects = []
+            params = []
+            for name, query in items[i:i + PlaylistExporter.CHUNK]:
+                if isinstance(query, str):
+                    selects.append("select ? as name, row_number() over () as pos, id as song_id from (%s)" % query)
+                    params.append(name)
+                else:
+                    ids = [ item['id'] if not isinstance(item, int) else item for item in query ]
+                    selects.append("select ?, key, value from json_each(?)")
+                    params += [ name, json.dumps(ids) ]
+
+            cursor.execute("""
+                select e.name, s.id, s.artist, s.title, s.duration, s.dirname, s.mp3, s.year,
+                       s.genre, s.edition, s.language, s.multi
+                from (%s) e join songs s on s.id = e.song_id
+                order by e.name, e.pos""" % " union all ".join(selects), params)
+            for row in cursor.fetchall():
+                song = dict(row)
+                playlists[song.pop('name')].append(song)
+
+        cursor.close()
+        return playlists
+
+    def render_upl(self, name, songs):
+        text = [ '#Name: %s' % name, '#Songs:' ]
+        for song in songs:
+            text.append("%s : %s" % (song['artist'], song['title']))
+        return "\n".join(text)
+
+    def render_m3u8(self, name, songs):
+        text = [ '#EXTM3U', '#PLAYLIST:%s' % name ]
+        for song in songs:
+            text.append("#EXTINF:%d,%s - %s" % (round(song['duration'] or 0), song['artist'], song['title']))
+            text.append(os.path.sep.join([song['dirname'], song['mp3']]))
+        return "\n".join(text) + "\n"
+
+    def render_json(self, name, songs):
+        return json.dumps({ 'name': name, 'songs': songs }, indent=2, ensure_ascii=False)
+
+    def upl_file(self, name):
+        return os.path.sep.join([self.config.full_playlist_dir, "%s.upl" % PlaylistExporter.filename(name)])
+
+    def write(self, name, songs, fmt, outdir):
+        "write a file (runs in the thread pool: no database access)"
+        filename = PlaylistExporter.filename(name)
+        if fmt == 'upl':
+            fname = self.upl_file(name)
+            Helper.atomic_write(fname, self.render_upl(name, songs), self.config.encoding)
+        else:
+            fname = os.path.sep.join([outdir, "%s.%s" % (filename, fmt)])
+            render = self.render_m3u8 if fmt == 'm3u8' else self.render_json
+            Helper.atomic_write(fname, render(name, songs), "utf-8")
+        return fname
+
+    def export(self, queries, formats=None, outdir=None, workers=8):
+        """export many playlists at once
+
+        Args:
+            queries (dict): name -> sql query (must return the id column) or list of ids / song dicts
+            formats (list, optional): any of upl, m3u8, json. Defaults to [ 'upl' ].
+            outdir (str, optional): directory for the m3u8 and json files. Defaults to config.export_dir.
+            workers (int, optional): threads writing files. Defaults to 8.
+
+        Returns:
+            list: the files written
+        """
+        formats = formats or [ 'upl' ]
+        for fmt in formats:
+            if fmt not in PlaylistExporter.FORMATS:
+                raise ValueError("unknown format %s (valid: %s)" % (fmt, ", ".join(PlaylistExporter.FORMATS)))
+
+        outdir = outdir or self.config.export_dir
+        if any(fmt != 'upl' for fmt in formats):
+            os.makedirs(outdir, exist_ok=True)
+
+        playlists = self.resolve(queries)
+        if 'upl' in formats:
+            # the backups are stored in the manifest from this thread, in one transaction
+            for name in playlists.keys():
+                self.helper.do_backup(self.upl_file(name))
+            self.helper.db.commit()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [ executor.submit(self.write, name, songs, fmt, outdir)
+                        for name, songs in playlists.items() for fmt in formats ]
+            files = [ future.result() for future in futures ]
+
+        if self.verbose > 1:
+            print("%d playlists exported (%d files)" % (len(playlists), len(files)))
+        return files
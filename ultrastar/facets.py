@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# facets.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# faceted browse of the songs: filter by genre, edition, language, year,
+# decade, duet and duration, and get the count of songs of each facet
+# value inside the selection. Results are cached until the data changes.
+#
+# ############################################################################
+
+import threading
+from collections import OrderedDict
+
+import sys
+sys.path.append('..')
+
+from ultrastar.dimensions import Dimensions
+
+
+class FacetBrowser:
+
+    # filters accepted by query(): dimensions take a list of values,
+    # ranges a (min, max) tuple (None for open ends)
+    DIMENSIONS = [ 'genre', 'edition', 'language' ]
+    RANGES = { 'year': 'year', 'duration': 'duration' }
+
+    def __init__(self, helper, max_entries=1024):
+        self.helper = helper
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.cache_version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def as_list(value):
+        if value is None or value == "" or value == []:
+            return []
+        if isinstance(value, (list, tuple, set)):
+            return list(value)
+        return [ value ]
+
+    def normalize_filters(self, filters):
+        """convert the filters to a hashable, canonical form
+
+        Args:
+            filters (dict): genre, edition, language, decade (value or list),
+                            year, duration ((min, max)), multi (bool)
+
+        Returns:
+            tuple: the canonical filters
+        """
+        key = []
+        for dimension in FacetBrowser.DIMENSIONS:
+            values = FacetBrowser.as_list(filters.get(dimension))
+            ids = set()
+            for value in values:
+                value_id = value if isinstance(value, int) else self.helper.dimensions.lookup(dimension, value)
+                ids.add(-1 if value_id is None else value_id)  # unknown value: match nothing
+            key.append((dimension, tuple(sorted(ids))))
+
+        for name in FacetBrowser.RANGES.keys():
+            value = filters.get(name)
+            if value is None or value == "":
+                value = (None, None)
+            elif not isinstance(value, (list, tuple)):
+                value = (value, value)
+            low, high = value
+            key.append((name, (None if low in (None, "") else float(low),
+                               None if high in (None, "") else float(high))))
+
+        decades = tuple(sorted(set(int(x) // 10 * 10 for x in FacetBrowser.as_list(filters.get('decade')))))
+        key.append(('decade', decades))
+
+        multi = filters.get('multi')
+        if multi is not None and multi != "":
+            multi = 1 if str(multi).lower() in ("1", "true", "yes", "on") else 0
+        else:
+            multi = None
+        key.append(('multi', multi))
+        return tuple(key)
+
+    @staticmethod
+    def where(key):
+        """build the where clause for the canonical filters
+
+        Returns:
+            tuple: (sql, params)
+        """
+        clauses = []
+        params = []
+        for name, value in key:
+            if name in FacetBrowser.DIMENSIONS and value:
+                clauses.append("%s_id in (%s)" % (name, ",".join("?" * len(value))))
+                params += value
+            elif name in FacetBrowser.RANGES:
+                low, high = value
+                column = FacetBrowser.RANGES[name]
+                if low is not None:
+                    clauses.append("%s >= ?" % column)
+                    params.append(low)
+                if high is not None:
+                    clauses.append("%s <= ?" % column)
+                    params.append(high)
+            elif name == 'decade' and value:
+                clauses.append("(year / 10) * 10 in (%s)" % ",".join("?" * len(value)))
+                params += value
+            elif name == 'multi' and value is not None:
+                clauses.append("multi = ?")
+                params.append(value)
+
+        if not clauses:
+            return "", params
+        return "where %s" % " and ".join(clauses), params
+
+    def compute(self, key):
+        where, params = FacetBrowser.where(key)
+        cursor = self.helper.db.cursor()
+        result = { 'count': 0, 'facets': {} }
+
+        cursor.execute("select count(*) from songs %s" % where, params)
+        result['count'] = cursor.fetchone()[0]
+
+        for dimension in FacetBrowser.DIMENSIONS:
+            if not where:
+                # no filters: use the precomputed counts
+                result['facets'][dimension] = self.helper.dimensions.get_counts(dimension)
+                continue
+            table = Dimensions.TABLES[dimension]
+            cursor.execute("""
+                select %s.id, %s.name, facet.songs from
+                    (select %s_id as id, count(*) as songs from songs %s group by %s_id) as facet
+                    join %s on %s.id = facet.id order by facet.songs desc, %s.name
+                """ % (table, table, dimension, where, dimension, table, table, table), params)
+            result['facets'][dimension] = list(map(lambda x: dict(x), cursor.fetchall()))
+
+        cursor.execute("""
+            select (year / 10) * 10 as decade, count(*) as songs from songs %s
+            group by decade order by decade""" % where, params)
+        result['facets']['decade'] = list(map(lambda x: dict(x), cursor.fetchall()))
+
+        cursor.execute("select multi, count(*) as songs from songs %s group by multi order by multi" % where, params)
+        result['facets']['multi'] = list(map(lambda x: dict(x), cursor.fetchall()))
+
+        cursor.close()
+        return result
+
+    def query(self, **filters):
+        """count the songs matching the filters, and the songs of each facet value inside them
+
+        Args:
+            filters: genre, edition, language, decade (value or list),
+                     year, duration ((min, max)), multi (bool)
+
+        Returns:
+            dict: { 'count': songs, 'facets': { facet: [ { id, name, songs } ] } }
+        """
+        version = self.helper.get_data_version()
+        key = self.normalize_filters(filters)
+
+        with self.lock:
+            if version != self.cache_version:
+                self.cache.clear()
+                self.cache_version = version
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+        if result is not None:
+            self.helper.metrics.cache_hit("facets")
+            return result
+
+        self.helper.metrics.cache_miss("facets")
+        result = self.compute(key)
+        with self.lock:
+            self.misses += 1
+            if version == self.cache_version:
+                self.cache[key] = result
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.cache),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0,
+            }
+
+    def invalidate(self):
+        with self.lock:
+            self.cache.clear()
+            self.cache_version = None
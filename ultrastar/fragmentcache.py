@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# fragmentcache.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# LRU cache for the rendered html of the cards of the web pages (artists,
+# playlists). Each fragment is keyed by its template and the values it is
+# rendered from, so a page only renders the cards whose data changed.
+#
+# ############################################################################
+
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    def __init__(self, helper, max_entries=4096):
+        self.helper = helper
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (template, version) -> html
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def version(value):
+        "a hashable copy of the values a fragment is rendered from"
+        if isinstance(value, dict):
+            return tuple((key, FragmentCache.version(value[key])) for key in sorted(value.keys()))
+        if isinstance(value, (list, tuple)):
+            return tuple(FragmentCache.version(x) for x in value)
+        return value
+
+    def render(self, template, version, render):
+        """the html of a fragment, rendered only if it is not in the cache
+
+        Args:
+            template (str): the template of the fragment
+            version (hashable): the values the fragment depends on (see version())
+            render (callable): renders the fragment
+
+        Returns:
+            str: the html
+        """
+        key = (template, version)
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if html is not None:
+            self.helper.metrics.cache_hit("fragments")
+            return html
+
+        self.helper.metrics.cache_miss("fragments")
+        html = render()
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = html
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return html
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """the cache statistics
+
+        Returns:
+            dict: entries, max_entries, hits, misses, hit_ratio, evictions
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0,
+                'evictions': self.evictions,
+            }
@@ -11,7 +11,9 @@
 
 import os
 import shutil
+import threading
 import datetime
+import unicodedata
 
 
 class Helper:
@@ -32,6 +34,22 @@ class Helper:
             s = s.split(".")[0]
         return s
 
+    @staticmethod
+    def normalize(s):
+        """normalize a string to compare it: no accents, casefolded and single spaced
+
+        Args:
+            s (str): the string
+
+        Returns:
+            str: the normalized string
+        """
+        if s is None:
+            return ""
+        s = unicodedata.normalize("NFKD", str(s))
+        s = "".join(c for c in s if not unicodedata.combining(c))
+        return " ".join(s.casefold().split())
+
     @staticmethod
     def do_backup(filename, ext="bak"):
         """copy filename to filename.bak if backup doesn't exists
@@ -42,4 +60,23 @@ class Helper:
         """
         bckfile = "%s.%s" % (filename, ext)
         if os.path.exists(filename) and not os.path.exists(bckfile):
-            shutil.copy2(filename, bckfile)
\ No newline at end of file
+            shutil.copy2(filename, bckfile)
+
+    @staticmethod
+    def atomic_write(filename, data, encoding="utf-8"):
+        """write the file in a temporary one and rename it, so readers never
+        see a partial file
+
+        Args:
+            filename (str): the file to write
+            data (str): the contents
+            encoding (str, optional): the encoding of the file. Defaults to "utf-8".
+        """
+        tmpfile = "%s.%d-%d.tmp" % (filename, os.getpid(), threading.get_ident())
+        try:
+            with open(tmpfile, 'w', encoding=encoding) as f:
+                f.write(data)
+            os.replace(tmpfile, filename)
+        finally:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
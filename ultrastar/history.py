@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# history.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# history of the changes done to the song metadata: each set() is a batch,
+# and each changed field of each song is stored with its old and new value.
+# A batch can be rolled back (database and song files of the affected songs
+# only), and the song file headers can be written again from the database.
+#
+# ############################################################################
+
+import datetime
+
+import sys
+sys.path.append('..')
+
+from ultrastar.helper import Helper
+from ultrastar.dimensions import Dimensions
+
+
+class MetadataHistory:
+
+    # kept between loads: songs are identified by their dirname
+    SQL_HISTORY = [
+        """
+        create table if not exists history_batches(
+            id integer primary key AUTOINCREMENT,
+            description text not null,
+            created_at timestamp not null,
+            rolled_back_by integer
+        );
+        """,
+        """
+        create table if not exists history(
+            id integer primary key AUTOINCREMENT,
+            batch_id integer not null,
+            dirname text not null,
+            field text not null,
+            old_value text,
+            new_value text,
+            changed_at timestamp not null,
+            FOREIGN key(batch_id) references history_batches(id)
+        );
+        """,
+        "create index if not exists history_batch_id on history(batch_id);"
+    ]
+
+    def __init__(self, helper):
+        self.helper = helper
+        self.verbose = helper.verbose or 0
+
+    def create_tables(self, cursor):
+        for sql_sentence in MetadataHistory.SQL_HISTORY:
+            cursor.execute(sql_sentence)
+
+    def begin(self, description):
+        """start a batch of changes
+
+        Args:
+            description (str): what the batch does
+
+        Returns:
+            int: the batch id
+        """
+        cursor = self.helper.db.cursor()
+        self.create_tables(cursor)
+        cursor.execute("insert into history_batches(description, created_at) values (?, ?)",
+                       (description, datetime.datetime.now().isoformat(" ")))
+        batch_id = cursor.lastrowid
+        cursor.close()
+        return batch_id
+
+    def apply(self, batch_id, changes):
+        """change the songs in the database and in their files, keeping the
+        old values in the history, and update the aggregates that depend on
+        them. All in one transaction: if something fails, the database is
+        rolled back and the files already written get their old values again.
+        The files are not backed up (the history has the old values)
+
+        Args:
+            batch_id (int): the batch (see begin())
+            changes (list): list of (song row, field, new value)
+        """
+        artists = set()
+        dimension_ids = dict((dimension, set()) for dimension in Dimensions.TABLES.keys())
+        fields = set()
+        now = datetime.datetime.now().isoformat(" ")
+        written = []
+
+        cursor = self.helper.db.cursor()
+        try:
+            for song, field, value in changes:
+                id = song['id']
+                artists.add(song['artist_norm'])
+                fields.add(field)
+                cursor.execute("update songs set %s=? where id=?" % field, [value, id])
+                if field == 'artist':
+                    cursor.execute("update songs set artist_norm=? where id=?", [Helper.normalize(value), id])
+                    artists.add(Helper.normalize(value))
+                if field in Dimensions.TABLES:
+                    value_id = self.helper.dimensions.resolve(field, value)
+                    cursor.execute("update songs set %s_id=? where id=?" % field, [value_id, id])
+                    dimension_ids[field].update([ song['%s_id' % field], value_id ])
+                # the value as stored (e.g. '120' is 120.0 in a real column), so
+                # rollback() can tell if it was changed after the batch
+                cursor.execute("select %s from songs where id=?" % field, [id])
+                stored = cursor.fetchone()[0]
+                cursor.execute("""insert into history(batch_id, dirname, field, old_value, new_value, changed_at)
+                                  values (?, ?, ?, ?, ?, ?)""",
+                               (batch_id, song['dirname'], field, song[field], stored, now))
+                # save file
+                written.append((song['dirname'], field, song[field]))
+                self.helper.update_song_file(song['dirname'], field=field, value=value, backup=False)
+
+            if fields.intersection([ 'artist', 'title' ]):
+                self.helper.songindex.reindex([ song['id'] for song, field, value in changes ])
+            if fields.intersection(self.helper.ARTIST_FIELDS):
+                self.helper.update_artists(artists)
+            for dimension, ids in dimension_ids.items():
+                if ids:
+                    self.helper.dimensions.update_counts(dimension, ids)
+            self.helper.db.commit()
+        except BaseException:
+            self.helper.db.rollback()
+            # the values added to the dimensions were rolled back too
+            self.helper.dimensions.aliases = {}
+            for dirname, field, value in reversed(written):
+                try:
+                    self.helper.update_song_file(dirname, field=field, value=value, backup=False)
+                except OSError as e:
+                    print("warning, can't restore %s of %s (%s)" % (field, dirname, e))
+            raise
+        finally:
+            cursor.close()
+        self.helper.bump_data_version()
+
+    def batches(self, limit=20):
+        """the last batches of changes
+
+        Returns:
+            list: list of dicts (id, description, created_at, rolled_back_by, changes)
+        """
+        cursor = self.helper.db.cursor()
+        self.create_tables(cursor)
+        cursor.execute("""
+            select b.id, b.description, b.created_at, b.rolled_back_by, count(h.id) as changes
+            from history_batches b left join history h on h.batch_id = b.id
+            group by b.id order by b.id desc limit ?""", (limit,))
+        rows = list(map(lambda x: dict(x), cursor.fetchall()))
+        cursor.close()
+        return rows
+
+    def changes(self, batch_id):
+        """the changes of a batch
+
+        Returns:
+            list: list of dicts (dirname, field, old_value, new_value, changed_at)
+        """
+        cursor = self.helper.db.cursor()
+        self.create_tables(cursor)
+        cursor.execute("""select id, dirname, field, old_value, new_value, changed_at
+                          from history where batch_id=? order by id""", (batch_id,))
+        rows = list(map(lambda x: dict(x), cursor.fetchall()))
+        cursor.close()
+        return rows
+
+    def last_batch(self):
+        "the last batch not rolled back, or None"
+        cursor = self.helper.db.cursor()
+        self.create_tables(cursor)
+        cursor.execute("""select id from history_batches where rolled_back_by is null
+                          and description not like 'rollback %' order by id desc limit 1""")
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def songs_by_dirname(self, dirnames):
+        cursor = self.helper.db.cursor()
+        songs = {}
+        dirnames = list(dirnames)
+        for i in range(0, len(dirnames), 500):
+            chunk = dirnames[i:i + 500]
+            cursor.execute("select * from songs where dirname in (%s)" % ",".join("?" * len(chunk)), chunk)
+            songs.update((song['dirname'], song) for song in cursor.fetchall())
+        cursor.close()
+        return songs
+
+    def rollback(self, batch_id=None, force=False):
+        """restore the old values of the changes of a batch, in the database and
+        in the files of the affected songs. The rollback is a new batch.
+
+        Args:
+            batch_id (int, optional): the batch. Defaults to None (the last one).
+            force (bool, optional): also restore the fields changed again after the batch. Defaults to False.
+
+        Returns:
+            int: the id of the rollback batch, or None if nothing was done
+        """
+        batch_id = batch_id or self.last_batch()
+        if batch_id is None:
+            print("there are no changes to roll back")
+            return None
+
+        # the value before the batch is the old value of its first change
+        original = {}
+        for change in self.changes(batch_id):
+            key = (change['dirname'], change['field'])
+            if key not in original:
+                original[key] = change
+
+        songs = self.songs_by_dirname(set(dirname for dirname, field in original.keys()))
+        changes = []
+        for (dirname, field), change in original.items():
+            song = songs.get(dirname)
+            if not song:
+                print("warning, song %s is not in the database, skipped" % dirname)
+                continue
+            if str(song[field]) != str(change['new_value']) and not force:
+                print("warning, %s of %s was changed after batch %d, skipped (use force=True)" % (field, dirname, batch_id))
+                continue
+            changes.append((song, field, change['old_value']))
+
+        if not changes:
+            return None
+
+        rollback_id = self.begin("rollback %d" % batch_id)
+        self.helper.db.execute("update history_batches set rolled_back_by=? where id=?", (rollback_id, batch_id))
+        self.apply(rollback_id, changes)
+        if self.verbose > 0:
+            print("batch %d rolled back (%d changes)" % (batch_id, len(changes)))
+        return rollback_id
+
+    def regenerate(self, batch_id=None):
+        """write again the headers of the song files changed by a batch, from
+        the values in the database (without reading the library)
+
+        Args:
+            batch_id (int, optional): the batch. Defaults to None (the last one).
+
+        Returns:
+            int: number of songs written
+        """
+        batch_id = batch_id or self.last_batch()
+        if batch_id is None:
+            return 0
+
+        fields = {}
+        for change in self.changes(batch_id):
+            fields.setdefault(change['dirname'], set()).add(change['field'])
+
+        songs = self.songs_by_dirname(fields.keys())
+        for dirname, song in songs.items():
+            for field in fields[dirname]:
+                self.helper.update_song_file(dirname, field=field, value=song[field], backup=False)
+        return len(songs)
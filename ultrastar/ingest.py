@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# ingest.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# streaming load of the library: the directory walk, the parse of the song
+# files and the database inserts are chained generators, and the songs are
+# committed in batches, so memory doesn't grow with the library and the
+# songs already inserted can be queried while the load goes on.
+#
+# ############################################################################
+
+import os
+import time
+
+import sys
+sys.path.append('..')
+
+from ultrastar.helper import Helper
+from ultrastar.dimensions import Dimensions
+
+
+class IngestProgress:
+    "counters of a running ingest"
+
+    def __init__(self):
+        self.total = None
+        self.scanned = 0
+        self.parsed = 0
+        self.inserted = 0
+        self.batches = 0
+        self.started = time.time()
+        self.finished = None
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def rate(self):
+        "songs inserted per second"
+        elapsed = self.elapsed()
+        return self.inserted / elapsed if elapsed else 0
+
+    def eta(self):
+        "estimated seconds to finish (None if unknown)"
+        if self.finished:
+            return 0
+        if not self.total or not self.inserted:
+            return None
+        return max(0, self.total - self.inserted) / self.rate()
+
+    def as_dict(self):
+        eta = self.eta()
+        return {
+            'total': self.total,
+            'scanned': self.scanned,
+            'parsed': self.parsed,
+            'inserted': self.inserted,
+            'batches': self.batches,
+            'elapsed': round(self.elapsed(), 3),
+            'rate': round(self.rate(), 1),
+            'eta': None if eta is None else round(eta, 1),
+            'finished': self.finished is not None,
+        }
+
+    def __str__(self):
+        return "scanned %d, parsed %d, inserted %d songs in %.1f s (%.0f songs/s)" % (
+            self.scanned, self.parsed, self.inserted, self.elapsed(), self.rate())
+
+
+class SongIngest:
+    def __init__(self, helper, batch_size=None, progress=None):
+        """
+        Args:
+            helper (UltraStarHelper): the helper (its db is the target)
+            batch_size (int, optional): songs per commit. Defaults to config.ingest_batch.
+            progress (callable, optional): called with the IngestProgress after each commit. Defaults to None.
+        """
+        self.helper = helper
+        self.config = helper.config
+        self.verbose = helper.verbose or 0
+        self.batch_size = batch_size or self.config.ingest_batch
+        self.callback = progress
+        self.progress = IngestProgress()
+
+    def count(self):
+        "number of song dirs (an estimation of the songs, to compute the ETA)"
+        with os.scandir(self.config.full_songs_dir) as entries:
+            return sum(1 for entry in entries if entry.is_dir())
+
+    def scan(self):
+        "stage 1: walk the songs dir, yielding SongInfo"
+        for song in self.helper.iter_songs(self.config.full_songs_dir):
+            self.progress.scanned += 1
+            yield song
+
+    def parse(self, songs):
+        "stage 2: read the config files, yielding SongRecord"
+        for record in self.helper.iter_records(songs):
+            self.progress.parsed += 1
+            yield record
+
+    def batches(self, records):
+        "stage 3: group the records in lists of batch_size"
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write(self, batch):
+        """insert a batch and update the aggregates of its artists and
+        dimension values, then commit so the batch can be queried"""
+        helper = self.helper
+        helper.insert_into_db(batch)
+        helper.update_artists([ Helper.normalize(record.artist) for record in batch ])
+        for dimension in Dimensions.TABLES.keys():
+            ids = set(helper.dimensions.lookup(dimension, getattr(record, dimension)) for record in batch)
+            helper.dimensions.update_counts(dimension, ids)
+        helper.db.commit()
+        helper.bump_data_version()
+
+        self.progress.inserted += len(batch)
+        self.progress.batches += 1
+        if self.verbose > 1:
+            print("ingest: %s" % self.progress)
+        if self.callback:
+            self.callback(self.progress)
+
+    def run(self):
+        """load the library into the helper's db (the tables are created again)
+
+        Returns:
+            IngestProgress: the final counters
+        """
+        helper = self.helper
+        self.progress.total = self.count()
+        if self.callback:
+            self.callback(self.progress)
+        # readers (other connections) don't block the writer, and see each committed batch
+        helper.db.execute("PRAGMA journal_mode=WAL")
+        helper.dimensions.db = helper.db
+        helper.dimensions.aliases = {}
+        helper.create_tables()
+        helper.db.commit()
+        helper.bump_data_version()
+
+        for batch in self.batches(self.parse(self.scan())):
+            self.write(batch)
+
+        self.progress.finished = time.time()
+        if self.verbose > 0:
+            print("ingest done: %s" % self.progress)
+        if self.callback:
+            self.callback(self.progress)
+        return self.progress
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# jobs.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# background jobs (e.g. the refresh of the database from the web): each
+# job runs in its own thread, reports its progress, and only one job of
+# each kind can run at the same time.
+#
+# ############################################################################
+
+import time
+import itertools
+import threading
+import traceback
+from collections import OrderedDict
+
+
+class Job:
+    def __init__(self, id, kind):
+        self.id = id
+        self.kind = kind
+        self.state = "running"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'started': self.started,
+            'finished': self.finished,
+            'elapsed': round((self.finished or time.time()) - self.started, 3),
+        }
+
+
+class JobRunningError(Exception):
+    "a job of the same kind is already running"
+    def __init__(self, job):
+        super().__init__("a %s job is already running (%d)" % (job.kind, job.id))
+        self.job = job
+
+
+class JobManager:
+    def __init__(self, max_jobs=100):
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.running = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def start(self, kind, func):
+        """run func(job) in a new thread. func can update job.progress, and
+        its return value is stored in job.result
+
+        Args:
+            kind (str): the kind of job (one running at a time per kind)
+            func (callable): the work
+
+        Raises:
+            JobRunningError: if a job of that kind is running
+
+        Returns:
+            Job: the job started
+        """
+        with self.lock:
+            current = self.running.get(kind)
+            if current is not None:
+                raise JobRunningError(current)
+            job = Job(next(self.ids), kind)
+            self.running[kind] = job
+            self.jobs[job.id] = job
+            if len(self.jobs) > self.max_jobs:
+                # forget the oldest finished jobs, the running ones are kept
+                finished = [ id for id, old in self.jobs.items() if old.state != "running" ]
+                for id in finished[:len(self.jobs) - self.max_jobs]:
+                    del self.jobs[id]
+
+        def run():
+            try:
+                job.result = func(job)
+                job.state = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.state = "failed"
+                traceback.print_exc()
+            finally:
+                job.finished = time.time()
+                with self.lock:
+                    self.running.pop(kind, None)
+
+        threading.Thread(target=run, name="job-%s-%d" % (kind, job.id), daemon=True).start()
+        return job
+
+    def get(self, id):
+        with self.lock:
+            return self.jobs.get(id)
+
+    def list(self):
+        with self.lock:
+            return list(reversed(self.jobs.values()))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# metrics.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# Request and sql instrumentation: latency histograms, sql time and number
+# of queries per request, response sizes, cache hits and a slow query log.
+# Metrics are rendered in prometheus text format.
+#
+# ############################################################################
+
+import re
+import time
+import sqlite3
+import datetime
+import threading
+from collections import deque
+
+
+class Histogram:
+    "cumulative histogram with labels, prometheus style"
+
+    def __init__(self, name, doc, buckets, label="route"):
+        self.name = name
+        self.doc = doc
+        self.buckets = buckets
+        self.label = label
+        self.values = {}  # label value -> [counts per bucket, sum, count]
+
+    def observe(self, label_value, value):
+        entry = self.values.get(label_value)
+        if entry is None:
+            entry = self.values[label_value] = [ [0] * len(self.buckets), 0, 0 ]
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        lines = [ "# HELP %s %s" % (self.name, self.doc),
+                  "# TYPE %s histogram" % self.name ]
+        for label_value, (counts, total, count) in sorted(self.values.items()):
+            label = '%s="%s"' % (self.label, Metrics.escape(label_value))
+            for bucket, bucket_count in zip(self.buckets, counts):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, bucket, bucket_count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, label, count))
+            lines.append('%s_sum{%s} %s' % (self.name, label, total))
+            lines.append('%s_count{%s} %d' % (self.name, label, count))
+        return lines
+
+
+class Counter:
+    "counter with labels"
+
+    def __init__(self, name, doc, labels):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.values = {}  # tuple of label values -> count
+
+    def inc(self, label_values, value=1):
+        self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def render(self):
+        lines = [ "# HELP %s %s" % (self.name, self.doc),
+                  "# TYPE %s counter" % self.name ]
+        for label_values, count in sorted(self.values.items()):
+            labels = ",".join('%s="%s"' % (k, Metrics.escape(v)) for k, v in zip(self.labels, label_values))
+            lines.append("%s{%s} %s" % (self.name, labels, count))
+        return lines
+
+
+class RequestStats:
+    "accumulates the sql and cache activity of the request being served"
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_time = 0.0
+        self.queries = 0
+        self.cache_hits = 0
+
+
+class Metrics:
+    LATENCY_BUCKETS = [ 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10 ]
+    QUERY_BUCKETS = [ 0, 1, 2, 5, 10, 25, 50, 100, 500, 1000 ]
+    SIZE_BUCKETS = [ 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216 ]
+
+    def __init__(self, slow_query_ms=100, slow_query_log=None, verbose=0):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.verbose = verbose
+        self.slow_queries = deque(maxlen=100)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.request_latency = Histogram("ultrastar_request_duration_seconds",
+                                         "Request latency per route", Metrics.LATENCY_BUCKETS)
+        self.request_sql = Histogram("ultrastar_request_sql_seconds",
+                                     "SQL time spent per request", Metrics.LATENCY_BUCKETS)
+        self.request_queries = Histogram("ultrastar_request_queries",
+                                         "Number of SQL queries per request", Metrics.QUERY_BUCKETS)
+        self.response_size = Histogram("ultrastar_response_size_bytes",
+                                       "Response body size per route", Metrics.SIZE_BUCKETS)
+        self.requests = Counter("ultrastar_requests_total",
+                                "Requests per route and status", [ "route", "status" ])
+        self.cache_hits = Counter("ultrastar_cache_hits_total", "Cache hits per cache", [ "cache" ])
+        self.cache_misses = Counter("ultrastar_cache_misses_total", "Cache misses per cache", [ "cache" ])
+        self.queries = Counter("ultrastar_sql_queries_total", "SQL queries executed", [ "kind" ])
+
+    @staticmethod
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def begin_request(self):
+        """start to account the activity of the current thread's request"""
+        self.local.request = RequestStats()
+
+    def end_request(self, route, status, size):
+        """store the metrics of the current thread's request
+
+        Args:
+            route (str): the route rule (e.g. /img/cover/<id>)
+            status (int): the http status code
+            size (int): the size of the response body
+        """
+        stats = getattr(self.local, "request", None)
+        if stats is None:
+            return
+        self.local.request = None
+        elapsed = time.perf_counter() - stats.start
+
+        with self.lock:
+            self.request_latency.observe(route, elapsed)
+            self.request_sql.observe(route, stats.sql_time)
+            self.request_queries.observe(route, stats.queries)
+            self.response_size.observe(route, size or 0)
+            self.requests.inc((route, str(status)))
+
+    def cache_hit(self, cache):
+        with self.lock:
+            self.cache_hits.inc((cache,))
+        stats = getattr(self.local, "request", None)
+        if stats is not None:
+            stats.cache_hits += 1
+
+    def cache_miss(self, cache):
+        with self.lock:
+            self.cache_misses.inc((cache,))
+
+    def observe_query(self, sql, params, elapsed):
+        """account a sql sentence, and log it if it is slower than the threshold
+
+        Args:
+            sql (str): the sql sentence
+            params (tuple/dict): the parameters of the sentence
+            elapsed (float): seconds spent running it
+        """
+        stats = getattr(self.local, "request", None)
+        if stats is not None:
+            stats.sql_time += elapsed
+            stats.queries += 1
+
+        kind = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else "empty"
+        with self.lock:
+            self.queries.inc((kind,))
+
+        if self.slow_query_ms is not None and elapsed * 1000 >= self.slow_query_ms:
+            self.log_slow_query(sql, params, elapsed)
+
+    def log_slow_query(self, sql, params, elapsed):
+        entry = {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'ms': round(elapsed * 1000, 3),
+            'sql': re.sub(r"\s+", " ", sql).strip(),
+            'params': params,
+        }
+        with self.lock:
+            self.slow_queries.append(entry)
+            if self.slow_query_log:
+                with open(self.slow_query_log, 'a', encoding='utf-8') as f:
+                    f.write("%s %.3f ms %s %r\n" % (entry['timestamp'], entry['ms'], entry['sql'], params))
+
+        if self.verbose > 1:
+            print("slow query (%.3f ms): %s %r" % (entry['ms'], entry['sql'], params))
+
+    def render(self):
+        """render all the metrics in prometheus text format
+
+        Returns:
+            str: the metrics
+        """
+        lines = []
+        with self.lock:
+            for metric in [ self.request_latency, self.request_sql, self.request_queries,
+                            self.response_size, self.requests, self.cache_hits,
+                            self.cache_misses, self.queries ]:
+                lines += metric.render()
+            lines.append("# HELP ultrastar_slow_queries Slow queries kept in the log buffer")
+            lines.append("# TYPE ultrastar_slow_queries gauge")
+            lines.append("ultrastar_slow_queries %d" % len(self.slow_queries))
+        return "\n".join(lines) + "\n"
+
+
+class TimedCursor(sqlite3.Cursor):
+    """cursor that reports the time of each sentence to the connection's
+    metrics. sqlite does most of the work of a select while its rows are
+    fetched, so the time of the fetches is added to the sentence, and it is
+    reported when all its rows were read, the next sentence runs or the
+    cursor is closed"""
+
+    # [sql, params, seconds] of the sentence whose rows are being read
+    timed = None
+    # rows fetched at once when the cursor is iterated
+    BATCH = 256
+
+    def finish_timing(self):
+        timed = self.timed
+        if timed is not None:
+            self.timed = None
+            self.connection.metrics.observe_query(*timed)
+
+    def fetch(self, method, *args):
+        "call a fetch method, adding its time to the sentence"
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self.timed is not None:
+                self.timed[2] += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self.finish_timing()
+        start = time.perf_counter()
+        try:
+            result = super().execute(sql, parameters)
+        except BaseException:
+            self.connection.metrics.observe_query(sql, parameters, time.perf_counter() - start)
+            raise
+        self.timed = [ sql, parameters, time.perf_counter() - start ]
+        if self.description is None:
+            # no rows to read
+            self.finish_timing()
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        self.finish_timing()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.metrics.observe_query(sql, "<many>", time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        self.finish_timing()
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.connection.metrics.observe_query(sql_script, (), time.perf_counter() - start)
+
+    def fetchone(self):
+        row = self.fetch(super().fetchone)
+        if row is None:
+            self.finish_timing()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self.fetch(super().fetchmany, size)
+        if len(rows) < size:
+            self.finish_timing()
+        return rows
+
+    def fetchall(self):
+        rows = self.fetch(super().fetchall)
+        self.finish_timing()
+        return rows
+
+    def __iter__(self):
+        # in batches: timing each row costs more than reading it
+        while True:
+            rows = self.fetchmany(TimedCursor.BATCH)
+            yield from rows
+            if len(rows) < TimedCursor.BATCH:
+                return
+
+    def __next__(self):
+        try:
+            return self.fetch(super().__next__)
+        except StopIteration:
+            self.finish_timing()
+            raise
+
+    def close(self):
+        self.finish_timing()
+        super().close()
+
+    def __del__(self):
+        # the rows were not read to the end, nor the cursor closed
+        try:
+            self.finish_timing()
+        except Exception:
+            pass
+
+
+class TimedConnection(sqlite3.Connection):
+    "connection whose cursors are TimedCursor. Use it as sqlite3.connect(factory=)"
+
+    metrics = Metrics(slow_query_ms=None)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
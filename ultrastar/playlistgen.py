@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# playlistgen.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# generates playlists from the songs in the database, given a target
+# duration and some constraints (songs per artist, genre and language mix,
+# duets, year spread, recently played songs). Uses a randomized greedy
+# selection refined with a local search (swap / add / remove moves).
+#
+# ############################################################################
+
+import time
+import random
+import datetime
+from collections import namedtuple, Counter
+
+import sys
+sys.path.append('..')
+
+Candidate = namedtuple('Candidate', ['id', 'artist', 'title', 'artist_norm', 'genre_id',
+                                     'language_id', 'multi', 'decade', 'duration', 'dirname' ])
+
+
+class PlaylistGenerator:
+
+    # weights of each term of the cost function
+    W_DURATION = 4.0
+    W_MIX = 1.0
+    W_DUETS = 1.0
+    W_SPREAD = 0.5
+
+    SQL_PLAYED = """
+        create table if not exists played(
+            id integer primary key AUTOINCREMENT,
+            dirname text not null,
+            playlist text not null,
+            played_at timestamp not null
+        );
+        """
+
+    def __init__(self, helper):
+        self.helper = helper
+
+    def load_candidates(self, where=None, years=None, exclude=None, exclude_recent=None):
+        """read the songs that can be part of the playlist
+
+        Args:
+            where (str, optional): extra sql condition over the songs table. Defaults to None.
+            years (tuple, optional): (min, max) years. Defaults to None.
+            exclude (list, optional): song ids to exclude. Defaults to None.
+            exclude_recent (float, optional): exclude songs played in the last days. Defaults to None.
+
+        Returns:
+            list: list of Candidate
+        """
+        clauses = [ "duration > 0" ]
+        params = []
+        if where:
+            clauses.append("(%s)" % where)
+        if years:
+            low, high = years
+            if low is not None:
+                clauses.append("year >= ?")
+                params.append(low)
+            if high is not None:
+                clauses.append("year <= ?")
+                params.append(high)
+        if exclude_recent:
+            since = datetime.datetime.now() - datetime.timedelta(days=exclude_recent)
+            clauses.append("dirname not in (select dirname from played where played_at >= ?)")
+            params.append(since.isoformat(" "))
+
+        cursor = self.helper.db.cursor()
+        cursor.execute("""
+            select id, artist, title, artist_norm, genre_id, language_id, multi,
+                   (year / 10) * 10, duration, dirname
+            from songs where %s""" % " and ".join(clauses), params)
+        excluded = set(exclude or [])
+        candidates = [ Candidate(*row) for row in cursor.fetchall() if row[0] not in excluded ]
+        cursor.close()
+        return candidates
+
+    def resolve_mix(self, dimension, mix):
+        "convert a { value: ratio } mix to { value id: ratio }"
+        if not mix:
+            return {}
+        resolved = {}
+        for value, ratio in mix.items():
+            value_id = self.helper.dimensions.lookup(dimension, value)
+            if value_id is None:
+                print("Warning: unknown %s '%s', ignored" % (dimension, value))
+                continue
+            resolved[value_id] = resolved.get(value_id, 0) + ratio
+        return resolved
+
+    def generate(self, duration=3600, max_per_artist=2, genres=None, languages=None,
+                 duets=None, years=None, year_spread=True, exclude=None,
+                 exclude_recent=None, where=None, seed=None, time_budget=0.5,
+                 iterations=5000):
+        """select the songs of a playlist
+
+        Args:
+            duration (float, optional): target duration in seconds. Defaults to 3600.
+            max_per_artist (int, optional): max songs of the same artist. Defaults to 2.
+            genres (dict, optional): genre mix, e.g. { "Pop": 0.5, "Rock": 0.25 }. Defaults to None.
+            languages (dict, optional): language mix, e.g. { "Spanish": 0.5 }. Defaults to None.
+            duets (float, optional): ratio of duets. Defaults to None.
+            years (tuple, optional): (min, max) years. Defaults to None.
+            year_spread (bool, optional): spread the songs over the decades. Defaults to True.
+            exclude (list, optional): song ids to exclude. Defaults to None.
+            exclude_recent (float, optional): exclude songs played in the last days. Defaults to None.
+            where (str, optional): extra sql condition over the songs table. Defaults to None.
+            seed (int, optional): random seed. Defaults to None.
+            time_budget (float, optional): max seconds of local search. Defaults to 0.5.
+            iterations (int, optional): max local search iterations. Defaults to 5000.
+
+        Returns:
+            list: list of Candidate, in play order
+        """
+        rnd = random.Random(seed)
+        candidates = self.load_candidates(where, years, exclude, exclude_recent)
+        genre_mix = self.resolve_mix('genre', genres)
+        language_mix = self.resolve_mix('language', languages)
+
+        state = PlaylistState(duration, genre_mix, language_mix, duets, year_spread)
+        if not candidates:
+            return []
+
+        # candidates of each constrained genre / language, to propose them
+        # more often while they are under represented
+        groups = {}
+        for index, c in enumerate(candidates):
+            if c.genre_id in genre_mix:
+                groups.setdefault(('genre', c.genre_id), []).append(index)
+            if c.language_id in language_mix:
+                groups.setdefault(('language', c.language_id), []).append(index)
+            if duets and c.multi:
+                groups.setdefault(('multi', 1), []).append(index)
+
+        selected = []
+        selected_set = set()
+
+        def propose():
+            "a random candidate not selected, biased to the under represented groups"
+            deficits = [ key for key in groups.keys() if state.deficit(*key) > 0 ]
+            for i in range(8):
+                if deficits and rnd.random() < 0.5:
+                    index = rnd.choice(groups[rnd.choice(deficits)])
+                else:
+                    index = rnd.randrange(len(candidates))
+                if index not in selected_set:
+                    return index
+            return None
+
+        # greedy: add the best of a random sample until the target is reached
+        sample = 32
+        while state.total < duration and len(selected_set) < len(candidates):
+            best = None
+            best_cost = None
+            for i in range(sample):
+                index = propose()
+                if index is None:
+                    continue
+                c = candidates[index]
+                if state.artists[c.artist_norm] >= max_per_artist:
+                    continue
+                cost = state.cost_with(add=c)
+                if best_cost is None or cost < best_cost:
+                    best, best_cost = index, cost
+            if best is None or (selected and best_cost >= state.cost()):
+                break
+            state.add(candidates[best])
+            selected.append(best)
+            selected_set.add(best)
+
+        # local search: random swap / add / remove moves, keep the improvements
+        start = time.perf_counter()
+        for i in range(iterations):
+            if time.perf_counter() - start > time_budget:
+                break
+            move = rnd.random()
+            out_pos, out, index, new = None, None, None, None
+            if selected and (move < 0.7 or move >= 0.85):
+                out_pos = rnd.randrange(len(selected))
+                out = candidates[selected[out_pos]]
+            if move < 0.85:
+                index = propose()
+                if index is not None:
+                    new = candidates[index]
+                    limit = max_per_artist + (1 if out and out.artist_norm == new.artist_norm else 0)
+                    if state.artists[new.artist_norm] >= limit:
+                        continue
+
+            if out is None and new is None:
+                continue
+            if state.cost_with(add=new, remove=out) >= state.cost():
+                continue
+
+            if out is not None:
+                state.remove(out)
+                selected_set.discard(selected.pop(out_pos))
+            if new is not None:
+                state.add(new)
+                selected.append(index)
+                selected_set.add(index)
+
+        songs = [ candidates[i] for i in selected ]
+        rnd.shuffle(songs)
+        return songs
+
+    def log_played(self, songs, name):
+        """store the songs of the playlist as played now (for exclude_recent)"""
+        now = datetime.datetime.now().isoformat(" ")
+        cursor = self.helper.db.cursor()
+        cursor.executemany("insert into played(dirname, playlist, played_at) values (?, ?, ?)",
+                           [ (song.dirname, name, now) for song in songs ])
+        cursor.close()
+        self.helper.db.commit()
+
+
+class PlaylistState:
+    "counters of the selected songs, to evaluate the cost function incrementally"
+
+    def __init__(self, duration, genre_mix, language_mix, duets, year_spread):
+        self.target = float(duration)
+        self.genre_mix = genre_mix
+        self.language_mix = language_mix
+        self.duets_ratio = duets
+        self.year_spread = year_spread
+        self.tolerance = max(60.0, self.target * 0.02)
+
+        self.n = 0
+        self.total = 0.0
+        self.duets = 0
+        self.artists = Counter()
+        self.genres = Counter()
+        self.languages = Counter()
+        self.decades = Counter()
+
+    def apply(self, song, sign):
+        self.n += sign
+        self.total += sign * song.duration
+        self.duets += sign * (1 if song.multi else 0)
+        self.artists[song.artist_norm] += sign
+        self.genres[song.genre_id] += sign
+        self.languages[song.language_id] += sign
+        self.decades[song.decade] += sign
+
+    def add(self, song):
+        self.apply(song, 1)
+
+    def remove(self, song):
+        self.apply(song, -1)
+
+    def deficit(self, kind, value_id):
+        "how many songs of a constrained group are missing to reach its ratio"
+        n = max(self.n, 1)
+        if kind == 'genre':
+            return self.genre_mix[value_id] * n - self.genres[value_id]
+        if kind == 'language':
+            return self.language_mix[value_id] * n - self.languages[value_id]
+        return self.duets_ratio * n - self.duets
+
+    def cost(self):
+        # a small error in the duration is allowed, to leave room to the mix
+        error = max(0.0, abs(self.total - self.target) - self.tolerance)
+        cost = PlaylistGenerator.W_DURATION * error / self.target
+        if not self.n:
+            return cost
+        for value_id, ratio in self.genre_mix.items():
+            cost += PlaylistGenerator.W_MIX * abs(self.genres[value_id] / self.n - ratio)
+        for value_id, ratio in self.language_mix.items():
+            cost += PlaylistGenerator.W_MIX * abs(self.languages[value_id] / self.n - ratio)
+        if self.duets_ratio is not None:
+            cost += PlaylistGenerator.W_DUETS * abs(self.duets / self.n - self.duets_ratio)
+        if self.year_spread:
+            cost += PlaylistGenerator.W_SPREAD * sum((v / self.n) ** 2 for v in self.decades.values() if v)
+        return cost
+
+    def cost_with(self, add=None, remove=None):
+        "the cost after adding and/or removing a song (state is restored)"
+        if add is not None:
+            self.apply(add, 1)
+        if remove is not None:
+            self.apply(remove, -1)
+        cost = self.cost()
+        if remove is not None:
+            self.apply(remove, 1)
+        if add is not None:
+            self.apply(add, -1)
+        return cost
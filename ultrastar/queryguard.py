@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# queryguard.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# limits for the queries typed in the console: a sqlite progress handler
+# stops the query when it goes over the time budget (or on ctrl+c), shows
+# the elapsed time and rows read of the long ones, and the queries can be
+# run in read only mode (an authorizer denies the writes). The connection
+# can be used again after an interrupted query. The handler and the
+# authorizer are installed once in the (shared) connection and only act on
+# the thread that runs the guarded block, so the other threads' queries
+# are not limited.
+#
+# ############################################################################
+
+import sys
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class QueryInterrupted(Exception):
+    "the query was stopped (time budget or ctrl+c), the connection is usable"
+    def __init__(self, reason, elapsed, rows):
+        super().__init__("query %s after %.1f s (%d rows read)" % (reason, elapsed, rows))
+        self.reason = reason
+        self.elapsed = elapsed
+        self.rows = rows
+
+
+class QueryGuard:
+
+    # sqlite virtual machine instructions between calls to the handler
+    STEPS = 20000
+    # actions denied in read only mode (see authorizer())
+    WRITES = set(getattr(sqlite3, name) for name in dir(sqlite3)
+                 if name.startswith(("SQLITE_CREATE_", "SQLITE_DROP_")) or
+                 name in ("SQLITE_INSERT", "SQLITE_UPDATE", "SQLITE_DELETE", "SQLITE_ALTER_TABLE",
+                          "SQLITE_REINDEX", "SQLITE_ANALYZE", "SQLITE_ATTACH", "SQLITE_DETACH"))
+    # prefix of the statements run in read only mode: sqlite checks the
+    # authorizer when a statement is prepared, so they don't share the
+    # cached statements of the same sql prepared without the limits
+    READ_ONLY = "/* read only */ "
+
+    def __init__(self, helper, budget=None, read_only=None, indicator=None, out=None):
+        """
+        Args:
+            helper (UltraStarHelper): the helper (its db is guarded)
+            budget (float, optional): max seconds of a query (0: no limit). Defaults to config.query_budget.
+            read_only (bool, optional): the queries can't change the data. Defaults to config.query_read_only.
+            indicator (float, optional): show the progress of the queries longer than this (0: never). Defaults to config.query_indicator.
+            out (file, optional): where the progress is shown. Defaults to sys.stderr.
+        """
+        config = helper.config
+        self.helper = helper
+        self.budget = config.query_budget if budget is None else budget
+        self.read_only = config.query_read_only if read_only is None else read_only
+        self.indicator = config.query_indicator if indicator is None else indicator
+        self.out = out or sys.stderr
+        self.local = threading.local()
+        # the connection with the handler and the authorizer (see install())
+        self.installed = None
+
+    def handler(self):
+        "progress handler: a non zero value stops the query"
+        try:
+            # queries of other threads on the same connection are not guarded
+            state = getattr(self.local, 'state', None)
+            if state is None:
+                return 0
+            elapsed = time.monotonic() - state['started']
+            if self.budget and elapsed > self.budget:
+                state['reason'] = "over the time budget (%s s)" % self.budget
+                return 1
+            if self.indicator and elapsed > self.indicator and elapsed - state['shown'] >= 0.5:
+                state['shown'] = elapsed
+                self.out.write("\r... %.1f s, %d rows " % (elapsed, state['rows']))
+                self.out.flush()
+        except KeyboardInterrupt:
+            return 1
+        return 0
+
+    def authorizer(self, action, arg1, arg2, database, source):
+        "sqlite authorizer: denies the writes of the thread in read only mode"
+        state = getattr(self.local, 'state', None)
+        if state is None or not state['read_only']:
+            return sqlite3.SQLITE_OK
+        if action in QueryGuard.WRITES or (action == sqlite3.SQLITE_PRAGMA and arg2 is not None):
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+
+    def install(self, db):
+        "set the handler and the authorizer of the connection (once)"
+        if self.installed is db:
+            return
+        db.set_progress_handler(self.handler, QueryGuard.STEPS)
+        db.set_authorizer(self.authorizer)
+        self.installed = db
+
+    def statement(self, sql):
+        """the sql to run in the guarded block
+
+        Args:
+            sql (str): the sql sentence
+
+        Returns:
+            str: the sentence (with the read only prefix, in read only mode)
+        """
+        state = getattr(self.local, 'state', None)
+        if state is not None and state['read_only']:
+            return QueryGuard.READ_ONLY + sql
+        return sql
+
+    @contextmanager
+    def guard(self, read_only=None):
+        """run the queries of the block with the limits. Nested blocks use
+        the limits of the outer one. Use rows() to count the rows read.
+
+        Args:
+            read_only (bool, optional): override the read only mode. Defaults to None.
+
+        Raises:
+            QueryInterrupted: if a query was stopped
+            sqlite3.OperationalError: if a query tried to write in read only mode
+        """
+        db = self.helper.db
+        state = getattr(self.local, 'state', None)
+        if state is not None:
+            yield state
+            return
+
+        read_only = self.read_only if read_only is None else read_only
+        self.install(db)
+        state = self.local.state = { 'started': time.monotonic(), 'shown': 0.0, 'rows': 0, 'reason': None,
+                                     'read_only': read_only }
+        transaction = db.in_transaction
+        try:
+            yield state
+        except sqlite3.DatabaseError as e:
+            if read_only and str(e) == "not authorized":
+                raise sqlite3.OperationalError("the queries are read only (see limits())") from e
+            if not isinstance(e, sqlite3.OperationalError):
+                raise
+            if state['reason'] is None:
+                if str(e) != "interrupted":
+                    raise
+                # ctrl+c while the query runs
+                state['reason'] = "interrupted"
+            # the statement was rolled back by sqlite; undo the rest of it
+            if db.in_transaction and not transaction:
+                db.rollback()
+            raise QueryInterrupted(state['reason'], time.monotonic() - state['started'], state['rows']) from e
+        finally:
+            if state['shown']:
+                self.out.write("\r%s\r" % (" " * 40))
+                self.out.flush()
+            self.local.state = None
+
+    def rows(self, count):
+        "add the rows read to the indicator"
+        state = getattr(self.local, 'state', None)
+        if state is not None:
+            state['rows'] += count
+
+    def settings(self):
+        return { 'budget': self.budget, 'read_only': self.read_only, 'indicator': self.indicator }
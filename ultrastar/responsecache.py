@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# responsecache.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# LRU cache for the bodies of the web responses, keyed by the route and its
+# arguments, and invalidated when the data version changes. Each body has a
+# strong ETag, and its gzip (and brotli, if installed) variants are
+# compressed once, the first time a client accepts them.
+#
+# ############################################################################
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CachedResponse:
+    __slots__ = ('key', 'body', 'content_type', 'etag', 'encoded', 'size')
+
+    def __init__(self, key, body, content_type):
+        self.key = key
+        self.body = body
+        self.content_type = content_type
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.encoded = {}
+        self.size = len(body)
+
+    def etags(self):
+        "the etag of each variant (identity, gzip, br)"
+        return [ self.etag ] + [ "%s-%s" % (self.etag, encoding) for encoding in ResponseCache.ENCODINGS ]
+
+
+class ResponseCache:
+
+    # preferred first
+    ENCODINGS = [ 'br', 'gzip' ] if brotli is not None else [ 'gzip' ]
+    # smaller bodies are sent as they are
+    MIN_COMPRESS = 512
+
+    def __init__(self, helper, max_bytes=32 * 1024 * 1024):
+        self.helper = helper
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> CachedResponse
+        self.size = 0
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def check_version(self):
+        version = self.helper.get_data_version()
+        if version != self.version:
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+        return version
+
+    def get(self, key):
+        """the cached response of the key
+
+        Returns:
+            tuple: (CachedResponse or None, data version), pass the version to put()
+        """
+        with self.lock:
+            version = self.check_version()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            self.helper.metrics.cache_hit("responses")
+        else:
+            self.helper.metrics.cache_miss("responses")
+        return entry, version
+
+    def put(self, key, body, content_type, version):
+        """store a response body (not if the data changed while it was built)
+
+        Returns:
+            CachedResponse: the entry
+        """
+        entry = CachedResponse(key, body, content_type)
+        with self.lock:
+            if entry.size <= self.max_bytes and version == self.version:
+                old = self.entries.pop(key, None)
+                if old is not None:
+                    self.size -= old.size
+                self.entries[key] = entry
+                self.size += entry.size
+                self.evict()
+        return entry
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            old_key, old = self.entries.popitem(last=False)
+            self.size -= old.size
+            self.evictions += 1
+
+    def encode(self, entry, encoding):
+        """the body of the entry compressed with the encoding (compressed once)
+
+        Returns:
+            bytes: the compressed body
+        """
+        body = entry.encoded.get(encoding)
+        if body is not None:
+            return body
+        if encoding == 'br':
+            body = brotli.compress(entry.body, quality=5)
+        else:
+            body = gzip.compress(entry.body, compresslevel=6)
+        with self.lock:
+            if encoding not in entry.encoded:
+                entry.encoded[encoding] = body
+                entry.size += len(body)
+                if self.entries.get(entry.key) is entry:
+                    self.size += len(body)
+                    self.evict()
+        return entry.encoded[encoding]
+
+    def choose_encoding(self, entry, accept):
+        """the encoding to send the entry with
+
+        Args:
+            entry (CachedResponse): the response
+            accept (callable): quality of an encoding for the client (0 if not accepted)
+
+        Returns:
+            str: 'br', 'gzip' or None (identity)
+        """
+        if len(entry.body) < ResponseCache.MIN_COMPRESS:
+            return None
+        for encoding in ResponseCache.ENCODINGS:
+            if accept(encoding):
+                return encoding
+        return None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """the cache statistics
+
+        Returns:
+            dict: entries, bytes, max_bytes, hits, misses, hit_ratio, evictions, encodings
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0,
+                'evictions': self.evictions,
+                'encodings': list(ResponseCache.ENCODINGS),
+            }
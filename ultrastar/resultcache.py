@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# resultcache.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# LRU cache for the results of the console queries, bounded in bytes and
+# invalidated when the data version changes. Rows are returned as read
+# only tuples that can also be accessed by column name.
+#
+# ############################################################################
+
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+
+class ResultRow(tuple):
+    "read only row: a tuple that can also be indexed by column name, like a dict"
+
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+    _layouts = {}
+
+    @staticmethod
+    def layout(columns):
+        """get the row class for the given column names (classes are shared)
+
+        Args:
+            columns (tuple): the column names
+
+        Returns:
+            class: a ResultRow subclass
+        """
+        cls = ResultRow._layouts.get(columns)
+        if cls is None:
+            cls = type("ResultRow", (ResultRow,), {
+                '__slots__': (),
+                '_fields': columns,
+                '_index': dict((name, i) for i, name in reversed(list(enumerate(columns)))),
+            })
+            ResultRow._layouts[columns] = cls
+        return cls
+
+    @staticmethod
+    def factory(cursor, row):
+        "sqlite3 row_factory building ResultRow"
+        columns = tuple(d[0] for d in cursor.description)
+        return ResultRow.layout(columns)(row)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def keys(self):
+        return self._fields
+
+    def get(self, key, default=None):
+        if key in self._index:
+            return self[key]
+        return default
+
+    def __repr__(self):
+        return repr(dict(zip(self._fields, self)))
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+
+class ResultCache:
+
+    # rows fetched at once (the progress of the QueryGuard counts them)
+    FETCH_BATCH = 500
+
+    def __init__(self, helper, max_bytes=64 * 1024 * 1024):
+        self.helper = helper
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (rows, size)
+        self.size = 0
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize(sql):
+        "the sql sentence without redundant whitespace and trailing ;"
+        return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+    @staticmethod
+    def is_read(sql):
+        "only the queries that don't change the data are cached"
+        words = sql.split(None, 1)
+        return bool(words) and words[0].lower() in ("select", "with", "values")
+
+    @staticmethod
+    def sizeof(rows):
+        "approximate memory used by the rows"
+        size = sys.getsizeof(rows)
+        for row in rows:
+            size += sys.getsizeof(row)
+            for value in row:
+                size += sys.getsizeof(value)
+        return size
+
+    def check_version(self):
+        version = self.helper.get_data_version()
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+        return version
+
+    def execute(self, query, params=()):
+        """run the query, or get the rows from the cache
+
+        Args:
+            query (str): sql query
+            params (tuple, optional): the parameters of the query. Defaults to ().
+
+        Returns:
+            tuple: the rows (ResultRow)
+        """
+        sql = ResultCache.normalize(query)
+        if isinstance(params, dict):
+            key = (sql, tuple(sorted(params.items())))
+        else:
+            key = (sql, tuple(params))
+        cacheable = ResultCache.is_read(sql)
+
+        if cacheable:
+            with self.lock:
+                version = self.check_version()
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+            if entry is not None:
+                self.helper.metrics.cache_hit("results")
+                return entry[0]
+            self.helper.metrics.cache_miss("results")
+
+        cursor = self.helper.db.cursor()
+        cursor.row_factory = ResultRow.factory
+        try:
+            # time budget, read only mode and progress (see QueryGuard)
+            with self.helper.query_guard.guard():
+                cursor.execute(self.helper.query_guard.statement(query), params)
+                rows = []
+                while True:
+                    batch = cursor.fetchmany(ResultCache.FETCH_BATCH)
+                    rows += batch
+                    self.helper.query_guard.rows(len(batch))
+                    if len(batch) < ResultCache.FETCH_BATCH:
+                        break
+                rows = tuple(rows)
+        finally:
+            cursor.close()
+
+        if not cacheable:
+            self.helper.bump_data_version()
+            return rows
+
+        size = ResultCache.sizeof(rows)
+        with self.lock:
+            self.misses += 1
+            if size <= self.max_bytes and version == self.version:
+                self.entries[key] = (rows, size)
+                self.size += size
+                while self.size > self.max_bytes:
+                    old_key, (old_rows, old_size) = self.entries.popitem(last=False)
+                    self.size -= old_size
+                    self.evictions += 1
+        return rows
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """the cache statistics
+
+        Returns:
+            dict: entries, bytes, max_bytes, hits, misses, hit_ratio, evictions, invalidations
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# resultset.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# lazy result of a console query: rows are read from the cursor when
+# iterated, len() runs a COUNT, slices use LIMIT/OFFSET and printing it
+# shows one page. Pages and counts go through the query result cache.
+#
+# ############################################################################
+
+import sys
+sys.path.append('..')
+
+from ultrastar.resultcache import ResultRow, ResultCache
+
+
+class ResultSet:
+    def __init__(self, helper, query, params=(), page_size=20, batch_size=500):
+        self.helper = helper
+        self.query = ResultCache.normalize(query)
+        self.params = params
+        self.page_size = page_size
+        self.batch_size = batch_size
+
+    def execute(self, query, params=None):
+        "run a query derived from this one, through the result cache"
+        return self.helper.result_cache.execute(query, self.params if params is None else params)
+
+    def params_with(self, *extra):
+        if isinstance(self.params, dict):
+            raise TypeError("slices and batches need positional parameters (?), not named ones")
+        return tuple(self.params) + extra
+
+    def __iter__(self):
+        # the limits of the QueryGuard apply to each batch read, not to
+        # the time the rows are used
+        guard = self.helper.query_guard
+        cursor = self.helper.db.cursor()
+        cursor.row_factory = ResultRow.factory
+        try:
+            with guard.guard():
+                cursor.execute(guard.statement(self.query), self.params)
+            while True:
+                with guard.guard():
+                    rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def __len__(self):
+        return self.execute("select count(*) from (%s)" % self.query)[0][0]
+
+    def __bool__(self):
+        return bool(self.execute("select 1 from (%s) limit 1" % self.query))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.start, key.stop, key.step
+            if (start is not None and start < 0) or (stop is not None and stop < 0):
+                start, stop, step = key.indices(len(self))
+            start = start or 0
+            if stop is None:
+                rows = self.execute("select * from (%s) limit -1 offset ?" % self.query,
+                                    self.params_with(start))
+            else:
+                rows = self.execute("select * from (%s) limit ? offset ?" % self.query,
+                                    self.params_with(max(0, stop - start), start))
+            return rows[::step] if step and step != 1 else rows
+
+        if key < 0:
+            key += len(self)
+        rows = self.execute("select * from (%s) limit 1 offset ?" % self.query, self.params_with(key))
+        if not rows:
+            raise IndexError("result index out of range")
+        return rows[0]
+
+    def page(self, n=1):
+        """get a page of results
+
+        Args:
+            n (int, optional): the page number, starting in 1. Defaults to 1.
+
+        Returns:
+            tuple: the rows of the page
+        """
+        start = (n - 1) * self.page_size
+        return self[start:start + self.page_size]
+
+    def pages(self):
+        "number of pages"
+        return max(1, -(-len(self) // self.page_size))
+
+    def show(self, n=1):
+        "print a page of results"
+        print(self.format_page(n))
+
+    def format_page(self, n=1):
+        rows = self.page(n)
+        lines = [ repr(row) for row in rows ]
+        total = len(self)
+        lines.append("-- %d rows, page %d/%d (use .show(n) or .page(n) to see other pages)" %
+                     (total, n, self.pages()))
+        return "\n".join(lines)
+
+    def all(self):
+        "all the rows (cached)"
+        return self.execute(self.query)
+
+    def id_batches(self, size=None):
+        """yield the ids of the result in batches, using keyset pagination on
+        the id, so the rows can be modified between batches
+
+        Args:
+            size (int, optional): ids per batch. Defaults to batch_size.
+
+        Yields:
+            list: list of ids
+        """
+        size = size or self.batch_size
+        last = None
+        cursor = self.helper.db.cursor()
+        try:
+            while True:
+                if last is None:
+                    cursor.execute("select id from (%s) order by id limit ?" % self.query,
+                                   self.params_with(size))
+                else:
+                    cursor.execute("select id from (%s) where id > ? order by id limit ?" % self.query,
+                                   self.params_with(last, size))
+                ids = [ row[0] for row in cursor.fetchall() ]
+                if not ids:
+                    break
+                yield ids
+                last = ids[-1]
+        finally:
+            cursor.close()
+
+    def __repr__(self):
+        return self.format_page(1)
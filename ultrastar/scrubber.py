@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# scrubber.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# integrity checks of the library, to find the broken songs before they are
+# played: mp3 frame sync, cover decodable, video present and song file
+# header equal to the database. The songs are checked in the background
+# with a limited read bandwidth, the oldest checks first, and the results
+# are stored in the integrity table of its own database (integrity_file,
+# attached as scrub), so the checks don't change the data_version of the
+# songs database nor invalidate the caches built over it.
+#
+# ############################################################################
+
+import os
+import time
+import datetime
+import sqlite3
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import sys
+sys.path.append('..')
+
+
+class Mp3Check:
+    "find two consecutive valid mpeg audio frames at the start of the file"
+
+    # kbps by (version is 1, layer)
+    BITRATES = {
+        (True, 1): [ 0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448 ],
+        (True, 2): [ 0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384 ],
+        (True, 3): [ 0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320 ],
+        (False, 1): [ 0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256 ],
+        (False, 2): [ 0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160 ],
+        (False, 3): [ 0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160 ],
+    }
+    # by version bits: 0 MPEG 2.5, 2 MPEG 2, 3 MPEG 1
+    SAMPLE_RATES = { 0: [ 11025, 12000, 8000 ], 2: [ 22050, 24000, 16000 ], 3: [ 44100, 48000, 32000 ] }
+    # the first frame is searched in this window (after the ID3v2 tag)
+    WINDOW = 64 * 1024
+
+    @staticmethod
+    def frame(data, pos):
+        """the header at pos
+
+        Returns:
+            tuple: (version bits, layer, frame length), or None if it isn't a valid header
+        """
+        if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+            return None
+        version = (data[pos + 1] >> 3) & 3
+        layer = 4 - ((data[pos + 1] >> 1) & 3)
+        bitrate = data[pos + 2] >> 4
+        rate = (data[pos + 2] >> 2) & 3
+        padding = (data[pos + 2] >> 1) & 1
+        if version == 1 or layer == 4 or bitrate in (0, 15) or rate == 3:
+            return None
+        kbps = Mp3Check.BITRATES[(version == 3, layer)][bitrate]
+        sample_rate = Mp3Check.SAMPLE_RATES[version][rate]
+        if layer == 1:
+            length = (12 * kbps * 1000 // sample_rate + padding) * 4
+        elif layer == 3 and version != 3:
+            length = 72 * kbps * 1000 // sample_rate + padding
+        else:
+            length = 144 * kbps * 1000 // sample_rate + padding
+        return version, layer, length
+
+    @staticmethod
+    def check(fname):
+        """
+        Returns:
+            tuple: (problem or None, bytes read)
+        """
+        with open(fname, 'rb') as f:
+            data = f.read(10)
+            start = 0
+            if len(data) == 10 and data[:3] == b"ID3":
+                # syncsafe size of the ID3v2 tag (and its footer)
+                size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+                start = 10 + size + (10 if data[5] & 0x10 else 0)
+            f.seek(start)
+            data = f.read(Mp3Check.WINDOW + 4096)
+        read = 10 + len(data)
+        if not data:
+            return "mp3 is empty", read
+        for pos in range(min(len(data), Mp3Check.WINDOW)):
+            header = Mp3Check.frame(data, pos)
+            if header is None:
+                continue
+            following = Mp3Check.frame(data, pos + header[2])
+            if following is not None and following[:2] == header[:2]:
+                return None, read
+            if pos + header[2] >= len(data):
+                # a single frame file
+                return None, read
+        return "mp3 has no valid frames", read
+
+
+class IntegrityScrubber:
+
+    # kept between loads: songs are identified by their dirname
+    SQL_INTEGRITY = [
+        """
+        create table if not exists scrub.integrity(
+            dirname text primary key,
+            checked_at timestamp not null,
+            status text not null,
+            problems text not null,
+            bytes_read integer not null default 0
+        );
+        """,
+        "create index if not exists scrub.integrity_status on integrity(status);"
+    ]
+
+    # magic bytes of the cover formats
+    IMAGES = [ (b"\xff\xd8\xff", "jpeg"), (b"\x89PNG\r\n\x1a\n", "png"), (b"GIF87a", "gif"),
+               (b"GIF89a", "gif"), (b"BM", "bmp") ]
+
+    # song file header -> database column
+    HEADER_FIELDS = [ 'title', 'artist', 'language', 'edition', 'genre', 'year',
+                      'mp3', 'cover', 'video', 'videogap', 'bpm', 'gap' ]
+
+    def __init__(self, helper):
+        self.helper = helper
+        self.config = helper.config
+        self.verbose = helper.verbose or 0
+        self.bandwidth = self.config.scrub_bandwidth
+        self.thread = None
+        self.stop = threading.Event()
+        self.checked = 0
+        self.failed = 0
+        self.bytes_read = 0
+        self.started = None
+        self.attach_lock = threading.Lock()
+
+    def attach(self, db):
+        """attach the integrity database to the connection as scrub (once per
+        connection), creating its tables
+
+        Args:
+            db (sqlconn): the connection
+        """
+        with self.attach_lock:
+            if getattr(db, 'integrity_attached', False):
+                return
+            db.execute("attach database ? as scrub", (self.config.integrity_file,))
+            cursor = db.cursor()
+            try:
+                for sql_sentence in IntegrityScrubber.SQL_INTEGRITY:
+                    cursor.execute(sql_sentence)
+            except sqlite3.OperationalError:
+                # read only connection: the tables are created by the scrubber
+                pass
+            cursor.close()
+            db.integrity_attached = True
+
+    @staticmethod
+    def missing(value):
+        return value is None or str(value).strip() in ("", "UNKNOWN")
+
+    def check_cover(self, fname):
+        with open(fname, 'rb') as f:
+            head = f.read(16)
+        if not any(head.startswith(magic) for magic, name in IntegrityScrubber.IMAGES) and \
+           not (head[:4] == b"RIFF" and head[8:12] == b"WEBP"):
+            return "cover is not an image", len(head)
+        if Image is None:
+            return None, len(head)
+        try:
+            with Image.open(fname) as image:
+                image.verify()
+        except Exception as e:
+            return "cover can't be decoded (%s)" % e, os.path.getsize(fname)
+        return None, os.path.getsize(fname)
+
+    def check_header(self, song):
+        "the song file header against the database"
+        problems = []
+        with open(song['path'], 'r', encoding=self.config.encoding, errors='replace') as f:
+            header = []
+            for line in f:
+                if not line.startswith('#'):
+                    break
+                header.append(line.rstrip('\r\n'))
+        text = "\n".join(header)
+        config, tags = self.helper.read_config(text, song['path'])
+        if not config:
+            return [ "song file has no header" ], len(text)
+        for field in IntegrityScrubber.HEADER_FIELDS:
+            value = str(config.get(field, "")).strip()
+            stored = "" if song[field] is None else str(song[field]).strip()
+            if field in ('bpm', 'videogap', 'gap', 'year'):
+                try:
+                    if float(value.replace(',', '.')) == float(stored.replace(',', '.')):
+                        continue
+                except ValueError:
+                    pass
+            if value != stored:
+                problems.append("%s in the song file is '%s', in the database '%s'" % (field, value, stored))
+        return problems, len(text)
+
+    def check(self, song):
+        """check a song
+
+        Args:
+            song (dict): the row of the songs table
+
+        Returns:
+            tuple: (list of problems, bytes read)
+        """
+        problems = []
+        read = 0
+        dirname = song['dirname']
+
+        if not os.path.exists(song['path']):
+            return [ "song file not found" ], 0
+        found, size = self.check_header(song)
+        problems += found
+        read += size
+
+        if IntegrityScrubber.missing(song['mp3']):
+            problems.append("no mp3")
+        else:
+            fname = os.path.sep.join([dirname, song['mp3']])
+            if not os.path.exists(fname):
+                problems.append("mp3 not found")
+            else:
+                problem, size = Mp3Check.check(fname)
+                read += size
+                if problem:
+                    problems.append(problem)
+
+        if not IntegrityScrubber.missing(song['cover']):
+            fname = os.path.sep.join([dirname, song['cover']])
+            if not os.path.exists(fname):
+                problems.append("cover not found")
+            else:
+                problem, size = self.check_cover(fname)
+                read += size
+                if problem:
+                    problems.append(problem)
+
+        if not IntegrityScrubber.missing(song['video']):
+            if not os.path.exists(os.path.sep.join([dirname, song['video']])):
+                problems.append("video not found")
+
+        return problems, read
+
+    def due(self, db, limit):
+        "the songs never checked, or checked longer than scrub_interval days ago (the oldest first)"
+        limit_date = (datetime.datetime.now() - datetime.timedelta(days=self.config.scrub_interval)).isoformat(" ")
+        cursor = db.cursor()
+        cursor.execute("""select s.* from songs s left join scrub.integrity i on i.dirname = s.dirname
+                          where i.checked_at is null or i.checked_at < ?
+                          order by i.checked_at is not null, i.checked_at, s.id limit ?""", (limit_date, limit))
+        songs = cursor.fetchall()
+        cursor.close()
+        return songs
+
+    def throttle(self, read, started):
+        "sleep so the bytes read since started don't go over the bandwidth"
+        if not self.bandwidth:
+            return
+        wait = read / self.bandwidth - (time.monotonic() - started)
+        if wait > 0:
+            self.stop.wait(wait)
+
+    def run(self, limit=100, db=None):
+        """check the songs due
+
+        Args:
+            limit (int, optional): max songs to check. Defaults to 100.
+            db (sqlconn, optional): the connection to use. Defaults to the helper's one.
+
+        Returns:
+            int: number of songs checked
+        """
+        db = db or self.helper.db
+        self.attach(db)
+
+        started = time.monotonic()
+        read = 0
+        count = 0
+        for song in self.due(db, limit):
+            if self.stop.is_set():
+                break
+            try:
+                problems, size = self.check(song)
+            except OSError as e:
+                problems, size = [ "can't read the song files (%s)" % e ], 0
+            read += size
+            count += 1
+            self.checked += 1
+            self.bytes_read += size
+            if problems:
+                self.failed += 1
+                if self.verbose > 0:
+                    print("integrity: %s: %s" % (song['dirname'], "; ".join(problems)))
+            db.execute("""insert into scrub.integrity(dirname, checked_at, status, problems, bytes_read)
+                          values (?, ?, ?, ?, ?)
+                          on conflict(dirname) do update set checked_at=excluded.checked_at,
+                          status=excluded.status, problems=excluded.problems,
+                          bytes_read=excluded.bytes_read""",
+                       (song['dirname'], datetime.datetime.now().isoformat(" "),
+                        "fail" if problems else "ok", "\n".join(problems), size))
+            if count % 20 == 0:
+                db.commit()
+            self.throttle(read, started)
+        db.commit()
+        return count
+
+    def start(self):
+        """check the library in a background thread, forever: the songs due,
+        then wait scrub_idle seconds for the next ones"""
+        if self.thread:
+            return
+        self.stop.clear()
+        self.started = time.time()
+
+        def loop():
+            # its own connection (in_memory mode, the shared one)
+            db = self.helper.db if self.config.in_memory else self.helper.connect(self.config.dbfile)
+            try:
+                while not self.stop.is_set():
+                    try:
+                        count = self.run(self.config.scrub_batch, db)
+                    except Exception as e:
+                        # e.g. the tables are being created again by a refresh
+                        if self.verbose > 0:
+                            print("integrity: %s" % e)
+                        count = 0
+                    if count < self.config.scrub_batch:
+                        self.stop.wait(self.config.scrub_idle)
+            finally:
+                if db is not self.helper.db:
+                    db.close()
+
+        self.thread = threading.Thread(target=loop, name="scrubber", daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        self.stop.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def report(self, status="fail", limit=None):
+        """the results of the checks
+
+        Args:
+            status (str, optional): "fail", "ok" or None (all). Defaults to "fail".
+            limit (int, optional): max songs. Defaults to None (all).
+
+        Returns:
+            dict: summary (songs, checked, failed, due) and the songs (id, artist, title, dirname, checked_at, problems)
+        """
+        db = self.helper.db
+        try:
+            self.attach(db)
+        except sqlite3.OperationalError:
+            # read only and the integrity database doesn't exist yet
+            return { 'songs': 0, 'checked': 0, 'failed': 0, 'items': [] }
+        cursor = db.cursor()
+        cursor.execute("select 1 from scrub.sqlite_master where type='table' and name='integrity'")
+        if not cursor.fetchone():
+            cursor.close()
+            return { 'songs': 0, 'checked': 0, 'failed': 0, 'items': [] }
+
+        cursor.execute("""select count(*) as songs, count(i.dirname) as checked,
+                                 total(i.status = 'fail') as failed
+                          from songs s left join scrub.integrity i on i.dirname = s.dirname""")
+        summary = dict(cursor.fetchone())
+        summary['failed'] = int(summary['failed'])
+
+        sql = """select s.id, s.artist, s.title, s.dirname, i.checked_at, i.status, i.problems
+                 from scrub.integrity i join songs s on s.dirname = i.dirname"""
+        params = []
+        if status:
+            sql += " where i.status = ?"
+            params.append(status)
+        sql += " order by s.artist, s.title"
+        if limit:
+            sql += " limit ?"
+            params.append(limit)
+        cursor.execute(sql, params)
+        items = []
+        for row in cursor.fetchall():
+            item = dict(row)
+            item['problems'] = item['problems'].split("\n") if item['problems'] else []
+            items.append(item)
+        cursor.close()
+        summary['items'] = items
+        if self.started:
+            summary['scrubber'] = { 'running': self.thread is not None, 'checked': self.checked,
+                                    'failed': self.failed, 'bytes_read': self.bytes_read }
+        return summary
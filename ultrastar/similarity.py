@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# similarity.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# "more like this": each song is a vector of features (year, bpm, duration,
+# genre/edition/language, duet, and the pitch histogram of its notes), the
+# vectors are stored as a numpy matrix next to the database, and the songs
+# nearest to a seed (cosine similarity) are found with a single matrix
+# product. The index is built again (in the background in the web app)
+# when the data changes, and the queries use the previous one meanwhile.
+# numpy is optional: without it similar() raises an error.
+#
+# ############################################################################
+
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import sys
+sys.path.append('..')
+
+
+class IndexNotReady(Exception):
+    "the index was never built (it is being built)"
+
+
+class SimilarityIndex:
+
+    # numeric columns (z-score) and their weight
+    NUMBERS = [ ('year', 1.0), ('bpm', 0.5), ('duration', 0.5) ]
+    # dimensions (one-hot of the most used values) and their weight
+    DIMENSIONS = [ ('genre', 1.5), ('edition', 0.5), ('language', 1.5) ]
+    MAX_VALUES = 64
+    MULTI_WEIGHT = 1.0
+    PITCH_WEIGHT = 1.0
+    # pitch classes (C, C#, ... B)
+    PITCHES = 12
+
+    def __init__(self, helper, fname=None):
+        """
+        Args:
+            helper (UltraStarHelper): the helper
+            fname (str, optional): the file of the vectors. Defaults to config.similarity_file.
+        """
+        self.helper = helper
+        self.verbose = helper.verbose or 0
+        self.fname = fname or helper.config.similarity_file or "%s.similar.npz" % helper.config.dbfile
+        self.ids = None
+        self.vectors = None
+        self.positions = {}
+        self.paths = None
+        self.pitches = None
+        self.version = None
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        return np is not None
+
+    @staticmethod
+    def pitch_histogram(fname, encoding):
+        """the histogram of the pitch classes of the notes of a song, weighted
+        by the length of the notes (the sum is 1, or all zeros without notes)
+
+        Args:
+            fname (str): the song txt file
+            encoding (str): the encoding of the file
+
+        Returns:
+            list: PITCHES floats
+        """
+        histogram = [ 0.0 ] * SimilarityIndex.PITCHES
+        try:
+            with open(fname, 'r', encoding=encoding, errors='replace') as f:
+                for line in f:
+                    # note: type start length pitch text (: normal, * golden, F freestyle, R/G rap)
+                    if not line or line[0] not in ":*FRG":
+                        continue
+                    fields = line[1:].split(None, 3)
+                    if len(fields) < 3:
+                        continue
+                    try:
+                        length, pitch = int(fields[1]), int(fields[2])
+                    except ValueError:
+                        continue
+                    histogram[pitch % SimilarityIndex.PITCHES] += max(length, 1)
+        except OSError:
+            pass
+        total = sum(histogram)
+        return [ x / total for x in histogram ] if total else histogram
+
+    def read_songs(self):
+        columns = [ 'id', 'path', 'multi' ] + [ name for name, weight in SimilarityIndex.NUMBERS ] + \
+                  [ '%s_id' % name for name, weight in SimilarityIndex.DIMENSIONS ]
+        cursor = self.helper.db.cursor()
+        cursor.execute("select %s from songs order by id" % ", ".join(columns))
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    @staticmethod
+    def numbers(values):
+        "the z-score of a column (missing or not numeric values get the mean)"
+        column = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                column[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+        valid = ~np.isnan(column)
+        if not valid.any():
+            return np.zeros(len(values))
+        mean = column[valid].mean()
+        std = column[valid].std() or 1.0
+        column[~valid] = mean
+        return (column - mean) / std
+
+    @staticmethod
+    def one_hot(values):
+        "one column per value (the MAX_VALUES most used ones)"
+        ids, counts = np.unique(np.asarray(values, dtype=np.int64), return_counts=True)
+        keep = ids[np.argsort(-counts, kind='stable')[:SimilarityIndex.MAX_VALUES]]
+        return (np.asarray(values, dtype=np.int64)[:, None] == keep[None, :]).astype(np.float32)
+
+    def build(self, pitch=True):
+        """compute the vectors of all the songs and save them. The pitch
+        histograms of the songs already in the file are not read again.
+
+        Args:
+            pitch (bool, optional): read the notes of the songs. Defaults to True.
+
+        Returns:
+            int: number of songs
+        """
+        if np is None:
+            raise RuntimeError("the similarity index needs numpy (pip install numpy)")
+
+        version = self.helper.get_data_version()
+        rows = self.read_songs()
+        ids = np.array([ row['id'] for row in rows ], dtype=np.int64)
+        paths = np.array([ row['path'] for row in rows ], dtype=str)
+
+        features = []
+        for name, weight in SimilarityIndex.NUMBERS:
+            features.append(weight * SimilarityIndex.numbers([ row[name] for row in rows ])[:, None])
+        for name, weight in SimilarityIndex.DIMENSIONS:
+            features.append(weight * SimilarityIndex.one_hot([ row['%s_id' % name] or 0 for row in rows ]))
+        multi = np.array([ 1.0 if row['multi'] else -1.0 for row in rows ])
+        features.append(SimilarityIndex.MULTI_WEIGHT * multi[:, None])
+
+        pitches = np.zeros((len(rows), SimilarityIndex.PITCHES), dtype=np.float32)
+        if pitch:
+            known = {}
+            if self.paths is None:
+                self.load(check=False)
+            if self.paths is not None and self.pitches is not None:
+                known = dict(zip(self.paths.tolist(), range(len(self.paths))))
+            encoding = self.helper.config.encoding
+            for i, path in enumerate(paths.tolist()):
+                if path in known and self.pitches[known[path]].any():
+                    pitches[i] = self.pitches[known[path]]
+                else:
+                    pitches[i] = SimilarityIndex.pitch_histogram(path, encoding)
+            # centered, so songs without notes don't add to the similarity
+            features.append(SimilarityIndex.PITCH_WEIGHT * SimilarityIndex.PITCHES *
+                            (pitches - 1.0 / SimilarityIndex.PITCHES) * (pitches.sum(axis=1) > 0)[:, None])
+
+        vectors = np.hstack(features).astype(np.float32) if len(rows) else np.zeros((0, 1), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1.0
+        vectors /= norms[:, None]
+
+        with self.lock:
+            self.ids, self.vectors, self.paths, self.pitches = ids, vectors, paths, pitches
+            self.positions = dict(zip(ids.tolist(), range(len(ids))))
+            self.version = version
+        self.save()
+        if self.verbose > 0:
+            print("similarity index: %d songs, %d features" % vectors.shape)
+        return len(ids)
+
+    def save(self):
+        "write the vectors (atomic)"
+        tmpfile = "%s.%d.tmp" % (self.fname, os.getpid())
+        try:
+            with open(tmpfile, 'wb') as f:
+                np.savez(f, ids=self.ids, vectors=self.vectors, paths=self.paths, pitches=self.pitches)
+            os.replace(tmpfile, self.fname)
+        except OSError as e:
+            # e.g. read only workers: the index is kept in memory
+            if self.verbose > 0:
+                print("can't write the similarity index %s: %s" % (self.fname, e))
+        finally:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+
+    def load(self, check=True):
+        """read the vectors saved by build()
+
+        Args:
+            check (bool, optional): only use them if they have the songs of the database. Defaults to True.
+
+        Returns:
+            bool: True if the file was read
+        """
+        if np is None or not os.path.exists(self.fname):
+            return False
+        with np.load(self.fname) as data:
+            ids, vectors, paths, pitches = data['ids'], data['vectors'], data['paths'], data['pitches']
+        if check:
+            cursor = self.helper.db.cursor()
+            cursor.execute("select id from songs order by id")
+            current = np.array([ row[0] for row in cursor.fetchall() ], dtype=np.int64)
+            cursor.close()
+            if not np.array_equal(current, ids):
+                return False
+        with self.lock:
+            self.ids, self.vectors, self.paths, self.pitches = ids, vectors, paths, pitches
+            self.positions = dict(zip(ids.tolist(), range(len(ids))))
+            if check:
+                self.version = self.helper.get_data_version()
+        return True
+
+    def stale(self):
+        "the data changed since the index was built (or read)"
+        return np is not None and self.version != self.helper.get_data_version()
+
+    def refresh(self):
+        """build the index again if the data changed (read it from the file
+        if it has the songs of the database). One build at a time: run it in
+        the background, the queries use the previous index meanwhile
+
+        Returns:
+            int: number of songs, 0 if nothing was done
+        """
+        if np is None:
+            raise RuntimeError("the similarity index needs numpy (pip install numpy)")
+        with self.build_lock:
+            if not self.stale():
+                return 0
+            if self.version is None and self.load():
+                return len(self.ids)
+            return self.build()
+
+    def similar(self, id, k=10):
+        """the k songs most similar to a song
+
+        Args:
+            id (int): the song
+            k (int, optional): number of songs. Defaults to 10.
+
+        Raises:
+            KeyError: if the song doesn't exist (in the index being used)
+            IndexNotReady: if the index was never built (see refresh())
+
+        Returns:
+            list: list of (id, similarity) from the most similar
+        """
+        if np is None:
+            raise RuntimeError("the similarity index needs numpy (pip install numpy)")
+        if self.vectors is None and not self.load(check=False):
+            raise IndexNotReady("the similarity index is being built")
+        with self.lock:
+            ids, vectors, positions = self.ids, self.vectors, self.positions
+        pos = positions[int(id)]
+        scores = vectors @ vectors[pos]
+        scores[pos] = -np.inf
+        k = max(0, min(int(k), len(ids) - 1))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [ (int(ids[i]), round(float(scores[i]), 4)) for i in best ]
+
+    def similar_songs(self, id, k=10):
+        """the k songs most similar to a song, with their data
+
+        Returns:
+            list: list of dicts (the song row and its similarity)
+        """
+        result = self.similar(id, k)
+        songs = self.helper.get_songs_by_id(id for id, score in result)
+        items = []
+        for id, score in result:
+            if id in songs:
+                item = dict(songs[id])
+                item['similarity'] = score
+                items.append(item)
+        return items
@@ -13,7 +13,8 @@
 import os
 from collections import namedtuple
 import sqlite3
-import shutil
+import threading
+import urllib.request
 import mutagen.mp3
 
 import sys
@@ -22,16 +23,170 @@ sys.path.append('..')
 from ultrastar.appenv import AppEnv
 from ultrastar.literals import *
 from ultrastar.helper import Helper
-
-SongInfo = namedtuple('SongInfo', ['config','is_multi', 'dirname' ])
+from ultrastar.metrics import Metrics, TimedConnection
+from ultrastar.dimensions import Dimensions
+from ultrastar.facets import FacetBrowser
+from ultrastar.playlistgen import PlaylistGenerator
+from ultrastar.resultcache import ResultCache
+from ultrastar.songrecord import SongRecord
+from ultrastar.ingest import SongIngest
+from ultrastar.backups import BackupManifest
+from ultrastar.history import MetadataHistory
+from ultrastar.catalog import Catalog
+from ultrastar.songindex import SongIndex
+from ultrastar.similarity import SimilarityIndex
+from ultrastar.sprites import SpriteSheets
+from ultrastar.queryguard import QueryGuard
+from ultrastar.scrubber import IntegrityScrubber
+
+# files: the names in the song dir (os.path.normcase), None if unknown
+SongInfo = namedtuple('SongInfo', ['config','is_multi', 'dirname', 'files' ], defaults=[ None ])
 PlaylistInfo = namedtuple('PlaylistInfo', ['name','path', 'filename', 'songs', 'len' ])  
 
 class UltraStarHelper:
+
+    # materialized artist aggregates, maintained by update_artists()
+    SQL_ARTISTS = """
+        create table artists(
+            id integer primary key AUTOINCREMENT,
+            name text not null,
+            norm text not null unique,
+            sort_key text not null,
+            songs integer not null default 0,
+            duration real not null default 0,
+            languages text not null default '',
+            cover_id integer,
+            cover_size integer not null default 0,
+            cover_mtime real not null default 0
+        );
+        """
+
+    # song fields that change the artists aggregates
+    ARTIST_FIELDS = [ 'artist', 'artist_sort', 'language', 'duration', 'cover', 'dirname' ]
+
     def __init__(self, config):
         self.config = config
         self.verbose = self.config.verbose
         self.db = None
+        self.metrics = Metrics(slow_query_ms=self.config.slow_query_ms,
+                               slow_query_log=self.config.slow_query_log,
+                               verbose=self.verbose or 0)
+        self.dimensions = Dimensions()
+        self.data_version = 0
+        self.facets = FacetBrowser(self)
+        self.result_cache = ResultCache(self, self.config.result_cache_bytes)
+        self.backups = BackupManifest(self)
+        self.history = MetadataHistory(self)
+        self.songindex = SongIndex(self)
+        self.similarity = SimilarityIndex(self)
+        self.sprites = SpriteSheets(self)
+        self.query_guard = QueryGuard(self)
+        self.scrubber = IntegrityScrubber(self)
+        self.writes = 0
+        self.persist_enabled = True
+        self.persist_lock = threading.Lock()
+        self.persist_thread = None
+        self.persist_stop = threading.Event()
+
+    def connect(self, dbfile, read_only=False):
+        """open a database connection instrumented with the helper's metrics
 
+        Args:
+            dbfile (str): the database file (or sqlite uri)
+            read_only (bool, optional): open the file in read only mode. Defaults to False.
+
+        Returns:
+            sqlconn: the database connection
+        """
+        if read_only:
+            uri = "file:%s?mode=ro" % urllib.request.pathname2url(os.path.abspath(dbfile))
+            db = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=TimedConnection)
+        else:
+            db = sqlite3.connect(dbfile, check_same_thread=False, factory=TimedConnection)
+        db.metrics = self.metrics
+        db.row_factory = sqlite3.Row
+        db.create_function("normalize", 1, Helper.normalize, deterministic=True)
+        return db
+
+
+    def open_db(self, load=True):
+        """connect to the database file, or in in_memory mode, to a database
+        in RAM with a copy of the file (see persist())
+
+        Args:
+            load (bool, optional): in_memory, copy the file contents. Defaults to True.
+
+        Returns:
+            sqlconn: the database connection
+        """
+        if not self.config.in_memory:
+            return self.connect(self.config.dbfile)
+
+        db = self.connect(":memory:")
+        if load and os.path.exists(self.config.dbfile):
+            disk = sqlite3.connect(self.config.dbfile)
+            disk.backup(db)
+            disk.close()
+            if self.verbose > 0:
+                print("database %s loaded in memory" % self.config.dbfile)
+        return db
+
+    def persist(self):
+        """in_memory mode, write the database to the file (sqlite backup api)
+
+        Returns:
+            bool: true if the database was written
+        """
+        if not self.config.in_memory or not self.config.persistent or not self.db:
+            return False
+        if not self.persist_enabled or self.db.in_transaction:
+            # only committed data (the timer tries again later)
+            return False
+        with self.persist_lock:
+            self.writes = 0
+            disk = sqlite3.connect(self.config.dbfile)
+            try:
+                self.db.backup(disk)
+            finally:
+                disk.close()
+        if self.verbose > 1:
+            print("database persisted to %s" % self.config.dbfile)
+        return True
+
+    def start_persistence(self):
+        """in_memory mode, persist the changes every persist_interval seconds"""
+        if not self.config.in_memory or not self.config.persistent or self.persist_thread:
+            return
+        if not self.config.persist_interval:
+            return
+
+        def loop():
+            while not self.persist_stop.wait(self.config.persist_interval):
+                if self.writes:
+                    self.persist()
+
+        self.persist_thread = threading.Thread(target=loop, name="persist", daemon=True)
+        self.persist_thread.start()
+
+    def bump_data_version(self):
+        """mark the data as changed, so the caches built over it are invalidated
+        (and in in_memory mode, persist it after persist_writes changes)"""
+        self.data_version += 1
+        self.writes += 1
+        if (self.config.in_memory and self.config.persist_writes and
+            self.writes >= self.config.persist_writes):
+            self.persist()
+
+    def get_data_version(self):
+        """the version of the data: changes when this helper modifies the
+        database, or when another connection commits changes on it
+
+        Returns:
+            tuple: (helper version, sqlite data_version)
+        """
+        if not self.db:
+            return (self.data_version, 0)
+        return (self.data_version, self.db.execute("PRAGMA data_version").fetchone()[0])
 
     def test_db(self):
         """shows the database contents
@@ -64,9 +219,18 @@ class UltraStarHelper:
         """
         sql_prologue = [
             "drop table if exists songs;",
-            "drop table if exists multi;"
+            "drop table if exists multi;",
+            "drop table if exists artists;"
+        ]
+        sql_epilogue = [
+            "create index songs_artist_norm on songs(artist_norm);",
+            "create index artists_sort_key on artists(sort_key);",
+            "create index songs_genre_id on songs(genre_id);",
+            "create index songs_edition_id on songs(edition_id);",
+            "create index songs_language_id on songs(language_id);",
+            "create index songs_match_key on songs(match_key);",
+            "create index song_trigrams_trigram on song_trigrams(trigram);"
         ]
-        sql_epilogue = []
 
         sql_songs = """
         create table songs(
@@ -86,7 +250,16 @@ class UltraStarHelper:
             path text not null,
             dirname text not null,
             duration timestamp not null default 0,
-            multi integer not null default 0
+            multi integer not null default 0,
+            artist_norm text not null default '',
+            artist_sort text not null default '',
+            genre_id integer not null default 0,
+            edition_id integer not null default 0,
+            language_id integer not null default 0,
+            has_cover integer not null default 1,
+            has_video integer not null default 1,
+            match_key text not null default '',
+            match_grams integer not null default 0
         );
         """
         sql_multi = """
@@ -102,9 +275,17 @@ class UltraStarHelper:
 
         for sql_sentence in sql_prologue:
             cursor.execute(sql_sentence)
+        self.dimensions.drop_tables(cursor)
+        self.songindex.drop_tables(cursor)
         
         cursor.execute(sql_songs)
         cursor.execute(sql_multi)
+        cursor.execute(UltraStarHelper.SQL_ARTISTS)
+        self.dimensions.create_tables(cursor)
+        self.songindex.create_tables(cursor)
+        # kept between loads (uses dirname, not the song id)
+        cursor.execute(PlaylistGenerator.SQL_PLAYED)
+        self.history.create_tables(cursor)
         
         for sql_sentence in sql_epilogue:
             cursor.execute(sql_sentence)
@@ -122,10 +303,18 @@ class UltraStarHelper:
         sql_insert_songs = """
         insert into SONGS(title, artist, language, edition, genre, year,
                         mp3, cover, video, videogap, bpm, gap, 
-                        path, dirname, duration, multi) 
+                        path, dirname, duration, multi,
+                        artist_norm, artist_sort,
+                        genre_id, edition_id, language_id,
+                        has_cover, has_video,
+                        match_key, match_grams) 
                 values ( ?, ?, ?, ?, ?, ?, 
                         ?, ?, ?, ?, ?, ?,
-                        ?, ?, ?, ? );
+                        ?, ?, ?, ?,
+                        ?, ?,
+                        ?, ?, ?,
+                        ?, ?,
+                        ?, ? );
         """
 
         sql_insert_players = """
@@ -135,23 +324,35 @@ class UltraStarHelper:
         cursor = self.db.cursor()
 
         item_list = []
-        if isinstance(items,dict):
-            item_list.append(dict)
+        if isinstance(items,(dict, SongRecord)):
+            item_list.append(items)
         else:
             item_list = items
 
         for item in item_list:
-            cursor.execute(sql_insert_songs, (item['title'], item['artist'],
-                                            item['language'], 
-                            item['edition'], item['genre'], item['year'],
-                            item['mp3'],item['cover'],item['video'],
-                            item['videogap'],item['bpm'],item['gap'],
-                            item['path'], item['dirname'],
-                            item['duration'], item['multi'] ))
+            if not isinstance(item, SongRecord):
+                item = SongRecord(item, item['dirname'], players=item['players'].items(),
+                                  duration=item['duration'], multi=item['multi'],
+                                  has_cover=item.get('has_cover', 1), has_video=item.get('has_video', 1))
+
+            match_key = SongIndex.key(item.artist, item.title)
+            cursor.execute(sql_insert_songs, (item.title, item.artist, item.language,
+                            item.edition, item.genre, item.year,
+                            item.mp3, item.cover, item.video,
+                            item.videogap, item.bpm, item.gap,
+                            item.path, item.dirname,
+                            item.duration, item.multi,
+                            Helper.normalize(item.artist),
+                            item.artist_sort,
+                            self.dimensions.resolve('genre', item.genre),
+                            self.dimensions.resolve('edition', item.edition),
+                            self.dimensions.resolve('language', item.language),
+                            item.has_cover, item.has_video,
+                            match_key, len(SongIndex.trigrams(match_key)) ))
 
             id = cursor.lastrowid
-            for key in item['players']:
-                val = item['players'][key]
+            self.songindex.add(cursor, id, match_key)
+            for key, val in item.players:
                 cursor.execute(sql_insert_players,(id, key, val))
         
         cursor.close()
@@ -168,65 +369,176 @@ class UltraStarHelper:
         """
 
         if not refresh:
-            # allways use db file
-            #if self.config.read_from_db:
-            self.db = sqlite3.connect(self.config.dbfile, check_same_thread=False)
-            #else:
-            #self.db = sqlite3.connect('file:cachedb?mode=memory&cache=shared', check_same_thread=False)
+            # the db file, or its copy in memory (in_memory)
+            self.db = self.open_db()
             self.db.row_factory = sqlite3.Row 
         else:
             # don't modify the database
             self.db.row_factory = sqlite3.Row 
+
+        self.dimensions.db = self.db
+        self.dimensions.aliases = {}
         
         if init and not self.config.read_from_db:
             self.create_tables()
             self.insert_into_db(config)
+            self.update_artists()
+            self.dimensions.update_counts()
             if self.verbose > 1:
                 print("%d records inserted in DB" % len(config))
+        else:
+            self.upgrade_db()
         
         self.db.commit()
+        self.bump_data_version()
 
-    
-    def restore_backup(self, delete_backup=False):
-        """restores the backup file to revert the situation
+    def upgrade_db(self):
+        """add the tables and columns missing in a database created by a
+        previous version (read_from_db), and build their data
+        """
+        cursor = self.db.cursor()
+        cursor.execute("select name from sqlite_master where type='table' and name='songs'")
+        if not cursor.fetchone():
+            cursor.close()
+            return
+
+        cursor.execute("PRAGMA table_info(songs)")
+        columns = [ row[1] for row in cursor.fetchall() ]
+        if 'artist_norm' not in columns:
+            cursor.execute("alter table songs add column artist_norm text not null default ''")
+            cursor.execute("alter table songs add column artist_sort text not null default ''")
+            cursor.execute("update songs set artist_norm = normalize(artist)")
+            cursor.execute("create index songs_artist_norm on songs(artist_norm)")
+
+        if 'genre_id' not in columns:
+            for dimension in Dimensions.TABLES.keys():
+                cursor.execute("alter table songs add column %s_id integer not null default 0" % dimension)
+            self.dimensions.drop_tables(cursor)
+            self.dimensions.create_tables(cursor)
+            self.dimensions.create_indexes(cursor)
+            self.dimensions.resolve_songs()
+            self.dimensions.update_counts()
+
+        cursor.execute("select name from sqlite_master where type='table' and name='artists'")
+        if not cursor.fetchone():
+            cursor.execute(UltraStarHelper.SQL_ARTISTS)
+            cursor.execute("create index artists_sort_key on artists(sort_key)")
+            self.update_artists()
+
+        if 'has_cover' not in columns:
+            cursor.execute("alter table songs add column has_cover integer not null default 1")
+            cursor.execute("alter table songs add column has_video integer not null default 1")
+            cursor.execute("select id, dirname, cover, video from songs")
+            for row in cursor.fetchall():
+                cursor.execute("update songs set has_cover=?, has_video=? where id=?",
+                               (UltraStarHelper.has_file(None, row['dirname'], row['cover']),
+                                UltraStarHelper.has_file(None, row['dirname'], row['video']), row['id']))
+
+        if 'match_key' not in columns:
+            cursor.execute("alter table songs add column match_key text not null default ''")
+            cursor.execute("alter table songs add column match_grams integer not null default 0")
+            self.songindex.drop_tables(cursor)
+            self.songindex.create_tables(cursor)
+            self.songindex.create_indexes(cursor)
+            self.songindex.reindex()
+
+        cursor.execute(PlaylistGenerator.SQL_PLAYED)
+        self.history.create_tables(cursor)
+        cursor.close()
+
+    def update_artists(self, norms=None):
+        """build the artists aggregates (song count, duration, languages and
+        representative cover) from the songs table
 
         Args:
-            delete_backup (bool, optional): if true, deletes the back files. Defaults to False.
+            norms (list, optional): normalized names of the artists to update. Defaults to None (all).
         """
+        cursor = self.db.cursor()
+        sql = "select id, artist, artist_norm, artist_sort, language, duration, dirname, cover from songs"
+        if norms is None:
+            cursor.execute("delete from artists")
+            cursor.execute("%s order by artist_norm, id" % sql)
+        else:
+            norms = list(set(norms))
+            if not norms:
+                cursor.close()
+                return
+            cursor.execute("%s where artist_norm in (%s) order by artist_norm, id" % (sql, ",".join("?" * len(norms))), norms)
+        rows = cursor.fetchall()
 
-        for entry in os.listdir(self.config.full_songs_dir):
-        
-            full_path = os.path.sep.join([self.config.full_songs_dir, entry])
-            if not os.path.isdir(full_path):
+        artists = {}
+        for row in rows:
+            entry = artists.get(row['artist_norm'])
+            if entry is None:
+                entry = artists[row['artist_norm']] = {
+                    'name': row['artist'], 'norm': row['artist_norm'], 'sort_key': '',
+                    'songs': 0, 'duration': 0, 'languages': set(),
+                    'cover_id': row['id'], 'cover_size': -1, 'cover_mtime': 0 }
+            entry['songs'] += 1
+            entry['duration'] += row['duration'] or 0
+            entry['languages'].add(row['language'])
+            if row['artist_sort'] and not entry['sort_key']:
+                entry['sort_key'] = Helper.normalize(row['artist_sort'])
+
+            try:
+                st = os.stat(os.path.sep.join([row['dirname'], row['cover']]))
+            except OSError:
                 continue
+            if self.config.artist_cover == "recent":
+                better = (st.st_mtime, st.st_size) > (entry['cover_mtime'], entry['cover_size'])
+            else:
+                better = (st.st_size, st.st_mtime) > (entry['cover_size'], entry['cover_mtime'])
+            if better:
+                entry['cover_id'] = row['id']
+                entry['cover_size'] = st.st_size
+                entry['cover_mtime'] = st.st_mtime
+
+        if norms is not None:
+            gone = [ norm for norm in norms if norm not in artists ]
+            if gone:
+                cursor.execute("delete from artists where norm in (%s)" % ",".join("?" * len(gone)), gone)
+
+        for entry in artists.values():
+            cursor.execute("""
+                insert into artists(name, norm, sort_key, songs, duration, languages,
+                                    cover_id, cover_size, cover_mtime)
+                    values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                on conflict(norm) do update set name=excluded.name, sort_key=excluded.sort_key,
+                    songs=excluded.songs, duration=excluded.duration, languages=excluded.languages,
+                    cover_id=excluded.cover_id, cover_size=excluded.cover_size,
+                    cover_mtime=excluded.cover_mtime;
+                """, (entry['name'], entry['norm'], entry['sort_key'] or entry['norm'],
+                      entry['songs'], entry['duration'], ", ".join(sorted(entry['languages'])),
+                      entry['cover_id'], max(entry['cover_size'], 0), entry['cover_mtime']))
+        cursor.close()
 
-            # process only entries here.
-            # check if there is a [MULTI] entry (duet) or single.
-            song_config = "%s" % os.path.sep.join( [ full_path, entry ] )
-            song_config_multi = "%s [MULTI]" % song_config
-            song_config = "%s.txt" % song_config
-            song_config_multi = "%s.txt" % song_config_multi
+    
+    def restore_backup(self, delete_backup=False, dry_run=False):
+        """restores the backup file to revert the situation, using the backups manifest
+        (see BackupManifest.restore)
 
-            song_config_bck = "%s.bak" % song_config
-            song_config_multi_bck = "%s.bak" % song_config_multi
+        Args:
+            delete_backup (bool, optional): if true, deletes the back files. Defaults to False.
+            dry_run (bool, optional): if true, only show the files that would be restored. Defaults to False.
 
-            if os.path.exists(song_config_bck):
-                shutil.copy2(song_config_bck, song_config) 
-                if self.verbose > 1:
-                    print("restoring: %s" % song_config)
-                if delete_backup:
-                    os.remove(song_config_bck)
-                    if self.verbose > 1:
-                        print("deleting backup file : %s" % song_config_bck)
-
-            if os.path.exists(song_config_multi_bck):
-                shutil.copy2(song_config_multi_bck, song_config_multi) 
-                if self.verbose > 1:
-                    print("restoring: %s" % song_config_multi)
-                if delete_backup:
-                    os.remove(song_config_multi_bck)
-                    if self.verbose > 1:
-                        print("deleting backup file : %s" % song_config_multi_bck)
+        Returns:
+            dict: count of files by status (restored, unchanged, missing)
+        """
+        if not self.db:
+            self.db = self.connect(self.config.dbfile)
+        return self.backups.restore(dry_run=dry_run, delete_backup=delete_backup)
+
+    def do_backup(self, filename):
+        """backup the file before modifying it, and store it in the backups manifest.
+        Does nothing if do_backup is false in the configuration. The changes done
+        with set() are not backed up: they are kept in the history
+
+        Args:
+            filename (str): the file
+        """
+        if not self.config.do_backup:
+            return
+        self.backups.do_backup(filename)
 
 
     def add_tags(self, tags, data, fname):
@@ -247,13 +559,31 @@ class UltraStarHelper:
             entry = "#%s:%s\n" % (tag.upper(), value)
             data = entry + data
 
-        Helper.do_backup(fname)
+        self.do_backup(fname)
         with open(fname, 'w', encoding=self.config.encoding) as f:
             f.write(data)
 
 
 
-    def merge_config(self, config, config_multi, dirname, path):
+    @staticmethod
+    def has_file(files, dirname, name):
+        """check if a file of the song exists
+
+        Args:
+            files (set): the names in the song dir (os.path.normcase), None to ask the filesystem
+            dirname (str): the song dir
+            name (str): the file name
+
+        Returns:
+            int: 1 if exists, 0 if not
+        """
+        if not name or name == "UNKNOWN":
+            return 0
+        if files is not None:
+            return 1 if os.path.normcase(name) in files else 0
+        return 1 if os.path.exists(os.path.sep.join([dirname, name])) else 0
+
+    def merge_config(self, config, config_multi, dirname, path, files=None):
         """merge the multi (duet) configuration with the single one, to get all the data
 
         Args:
@@ -261,36 +591,36 @@ class UltraStarHelper:
             config_multi (dict): dict with the duet (multi) config
             dirname (str): the dirname of the song
             path (str): full path of the configuration file for the song
+            files (set, optional): the names in the song dir (os.path.normcase). Defaults to None (check the filesystem).
 
         Returns:
-            dict: merged dict.
+            SongRecord: the merged record.
         """
-        players = {}
+        players = []
         is_multi = 0
         if config_multi:
             for item in config_multi.keys():
                 if item.startswith('duetsinger'):
                     is_multi = 1
                     entry = item.replace('duetsinger','')
-                    players[entry] = config_multi[item]
+                    players.append((entry, config_multi[item]))
 
         filename_mp3 = os.path.sep.join([dirname,config['mp3']])
         
-        # add synthetic fields
-
-        config['players'] = players
-        config['path'] = path
-        config['dirname'] = dirname
-        config['duration'] = 0
-        
-        if os.path.exists(filename_mp3):
+        duration = 0
+        if UltraStarHelper.has_file(files, dirname, config['mp3']):
             try:
-                config['duration'] = mutagen.mp3.MP3(filename_mp3).info.length
+                duration = mutagen.mp3.MP3(filename_mp3).info.length
             except Exception as e:
                 print("Warning: %s on %s" % (e, filename_mp3))
+
+        has_cover = UltraStarHelper.has_file(files, dirname, config['cover'])
+        has_video = UltraStarHelper.has_file(files, dirname, config['video'])
+        if self.verbose > 1 and not has_cover:
+            print("Warning: cover '%s' not found in %s" % (config['cover'], dirname))
                       
-        config['multi'] = is_multi
-        return config
+        return SongRecord(config, dirname, players=players, duration=duration, multi=is_multi,
+                          has_cover=has_cover, has_video=has_video)
 
     def get_song(self,artist=None, title=None, song_path=None):
         """get the contents of the song from DB
@@ -319,9 +649,28 @@ class UltraStarHelper:
             return None
         
         data = dict(data)
-        data = self.merge_config(data,None,data['dirname'], data['path'])
+        data['players'] = {}
         return data
 
+    def get_songs_by_id(self, ids):
+        """read many songs from the database
+
+        Args:
+            ids (iterable): the song ids
+
+        Returns:
+            dict: id -> song row
+        """
+        ids = list(ids)
+        songs = {}
+        cursor = self.db.cursor()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor.execute("select * from songs where id in (%s)" % ",".join("?" * len(chunk)), chunk)
+            songs.update((row['id'], row) for row in cursor.fetchall())
+        cursor.close()
+        return songs
+
     def get_songs(self, dirname):
         """retrieve the list of songs in the filesystem
 
@@ -331,34 +680,60 @@ class UltraStarHelper:
         Returns:
             list: List of SongInfo
         """
+        return list(self.iter_songs(dirname))
 
-        songs = []
-        for entry in os.listdir(dirname):
-        
-            full_path = os.path.sep.join([dirname, entry])
-            if not os.path.isdir(full_path):
-                continue
+    def iter_songs(self, dirname):
+        """walk the song directory, yielding the songs found
+
+        Args:
+            dirname (str): the full path to the song directory
+
+        Yields:
+            SongInfo: the song files
+        """
+        for entry, full_path, files in self.scan_songs_dir(dirname):
 
             # process only entries here.
             # check if there is a [MULTI] entry (duet) or single.
-            song_config = "%s" % os.path.sep.join( [ full_path, entry ] )
-            song_config_multi = "%s [MULTI]" % song_config
-            song_config = "%s.txt" % song_config
-            song_config_multi = "%s.txt" % song_config_multi
+            song_config = "%s.txt" % entry
+            song_config_multi = "%s [MULTI].txt" % entry
 
-            if not os.path.exists(song_config):
+            if not os.path.normcase(song_config) in files:
                 if self.verbose > 0:
                     print("Warning: '%s' has no config" % entry)
                 continue
 
-            if not os.path.exists(song_config_multi):
+            if os.path.normcase(song_config_multi) in files:
+                song_config_multi = os.path.sep.join([full_path, song_config_multi])
+            else:
                 song_config_multi = None
 
-            songs.append( SongInfo(config=song_config,
-                                is_multi=song_config_multi,
-                                dirname=full_path)
-                        )
-        return songs
+            yield SongInfo(config=os.path.sep.join([full_path, song_config]),
+                           is_multi=song_config_multi,
+                           dirname=full_path,
+                           files=files)
+
+    def scan_songs_dir(self, dirname):
+        """list the song dirs with one scandir per directory (no stat calls)
+
+        Args:
+            dirname (str): the full path to the song directory
+
+        Yields:
+            tuple: (entry, full path, set of the file names in it, os.path.normcase)
+        """
+        with os.scandir(dirname) as entries:
+            for dir_entry in entries:
+                if not dir_entry.is_dir():
+                    continue
+                full_path = os.path.sep.join([dirname, dir_entry.name])
+                try:
+                    with os.scandir(full_path) as children:
+                        files = frozenset(os.path.normcase(child.name) for child in children)
+                except OSError as e:
+                    print("Warning: can't read %s: %s" % (full_path, e))
+                    continue
+                yield dir_entry.name, full_path, files
 
     
 
@@ -378,6 +753,7 @@ class UltraStarHelper:
         playlist_name = None
         playlist_songs = []
         playlist_file = os.path.basename(fname)
+        entries = []
 
         with open(fname,'r', encoding=self.config.encoding) as f:
             text = f.read()
@@ -393,23 +769,33 @@ class UltraStarHelper:
                     l = l.strip()
                     if not l:
                         continue
-                    artist,title = list(map(lambda x: x.strip(),l.split(":")))
-                    song_dir = " - ".join([artist, title])
-                    song_path = os.path.sep.join([self.config.full_songs_dir, song_dir])
-                    entry = { 'artist': artist, 'title': title, 'path': song_path }
-                    entry_db = self.get_song(artist=artist, title=title)
-                    if not entry_db:
-                        entry['found'] = False
-                    else:
-                        entry = entry_db
-                        entry['found'] = True
+                    artist,title = list(map(lambda x: x.strip(),l.split(":", 1)))
+                    entries.append((artist, title))
+
+        # all the entries are resolved at once (exact key, then similarity)
+        resolved = self.songindex.resolve(entries, self.config.playlist_match_threshold)
+        songs = self.get_songs_by_id(set(id for id, confidence in resolved if id is not None))
+
+        for (artist, title), (id, confidence) in zip(entries, resolved):
+            if id is not None and id in songs:
+                entry = dict(songs[id])
+                entry['players'] = {}
+                entry['found'] = True
+                entry['confidence'] = confidence
+                playlist_songs.append(entry)
+                continue
+
+            song_dir = " - ".join([artist, title])
+            song_path = os.path.sep.join([self.config.full_songs_dir, song_dir])
+            entry = { 'artist': artist, 'title': title, 'path': song_path,
+                      'found': False, 'confidence': confidence }
 
-                    if not os.path.exists(song_path) or not os.path.isdir(song_path):
-                        if self.verbose > 1:
-                            print("Invalid song entry on playlist %s: %s, song dir not found" % (playlist_name, song_path))
-                            continue
-                                  
-                    playlist_songs.append(entry)
+            if not os.path.exists(song_path) or not os.path.isdir(song_path):
+                if self.verbose > 1:
+                    print("Invalid song entry on playlist %s: %s, song dir not found" % (playlist_name, song_path))
+                    continue
+                          
+            playlist_songs.append(entry)
 
         if  not playlist_name or playlist_songs == []:
             if self.verbose > 1:
@@ -424,6 +810,21 @@ class UltraStarHelper:
 
 
 
+    def playlists_version(self):
+        """the name, modification time and size of the playlist files, to know
+        if they changed (they aren't stored in the database)
+
+        Returns:
+            tuple: tuple of (name, mtime, size)
+        """
+        version = []
+        with os.scandir(self.config.full_playlist_dir) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith('.upl'):
+                    st = entry.stat()
+                    version.append((entry.name, st.st_mtime_ns, st.st_size))
+        return tuple(sorted(version))
+
     def get_playlists(self, filter=None):
         """return the list of the playlists
 
@@ -434,6 +835,8 @@ class UltraStarHelper:
 
         playlists = []
         for entry in os.listdir(self.config.full_playlist_dir):
+            if not entry.lower().endswith('.upl'):
+                continue
             full_path = os.path.sep.join([self.config.full_playlist_dir, entry])
             playlist = self.read_playlist(full_path)
             if playlist:
@@ -529,10 +932,19 @@ class UltraStarHelper:
             songs (list): list of SongInfo
 
         Returns:
-            list: list of dicts with the configuration values for the songs
+            list: list of SongRecord with the configuration values for the songs
         """
-        data = []
+        return list(self.iter_records(songs))
+
+    def iter_records(self, songs):
+        """read the config of the songs, one at a time
+
+        Args:
+            songs (iterable): SongInfo
 
+        Yields:
+            SongRecord: the configuration values of each song
+        """
         for song in songs:
             
             text = None
@@ -558,36 +970,109 @@ class UltraStarHelper:
 
 
             if config:
-                config = self.merge_config(config, config_multi, song.dirname, song.config)       
-                data.append(config)
+                yield self.merge_config(config, config_multi, song.dirname, song.config, song.files)
 
-        return data
 
+    def ingest(self, batch_size=None, progress=None):
+        """(re)load the database from the song files, streaming: songs are
+        committed in batches and can be queried while the load goes on
+
+        Args:
+            batch_size (int, optional): songs per commit. Defaults to config.ingest_batch.
+            progress (callable, optional): called with the IngestProgress after each commit. Defaults to None.
+
+        Returns:
+            IngestProgress: the final counters
+        """
+        if not self.db:
+            self.db = self.open_db(load=False)
+        progress = SongIngest(self, batch_size, progress).run()
+        self.persist()
+        return progress
+
+    def rebuild(self, progress=None):
+        """reload the database from the song files into a new database in
+        memory, while this one keeps serving the queries, and then replace
+        it in one step (in_memory: the connection is swapped, on disk: the
+        new database is copied into the file with the backup api, from its
+        own connection, so the statements open on this one don't make it
+        fail; sqlite retries while the file is busy)
+
+        Args:
+            progress (callable, optional): called with the IngestProgress after each batch. Defaults to None.
+
+        Returns:
+            IngestProgress: the final counters
+        """
+        builder = UltraStarHelper(self.config)
+        builder.persist_enabled = False
+        # start from a copy: the tables kept between loads (played, history, backups)
+        builder.db = self.connect(":memory:")
+        self.db.backup(builder.db)
+        result = builder.ingest(progress=progress)
+
+        if self.config.in_memory:
+            # requests running on the old connection finish with the old data
+            self.db = builder.db
+            self.dimensions.db = self.db
+            self.persist()
+        else:
+            disk = sqlite3.connect(self.config.dbfile, timeout=30)
+            try:
+                builder.db.backup(disk)
+            finally:
+                disk.close()
+                builder.db.close()
+        self.dimensions.aliases = {}
+        self.bump_data_version()
+        return result
 
     def refresh_db(self):
         """
             Refresh the database (load the values again into the database from the file)
         """
-        songs = self.get_songs(self.config.full_songs_dir)
-        config = self.process_songs(songs)
-        self.store_in_db(config, refresh=True)
+        self.ingest()
 
 
     def load_db(self):
         """
             load the database
         """
-        config = []
         if not self.config.read_from_db:
-            songs = self.get_songs(self.config.full_songs_dir)
-            config = self.process_songs(songs)
             if self.verbose > 0:
                 print("initializing db from song files")
+            self.db = self.open_db(load=False)
+            self.ingest()
+        else:
+            self.store_in_db([])
+        self.start_persistence()
 
-        self.store_in_db(config)
 
 
 
+    def open_read_only(self):
+        """use the database as is, in read only mode, without loading it nor
+        upgrading it (e.g. the web workers, that share a catalog built once)
+        """
+        self.db = self.connect(self.config.dbfile, read_only=True)
+        self.dimensions.db = self.db
+        self.dimensions.aliases = {}
+        self.bump_data_version()
+
+    def build_catalog(self, fname=None):
+        """write the memory mapped snapshot of the songs (see Catalog)
+
+        Args:
+            fname (str, optional): the catalog file. Defaults to config.catalog_file.
+
+        Returns:
+            int: number of songs
+        """
+        fname = fname or self.config.catalog_file
+        count = Catalog.build(self.db, fname)
+        if self.verbose > 0:
+            print("catalog %s built with %d songs" % (fname, count))
+        return count
 
     def store_playlist(self, songs, name):
         """stores a list of songs as a playlist in ultrastar format
@@ -604,29 +1089,35 @@ class UltraStarHelper:
             text.append("%s : %s" % (song['artist'], song['title']))
         
         filename = os.path.sep.join([self.config.full_playlist_dir, "%s.upl" % name])
-        Helper.do_backup(filename)
-        with open(filename, 'w', encoding=self.config.encoding) as f:
-            f.write("\n".join(text))
+        self.do_backup(filename)
+        Helper.atomic_write(filename, "\n".join(text), self.config.encoding)
+        if self.db:
+            self.db.commit()
 
         if self.verbose > 1:
             print("Playlist %s created with %d songs" % (name, len(songs)))
 
 
     def shutdown(self):
-        """ends the execution, closes the database
+        """ends the execution, closes the database (in_memory, writes it to the file)
         """
+        self.persist_stop.set()
+        self.scrubber.shutdown()
+        if self.writes:
+            self.persist()
         self.db.close()
         raise SystemExit
     
 
 
-    def update_config(self, filename, field, newvalue):
+    def update_config(self, filename, field, newvalue, backup=True):
         """update the song config, changing the given field to the required value
 
         Args:
             filename (str): path for song configuration file
             field (str): the field name
             newvalue (str): the new value for the field
+            backup (bool, optional): backup the file first (see do_backup). Defaults to True.
         """
         
         new_file = []
@@ -640,28 +1131,31 @@ class UltraStarHelper:
                     # if found the required field:
                     if command.lower() == field.lower():
                         
+                        line_value = newvalue
                         if command.lower() in [ "bpm", "videogap" ]:
-                            newvalue = value.replace('.',',')
+                            line_value = str(newvalue).replace('.',',')
                         
-                        new_line="#%s:%s" % (field.upper(),newvalue)
+                        new_line="#%s:%s" % (field.upper(),line_value)
                         new_file.append(new_line)
                     else:
                         new_file.append(l)
                 else:
                     new_file.append(l)
         
-        Helper.do_backup(filename)
+        if backup:
+            self.do_backup(filename)
         with open(filename, 'w', encoding=self.config.encoding) as f:
             f.write("\n".join(new_file))    
         
 
-    def update_song_file(self, song_dirname, field, value):
+    def update_song_file(self, song_dirname, field, value, backup=True):
         """updates the song config (all the files) with the new value for the field
 
         Args:
             song_dirname (str): songs' directory
             field (str): the name of the field being changed
             value (str): the new value
+            backup (bool, optional): backup the files first (see do_backup). Defaults to True.
         """
 
         path = os.path.dirname(song_dirname)
@@ -673,10 +1167,10 @@ class UltraStarHelper:
         song_config_multi = "%s.txt" % song_config_multi
 
         if os.path.exists(song_config):
-            self.update_config(song_config, field, value)
+            self.update_config(song_config, field, value, backup)
         
         if os.path.exists(song_config_multi):
-            self.update_config(song_config_multi, field, value)
+            self.update_config(song_config_multi, field, value, backup)
         
 
 def test_read_playlists():
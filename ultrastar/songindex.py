@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# songindex.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# index to find the songs of the playlists: each song has a match key (the
+# artist and title without case, accents, punctuation nor "feat." parts)
+# and its trigrams are stored in a table, so the entries that don't match
+# exactly are resolved to the most similar song (Dice coefficient of the
+# trigrams), with a confidence value. All the entries of a playlist are
+# resolved at once.
+#
+# ############################################################################
+
+import re
+import json
+
+import sys
+sys.path.append('..')
+
+from ultrastar.helper import Helper
+
+
+class SongIndex:
+
+    SQL_TRIGRAMS = """
+        create table song_trigrams(
+            trigram text not null,
+            song_id integer not null
+        );
+        """
+
+    RE_FEAT = re.compile(r"\s*[\(\[]?\s*\b(feat|ft|featuring)\b\.?\s.*$")
+    RE_PUNCT = re.compile(r"[^\w\s]")
+
+    def __init__(self, helper):
+        self.helper = helper
+
+    @staticmethod
+    def clean(text):
+        text = Helper.normalize(text)
+        text = SongIndex.RE_FEAT.sub("", text)
+        text = text.replace("&", " and ")
+        text = SongIndex.RE_PUNCT.sub(" ", text)
+        return " ".join(text.split())
+
+    @staticmethod
+    def key(artist, title):
+        """the match key of a song
+
+        Args:
+            artist (str): the artist
+            title (str): the title
+
+        Returns:
+            str: the normalized "artist|title"
+        """
+        artist = SongIndex.clean(artist)
+        if artist.startswith("the "):
+            artist = artist[4:]
+        return "%s|%s" % (artist, SongIndex.clean(title))
+
+    @staticmethod
+    def trigrams(key):
+        text = " %s " % key.replace("|", " ")
+        return set(text[i:i + 3] for i in range(len(text) - 2))
+
+    def drop_tables(self, cursor):
+        cursor.execute("drop table if exists song_trigrams;")
+
+    def create_tables(self, cursor):
+        cursor.execute(SongIndex.SQL_TRIGRAMS)
+
+    def create_indexes(self, cursor):
+        cursor.execute("create index if not exists songs_match_key on songs(match_key);")
+        cursor.execute("create index if not exists song_trigrams_trigram on song_trigrams(trigram);")
+
+    def add(self, cursor, song_id, key):
+        "store the trigrams of a song (insert_into_db stores the key)"
+        cursor.executemany("insert into song_trigrams(trigram, song_id) values (?, ?)",
+                           [ (trigram, song_id) for trigram in SongIndex.trigrams(key) ])
+
+    def reindex(self, ids=None):
+        """compute the key and trigrams of the songs again
+
+        Args:
+            ids (list, optional): the songs. Defaults to None (all).
+        """
+        cursor = self.helper.db.cursor()
+        if ids is None:
+            cursor.execute("delete from song_trigrams")
+            cursor.execute("select id, artist, title from songs")
+        else:
+            ids = list(ids)
+            marks = ",".join("?" * len(ids))
+            cursor.execute("delete from song_trigrams where song_id in (%s)" % marks, ids)
+            cursor.execute("select id, artist, title from songs where id in (%s)" % marks, ids)
+        for row in cursor.fetchall():
+            key = SongIndex.key(row['artist'], row['title'])
+            cursor.execute("update songs set match_key=?, match_grams=? where id=?",
+                           (key, len(SongIndex.trigrams(key)), row['id']))
+            self.add(cursor, row['id'], key)
+        cursor.close()
+
+    def resolve(self, entries, threshold=0.75):
+        """find the songs of a list of (artist, title): first by match key,
+        then the entries not found by trigram similarity, all in a few queries
+
+        Args:
+            entries (list): list of (artist, title)
+            threshold (float, optional): min similarity (0..1) to accept a song. Defaults to 0.75.
+
+        Returns:
+            list: (song id or None, confidence 0..1) for each entry
+        """
+        keys = [ SongIndex.key(artist, title) for artist, title in entries ]
+        result = [ (None, 0.0) ] * len(keys)
+        cursor = self.helper.db.cursor()
+
+        exact = {}
+        distinct = list(set(keys))
+        for i in range(0, len(distinct), 500):
+            chunk = distinct[i:i + 500]
+            cursor.execute("select match_key, min(id) from songs where match_key in (%s) group by match_key" %
+                           ",".join("?" * len(chunk)), chunk)
+            exact.update((row[0], row[1]) for row in cursor.fetchall())
+
+        pending = []
+        for pos, key in enumerate(keys):
+            if key in exact:
+                result[pos] = (exact[key], 1.0)
+            else:
+                pending.append(pos)
+        if not pending:
+            cursor.close()
+            return result
+
+        # the trigrams of the entries are passed as json (a read only query:
+        # no temp tables, so no transaction is left open on the connection)
+        grams = []
+        sizes = []
+        for pos in pending:
+            trigrams = SongIndex.trigrams(keys[pos])
+            sizes.append([ pos, len(trigrams) ])
+            grams += [ [ pos, trigram ] for trigram in trigrams ]
+
+        # Dice coefficient: 2 * shared trigrams / (trigrams of the entry + trigrams of the song)
+        cursor.execute("""
+            with g(pos, trigram) as (select json_extract(value, '$[0]'), json_extract(value, '$[1]') from json_each(?)),
+                 e(pos, grams) as (select json_extract(value, '$[0]'), json_extract(value, '$[1]') from json_each(?))
+            select pos, song_id, score from (
+                select shared.pos, shared.song_id,
+                       2.0 * shared.n / (e.grams + s.match_grams) as score,
+                       row_number() over (partition by shared.pos
+                                          order by 2.0 * shared.n / (e.grams + s.match_grams) desc, shared.song_id) as rank
+                from (select g.pos, t.song_id, count(*) as n
+                      from g join song_trigrams t on t.trigram = g.trigram
+                      group by g.pos, t.song_id) as shared
+                join e on e.pos = shared.pos
+                join songs s on s.id = shared.song_id)
+            where rank = 1""", (json.dumps(grams), json.dumps(sizes)))
+        for pos, song_id, score in cursor.fetchall():
+            result[pos] = (song_id if score >= threshold else None, round(score, 3))
+
+        cursor.close()
+        return result
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# songrecord.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# compact record of a song read from the library (slots instead of a dict).
+# Repeated values (genre, edition, language, year, songs dir) are interned
+# so all the songs share the same string object. Only the tags stored in
+# the database are kept, the raw tags of the config file are discarded.
+#
+# ############################################################################
+
+import os
+import sys
+
+
+class SongRecord:
+
+    # the tags read from the song config file
+    TAGS = ( 'title', 'artist', 'language', 'edition', 'genre', 'year',
+             'mp3', 'cover', 'video', 'videogap', 'bpm', 'gap' )
+
+    # tags with few distinct values, shared between songs
+    INTERNED = ( 'language', 'edition', 'genre', 'year' )
+
+    # fields available as record['name'] (dict like access)
+    FIELDS = TAGS + ( 'path', 'dirname', 'duration', 'multi', 'players', 'artist-on-sorting',
+                      'has_cover', 'has_video' )
+
+    __slots__ = TAGS + ( 'root', 'entry', 'duration', 'multi', 'players', 'artist_sort',
+                         'has_cover', 'has_video' )
+
+    def __init__(self, config, dirname, players=(), duration=0, multi=0, has_cover=1, has_video=1):
+        """build the record from the tags of the config file
+
+        Args:
+            config (dict): the tags read by read_config()
+            dirname (str): the song directory
+            players (tuple, optional): ((player, singer), ...) of a duet. Defaults to ().
+            duration (float, optional): the mp3 duration in seconds. Defaults to 0.
+            multi (int, optional): 1 if the song is a duet. Defaults to 0.
+            has_cover (int, optional): 0 if the cover file is missing. Defaults to 1.
+            has_video (int, optional): 0 if the video file is missing. Defaults to 1.
+        """
+        for tag in SongRecord.TAGS:
+            value = config.get(tag)
+            if tag in SongRecord.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, tag, value)
+
+        root, entry = os.path.split(dirname)
+        self.root = sys.intern(root)
+        self.entry = entry
+        self.duration = duration
+        self.multi = multi
+        self.players = tuple(players)
+        self.artist_sort = config.get('artist-on-sorting', '')
+        self.has_cover = has_cover
+        self.has_video = has_video
+
+    @property
+    def dirname(self):
+        return os.path.sep.join([self.root, self.entry])
+
+    @property
+    def path(self):
+        "the song config file (built from the dirname, as get_songs() does)"
+        return os.path.sep.join([self.root, self.entry, "%s.txt" % self.entry])
+
+    def __getitem__(self, key):
+        if key == 'artist-on-sorting':
+            return self.artist_sort
+        if key == 'players':
+            return dict(self.players)
+        if key not in SongRecord.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def keys(self):
+        return SongRecord.FIELDS
+
+    def get(self, key, default=None):
+        if key in SongRecord.FIELDS:
+            return self[key]
+        return default
+
+    def as_dict(self):
+        return dict((key, self[key]) for key in SongRecord.FIELDS)
+
+    def __repr__(self):
+        return "SongRecord(%s - %s)" % (self.artist, self.title)
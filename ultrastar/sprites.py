@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# sprites.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# sprite sheets with the thumbnails of the artist covers, so the artist page
+# loads a few images instead of one per artist. Each cover keeps its slot
+# in a sheet between updates (index.json maps the cover file to its sheet
+# and slot), and only the sheets with new, changed or removed covers are
+# written again, in the background (the requests only read the index).
+# Pillow is optional: without it the page uses the covers.
+#
+# ############################################################################
+
+import os
+import json
+import time
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+import sys
+sys.path.append('..')
+
+
+class SpriteSheets:
+
+    COLUMNS = 10
+    ROWS = 10
+    SLOTS = COLUMNS * ROWS
+    INDEX = "index.json"
+    BACKGROUND = (32, 32, 32)
+    LOCK = ".lock"
+    # an update that holds the lock longer than this is dead (its lock is removed)
+    LOCK_TIMEOUT = 600
+
+    def __init__(self, helper, sprite_dir=None, size=None):
+        """
+        Args:
+            helper (UltraStarHelper): the helper
+            sprite_dir (str, optional): where the sheets are written. Defaults to config.sprite_dir.
+            size (int, optional): size of the thumbnails in pixels. Defaults to config.sprite_size.
+        """
+        self.helper = helper
+        self.verbose = helper.verbose or 0
+        self.sprite_dir = sprite_dir or helper.config.sprite_dir or "%s.sprites" % helper.config.dbfile
+        self.size = size or helper.config.sprite_size
+        self.index = None
+        self.version = None
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        return Image is not None
+
+    def sheet_file(self, sheet):
+        return os.path.sep.join([self.sprite_dir, "sheet_%03d.jpg" % sheet])
+
+    def read_index(self):
+        fname = self.index_file()
+        try:
+            with open(fname, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('size') == self.size and index.get('columns') == SpriteSheets.COLUMNS:
+                return index
+        except (OSError, ValueError):
+            pass
+        return { 'size': self.size, 'columns': SpriteSheets.COLUMNS, 'rows': SpriteSheets.ROWS,
+                 'tiles': {}, 'revisions': {} }
+
+    def write_index(self, index):
+        fname = self.index_file()
+        tmpfile = "%s.%d.tmp" % (fname, os.getpid())
+        with open(tmpfile, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmpfile, fname)
+
+    def read_covers(self):
+        "the representative cover of each artist: path -> (size, mtime) (see update_artists)"
+        cursor = self.helper.db.cursor()
+        cursor.execute("""select s.dirname, s.cover, a.cover_size, a.cover_mtime
+                          from artists a join songs s on s.id = a.cover_id
+                          where s.has_cover = 1 and a.cover_size >= 0""")
+        covers = dict((os.path.sep.join([row['dirname'], row['cover']]), [ row['cover_size'], row['cover_mtime'] ])
+                      for row in cursor.fetchall())
+        cursor.close()
+        return covers
+
+    def thumbnail(self, fname):
+        try:
+            with Image.open(fname) as image:
+                return ImageOps.fit(image.convert('RGB'), (self.size, self.size))
+        except Exception as e:
+            if self.verbose > 1:
+                print("can't read cover %s: %s" % (fname, e))
+            return None
+
+    def update(self):
+        """place the new and changed covers in the sheets, clear the slots
+        of the covers not used anymore, and write the sheets that changed
+
+        Returns:
+            int: number of sheets written
+        """
+        if Image is None:
+            raise RuntimeError("the sprite sheets need Pillow (pip install pillow)")
+
+        version = self.helper.get_data_version()
+        covers = self.read_covers()
+        os.makedirs(self.sprite_dir, exist_ok=True)
+        index = self.read_index()
+        tiles = index['tiles']
+
+        # sheet -> { slot: cover path, or None to clear it }
+        dirty = {}
+        for path in list(tiles.keys()):
+            if path not in covers:
+                sheet, slot = tiles.pop(path)[:2]
+                dirty.setdefault(sheet, {})[slot] = None
+
+        used = set((tile[0], tile[1]) for tile in tiles.values())
+        free = ((sheet, slot) for sheet in range(len(covers) // SpriteSheets.SLOTS + len(index['revisions']) + 1)
+                              for slot in range(SpriteSheets.SLOTS) if (sheet, slot) not in used)
+        for path in sorted(covers.keys()):
+            signature = covers[path]
+            tile = tiles.get(path)
+            if tile is not None and tile[2:] == signature:
+                continue
+            sheet, slot = tile[:2] if tile is not None else next(free)
+            tiles[path] = [ sheet, slot ] + signature
+            dirty.setdefault(sheet, {})[slot] = path
+
+        for sheet in set(tile[0] for tile in tiles.values()):
+            # sheets not written yet (or deleted): all their tiles are drawn
+            if str(sheet) not in index['revisions'] or not os.path.exists(self.sheet_file(sheet)):
+                slots = dirty.setdefault(sheet, {})
+                for path, tile in tiles.items():
+                    if tile[0] == sheet:
+                        slots[tile[1]] = path
+
+        width = SpriteSheets.COLUMNS * self.size
+        height = SpriteSheets.ROWS * self.size
+        written = 0
+        for sheet, slots in sorted(dirty.items()):
+            if not slots:
+                continue
+            fname = self.sheet_file(sheet)
+            try:
+                with Image.open(fname) as image:
+                    canvas = image.convert('RGB')
+                if canvas.size != (width, height):
+                    raise ValueError("size")
+            except Exception:
+                canvas = Image.new('RGB', (width, height), SpriteSheets.BACKGROUND)
+            for slot, path in slots.items():
+                box = ((slot % SpriteSheets.COLUMNS) * self.size, (slot // SpriteSheets.COLUMNS) * self.size)
+                thumbnail = self.thumbnail(path) if path else None
+                if thumbnail is None:
+                    canvas.paste(SpriteSheets.BACKGROUND, box + (box[0] + self.size, box[1] + self.size))
+                else:
+                    canvas.paste(thumbnail, box)
+            tmpfile = "%s.%d.tmp" % (fname, os.getpid())
+            canvas.save(tmpfile, format='JPEG', quality=85, optimize=True)
+            os.replace(tmpfile, fname)
+            index['revisions'][str(sheet)] = index['revisions'].get(str(sheet), 0) + 1
+            written += 1
+
+        self.write_index(index)
+        with self.lock:
+            self.index = index
+            self.version = version
+        if self.verbose > 0 and written:
+            print("sprites: %d covers, %d sheets written" % (len(tiles), written))
+        return written
+
+    def index_file(self):
+        return os.path.sep.join([self.sprite_dir, SpriteSheets.INDEX])
+
+    def stale(self):
+        "the data changed since the sheets were updated by this process"
+        return Image is not None and self.version != self.helper.get_data_version()
+
+    def current(self):
+        """the index of the sheets as they are (read from index.json the first
+        time). It doesn't update them: see refresh()
+
+        Returns:
+            dict: the index, or None without Pillow or sheets
+        """
+        if Image is None:
+            return None
+        with self.lock:
+            if self.index is None and os.path.exists(self.index_file()):
+                index = self.read_index()
+                if index['tiles']:
+                    self.index = index
+            return self.index
+
+    def lock_file(self):
+        """take the lock of the sprite dir (one update at a time, also between
+        the processes of the web server)
+
+        Returns:
+            bool: True if the lock was taken
+        """
+        fname = os.path.sep.join([self.sprite_dir, SpriteSheets.LOCK])
+        for attempt in range(2):
+            try:
+                os.makedirs(self.sprite_dir, exist_ok=True)
+                os.close(os.open(fname, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(fname) < SpriteSheets.LOCK_TIMEOUT:
+                        return False
+                    os.remove(fname)
+                except OSError:
+                    return False
+        return False
+
+    def unlock_file(self):
+        try:
+            os.remove(os.path.sep.join([self.sprite_dir, SpriteSheets.LOCK]))
+        except OSError:
+            pass
+
+    def refresh(self):
+        """update the sheets if the data changed. Slow (the covers are read):
+        run it in the background, the requests use current() meanwhile
+
+        Returns:
+            int: number of sheets written (0 if nothing was done)
+        """
+        if Image is None:
+            return 0
+        with self.update_lock:
+            if not self.stale():
+                return 0
+            if not self.lock_file():
+                # another process is updating them
+                return 0
+            try:
+                return self.update()
+            except OSError as e:
+                # e.g. sprite_dir is not writable: use the covers
+                if self.verbose > 0:
+                    print("can't write the sprite sheets in %s: %s" % (self.sprite_dir, e))
+                return 0
+            finally:
+                self.unlock_file()
+
+    def tile(self, dirname, cover):
+        """the position of a cover in the sheets
+
+        Returns:
+            dict: sheet, revision and the background position (x, y in %), or None
+        """
+        index = self.index
+        if not index:
+            return None
+        tile = index['tiles'].get(os.path.sep.join([dirname, cover]))
+        if tile is None:
+            return None
+        sheet, slot = tile[:2]
+        return { 'sheet': sheet,
+                 'revision': index['revisions'].get(str(sheet), 0),
+                 'x': round((slot % SpriteSheets.COLUMNS) * 100 / (SpriteSheets.COLUMNS - 1), 4),
+                 'y': round((slot // SpriteSheets.COLUMNS) * 100 / (SpriteSheets.ROWS - 1), 4) }
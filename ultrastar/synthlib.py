@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# synthlib.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# Generates synthetic UltraStar libraries (songs, duets, mp3 stubs, covers
+# and playlists) to benchmark the project in a reproducible way
+#
+# ############################################################################
+
+import os
+import json
+import random
+import struct
+
+import sys
+sys.path.append('..')
+
+from ultrastar.literals import *
+
+# 8x8 baseline jpeg. Padded with a COM segment to get covers of different sizes
+COVER_JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300100b0c0e0c0a100e0d0e12"
+    "11101318281a181616183123251d283a333d3c3933383740485c4e404457453738506d51"
+    "575f626768673e4d71797064785c656763ffdb0043011112121815182f1a1a2f63423842"
+    "6363636363636363636363636363636363636363636363636363636363636363636363636363"
+    "636363636363636363636363ffc00011080008000803012200021101031101ffc4001f00"
+    "00010501010101010100000000000000000102030405060708090a0bffc400b510000201"
+    "0303020403050504040000017d01020300041105122131410613516107227114328191a1"
+    "082342b1c11552d1f02433627282090a161718191a25262728292a3435363738393a4344"
+    "45464748494a535455565758595a636465666768696a737475767778797a838485868788"
+    "898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8"
+    "c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffc4001f01"
+    "00030101010101010101010000000000000102030405060708090a0bffc400b511000201"
+    "02040403040705040400010277000102031104052131061241510761711322328108144291"
+    "a1b1c109233352f0156272d10a162434e125f11718191a262728292a35363738393a4344"
+    "45464748494a535455565758595a636465666768696a737475767778797a828384858687"
+    "88898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7"
+    "c8c9cad2d3d4d5d6d7d8d9dae2e3e4e5e6e7e8e9eaf2f3f4f5f6f7f8f9faffda000c0301"
+    "0002110311003f00cba28a2b88fa63ffd9"
+)
+
+# MPEG1 Layer III, 32 kbps, 44100 Hz, mono: 104 bytes per frame, 1152 samples
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x10, 0xC0])
+MP3_FRAME_LEN = 104
+MP3_FRAME_SAMPLES = 1152
+MP3_SAMPLE_RATE = 44100
+MP3_XING_OFFSET = 21  # 4 bytes of header + 17 bytes of side info (mono)
+
+WORDS = [ "love", "night", "fuego", "corazón", "baby", "dance", "noche",
+          "heart", "rock", "canción", "sueño", "fire", "dream", "vida",
+          "blue", "música", "summer", "señorita", "forever", "alegría",
+          "moon", "día", "crazy", "mañana", "road", "niña", "star", "amor" ]
+
+NAMES = [ "Los", "The", "Banda", "José", "María", "Ángel", "Peña", "Sky",
+          "Electric", "Hermanos", "Iñigo", "Zoë", "Black", "Orquesta",
+          "Sister", "Björn", "Café", "Rubén", "Kings", "Müller" ]
+
+
+class SyntheticLibrary:
+    """builds a fake ultrastar tree (songs and playlists) under root"""
+
+    def __init__(self, root, songs=1000, duet_ratio=0.1, missing_ratio=0.05,
+                 encoding="iso-8859-15", playlists=10, playlist_size=20,
+                 min_duration=120, max_duration=300, seed=0):
+        self.root = root
+        self.songs = songs
+        self.duet_ratio = duet_ratio
+        self.missing_ratio = missing_ratio
+        self.encoding = encoding
+        self.playlists = playlists
+        self.playlist_size = playlist_size
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.random = random.Random(seed)
+
+        self.songs_dir = "Songs"
+        self.playlist_dir = "playlists"
+        self.full_songs_dir = os.path.sep.join([self.root, self.songs_dir])
+        self.full_playlist_dir = os.path.sep.join([self.root, self.playlist_dir])
+        self.generated = []
+
+        self.editions = self.encodable(EDITIONS)
+        self.genres = self.encodable(GENRES)
+
+    @staticmethod
+    def mp3_stub(seconds, frames=4):
+        """build a small mp3 with valid frame headers and a Xing header
+        announcing the number of frames, so mutagen reports the duration
+
+        Args:
+            seconds (float): the duration of the song
+            frames (int, optional): real frames written after the Xing one. Defaults to 4.
+
+        Returns:
+            bytes: the mp3 data
+        """
+        total_frames = int(seconds * MP3_SAMPLE_RATE / MP3_FRAME_SAMPLES)
+        first = bytearray(MP3_FRAME_HEADER + bytes(MP3_FRAME_LEN - 4))
+        first[MP3_XING_OFFSET:MP3_XING_OFFSET + 12] = b'Xing' + struct.pack('>II', 1, total_frames)
+        frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_LEN - 4)
+        return bytes(first) + frame * frames
+
+    @staticmethod
+    def cover_stub(padding=0):
+        """build a valid jpeg, padded with a comment segment
+
+        Args:
+            padding (int, optional): bytes of comment to add. Defaults to 0.
+
+        Returns:
+            bytes: the jpeg data
+        """
+        padding = min(padding, 65533)
+        if not padding:
+            return COVER_JPEG
+        comment = b'\xff\xfe' + struct.pack('>H', padding + 2) + bytes(padding)
+        return COVER_JPEG[:2] + comment + COVER_JPEG[2:]
+
+    def encodable(self, values):
+        "keep only the literals that can be written with the library encoding"
+        result = []
+        for value in values:
+            try:
+                value.encode(self.encoding)
+                result.append(value)
+            except UnicodeEncodeError:
+                pass
+        return result
+
+    def words(self, n):
+        return " ".join(self.random.choice(WORDS) for _ in range(n)).title()
+
+    def song_text(self, song, multi=False):
+        """build the song configuration file (header and some notes)"""
+
+        header = [ ("ENCODING", self.encoding.upper()),
+                   ("TITLE", song['title']),
+                   ("ARTIST", song['artist']),
+                   ("LANGUAGE", song['language']),
+                   ("EDITION", song['edition']),
+                   ("GENRE", song['genre']),
+                   ("YEAR", song['year']),
+                   ("MP3", song['mp3']),
+                   ("COVER", song['cover']),
+                   ("VIDEO", song['video']),
+                   ("VIDEOGAP", "0"),
+                   ("BPM", song['bpm']),
+                   ("GAP", song['gap']) ]
+
+        if song['artist_sort']:
+            header.append(("ARTIST-ON-SORTING", song['artist_sort']))
+
+        if multi:
+            header.append(("DUETSINGERP1", song['singers'][0]))
+            header.append(("DUETSINGERP2", song['singers'][1]))
+
+        text = []
+        for tag, value in header:
+            if tag.lower() in song['missing']:
+                continue
+            text.append("#%s:%s" % (tag, value))
+
+        beat = 0
+        for i in range(self.random.randint(16, 48)):
+            length = self.random.randint(1, 8)
+            pitch = self.random.randint(-12, 24)
+            text.append(": %d %d %d %s" % (beat, length, pitch, self.random.choice(WORDS)))
+            beat += length + self.random.randint(0, 4)
+            if i % 8 == 7:
+                text.append("- %d" % beat)
+        text.append("E")
+        return "\n".join(text) + "\n"
+
+    def make_song(self, index, artists):
+        artist = self.random.choice(artists)
+        title = "%s %d" % (self.words(self.random.randint(1, 3)), index)
+        basename = "%s - %s" % (artist, title)
+        missing = []
+        if self.random.random() < self.missing_ratio:
+            missing = self.random.sample([ 'genre', 'edition', 'language', 'year' ],
+                                         self.random.randint(1, 2))
+        language_idx = self.random.randrange(len(LANGUAGES['en']))
+        song = {
+            'artist': artist,
+            'artist_sort': ("%s, The" % artist[4:]) if artist.startswith("The ") else "",
+            'title': title,
+            'language': self.random.choice([ LANGUAGES['en'][language_idx],
+                                             LANGUAGES['es'][language_idx] ]),
+            'edition': self.random.choice(self.editions),
+            'genre': self.random.choice(self.genres),
+            'year': self.random.randint(1955, 2023),
+            'mp3': "%s.mp3" % basename,
+            'cover': "%s [CO].jpg" % basename,
+            'video': "%s.avi" % basename,
+            'bpm': ("%.2f" % self.random.uniform(150, 400)).replace('.', ','),
+            'gap': ("%.2f" % self.random.uniform(0, 20000)).replace('.', ','),
+            'duration': self.random.randint(self.min_duration, self.max_duration),
+            'multi': self.random.random() < self.duet_ratio,
+            'singers': (self.random.choice(NAMES), self.random.choice(NAMES)),
+            'missing': missing,
+            'dirname': os.path.sep.join([self.full_songs_dir, basename]),
+            'basename': basename,
+        }
+        return song
+
+    def write_song(self, song):
+        os.makedirs(song['dirname'], exist_ok=True)
+        song_config = os.path.sep.join([song['dirname'], song['basename']])
+
+        with open("%s.txt" % song_config, 'w', encoding=self.encoding, newline='\n') as f:
+            f.write(self.song_text(song))
+        if song['multi']:
+            with open("%s [MULTI].txt" % song_config, 'w', encoding=self.encoding, newline='\n') as f:
+                f.write(self.song_text(song, multi=True))
+
+        with open(os.path.sep.join([song['dirname'], song['mp3']]), 'wb') as f:
+            f.write(SyntheticLibrary.mp3_stub(song['duration']))
+        with open(os.path.sep.join([song['dirname'], song['cover']]), 'wb') as f:
+            f.write(SyntheticLibrary.cover_stub(self.random.randint(0, 4096)))
+
+    def write_playlists(self):
+        for i in range(self.playlists):
+            name = "Synthetic %s %d" % (self.words(1), i)
+            count = min(self.playlist_size, len(self.generated))
+            text = [ '#Name: %s' % name, '#Songs:' ]
+            for song in self.random.sample(self.generated, count):
+                text.append("%s : %s" % (song['artist'], song['title']))
+            fname = os.path.sep.join([self.full_playlist_dir, "synthetic_%03d.upl" % i])
+            with open(fname, 'w', encoding=self.encoding, newline='\n') as f:
+                f.write("\n".join(text))
+
+    def write_config(self, fname, **kwargs):
+        """write a json configuration file pointing to the generated library
+
+        Args:
+            fname (str): the configuration file name
+            kwargs: extra configuration values (e.g. dbfile)
+        """
+        data = {
+            "verbose": 0,
+            "read_from_db": False,
+            "persistent": True,
+            "do_backup": True,
+            "ultrastar_dir": self.root,
+            "songs_dir": self.songs_dir,
+            "playlist_dir": self.playlist_dir,
+            "encoding": self.encoding,
+            "dbfile": os.path.sep.join([self.root, "songs.db"])
+        }
+        data.update(kwargs)
+        with open(fname, 'w') as f:
+            json.dump(data, f, indent=4)
+        return fname
+
+    def generate(self):
+        """generate the library on disk
+
+        Returns:
+            str: the path of a configuration file for the library
+        """
+        os.makedirs(self.full_songs_dir, exist_ok=True)
+        os.makedirs(self.full_playlist_dir, exist_ok=True)
+
+        artists = []
+        for i in range(max(1, self.songs // 5)):
+            artist = "%s %s %d" % (self.random.choice(NAMES), self.words(1), i)
+            if self.random.random() < 0.1:
+                artist = "The %s" % artist
+            artists.append(artist)
+
+        for index in range(self.songs):
+            song = self.make_song(index, artists)
+            self.write_song(song)
+            self.generated.append(song)
+
+        self.write_playlists()
+        return self.write_config(os.path.sep.join([self.root, "config.cfg"]))
+
+
+def test_synthlib():
+    import tempfile
+    import mutagen.mp3
+
+    root = tempfile.mkdtemp(prefix="ultrastar_")
+    lib = SyntheticLibrary(root, songs=20, playlists=2)
+    print(lib.generate())
+    song = lib.generated[0]
+    print(song['dirname'], mutagen.mp3.MP3(os.path.sep.join([song['dirname'], song['mp3']])).info.length)
+
+if __name__ == "__main__":
+
+    test_synthlib()
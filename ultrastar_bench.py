@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################
+#
+# ultrastar_bench.py
+# 09/27/2023 (c) Juan M. Casillas <juanm.casillas@gmail.com>
+#
+# Generates a synthetic library and times the load, refresh, playlist,
+# tag update and web operations over it. Results are stored as json and
+# can be compared with a previous run to catch regressions.
+#
+# ############################################################################
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import itertools
+import tracemalloc
+import urllib.parse
+import mutagen.mp3
+
+from ultrastar.appenv import AppEnv
+from ultrastar.songhelper import UltraStarHelper
+from ultrastar.consolehelper import ConsoleHelper
+from ultrastar.synthlib import SyntheticLibrary
+from ultrastar.benchmark import Benchmark
+from ultrastar.playlistgen import PlaylistGenerator
+
+
+def bench_helper(bench, config_file, repeat):
+    AppEnv.config(config_file)
+    AppEnv.config_set("verbose", 0)
+    helper = UltraStarHelper(AppEnv.config())
+
+    bench.run("load_db", helper.load_db, repeat=1)
+    bench.run("refresh_db", helper.refresh_db, repeat=repeat)
+    bench.run("get_playlists", helper.get_playlists, repeat=repeat)
+    bench.run("generate_playlist", lambda: PlaylistGenerator(helper).generate(
+        duration=3600, genres={ "Pop": 0.5 }, languages={ "Spanish": 0.5 }, duets=0.2, seed=0), repeat=repeat)
+
+    console = ConsoleHelper(helper)
+    genres = itertools.cycle([ "Pop", "Rock" ])
+    bench.run("set_genre_50", lambda: console.console_db_set_field(
+        "select id, dirname from songs order by id limit 50", "genre", next(genres)), repeat=repeat)
+
+    helper.db.close()
+
+
+class DictHelper(UltraStarHelper):
+    "the ingest path with a dict per song (as before SongRecord), to compare the memory"
+
+    def merge_config(self, config, config_multi, dirname, path, files=None):
+        players = {}
+        is_multi = 0
+        if config_multi:
+            for item in config_multi.keys():
+                if item.startswith('duetsinger'):
+                    is_multi = 1
+                    players[item.replace('duetsinger','')] = config_multi[item]
+
+        config['players'] = players
+        config['path'] = path
+        config['dirname'] = dirname
+        config['duration'] = 0
+        if UltraStarHelper.has_file(files, dirname, config['mp3']):
+            config['duration'] = self.mp3_duration(os.path.sep.join([dirname, config['mp3']]))
+        config['multi'] = is_multi
+        return config
+
+    @staticmethod
+    def mp3_duration(fname):
+        try:
+            return mutagen.mp3.MP3(fname).info.length
+        except Exception:
+            return 0
+
+
+def bench_memory(bench, root, params):
+    """tracemalloc peak and retained memory of reading the library as dicts,
+    as SongRecord, and of the streaming ingest. They read their own library
+    without missing tags: the first pass would add them (and back up the
+    files), so the passes would not do the same work"""
+    library = SyntheticLibrary(os.path.join(root, "memory"), **dict(params, missing_ratio=0))
+    config_file = library.generate()
+    AppEnv.config(config_file)
+    AppEnv.config_set("verbose", 0)
+    for name, cls in [ ("dict", DictHelper), ("record", UltraStarHelper) ]:
+        helper = cls(AppEnv.config())
+        songs = helper.get_songs(helper.config.full_songs_dir)
+        tracemalloc.start()
+        config = helper.process_songs(songs)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        bench.record("memory_ingest_%s" % name, songs=len(config), current=current, peak=peak)
+        del config
+
+    # streaming ingest: the peak depends on the batch size, not on the library
+    helper = UltraStarHelper(AppEnv.config())
+    helper.db = helper.connect(":memory:")
+    tracemalloc.start()
+    progress = helper.ingest()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    bench.record("memory_ingest_stream", songs=progress.inserted, current=current, peak=peak)
+    helper.db.close()
+
+
+# the queries of the web routes (www/ultraweb.py)
+WEB_QUERIES = [
+    ("artists", "select name as artist, cover_id as id, songs, duration, languages from artists order by sort_key", ()),
+    ("artists_search", "select name as artist, cover_id as id, songs, duration, languages from artists "
+                       "where norm like ? order by sort_key", ("%a%",)),
+    ("artist_name", "select name from artists where norm=?", None),
+    ("data", "select * from songs", ()),
+    ("data_artist", "select * from songs where artist_norm=? order by title", None),
+    ("data_search", "select * from songs where title like ?", ("%a%",)),
+    ("playlist_song", "select * from songs where artist=? and title=?", None),
+    ("cover", "select dirname,cover,has_cover from songs where id=?", None),
+    ("facets_genre", "select genre_id as id, count(*) as songs from songs where language_id = ? group by genre_id", None),
+]
+
+
+def bench_memdb(bench, config_file, repeat):
+    """latency of the web queries with the database on disk and in memory (in_memory)"""
+    for mode, in_memory in [ ("disk", False), ("memory", True) ]:
+        AppEnv.config(config_file)
+        AppEnv.config_set("verbose", 0)
+        AppEnv.config_set("in_memory", in_memory)
+        AppEnv.config_set("persistent", False)
+        helper = UltraStarHelper(AppEnv.config())
+        helper.load_db()
+
+        song = helper.db.execute("select id, artist, artist_norm, title, language_id from songs order by id limit 1").fetchone()
+        params = {
+            "artist_name": (song['artist_norm'],),
+            "data_artist": (song['artist_norm'],),
+            "playlist_song": (song['artist'], song['title']),
+            "cover": (song['id'],),
+            "facets_genre": (song['language_id'],),
+        }
+        for name, sql, args in WEB_QUERIES:
+            args = params[name] if args is None else args
+            bench.run("query_%s_%s" % (mode, name), lambda: helper.db.execute(sql, args).fetchall(), repeat=repeat * 10)
+        helper.db.close()
+
+
+def bench_web(bench, config_file, repeat):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "www"))
+    from ultraweb import create_app
+
+    app = create_app(config_file)
+    client = app.test_client()
+
+    cursor = app.ultrastar_helper.db.cursor()
+    cursor.execute("select id, artist from songs order by id limit 1")
+    song = cursor.fetchone()
+    cursor.close()
+    playlist = app.ultrastar_helper.get_playlists()[0]
+    artist = urllib.parse.quote_plus(song['artist'])
+
+    routes = [
+        ("web_artists", "/artists"),
+        ("web_artists_search", "/artists?search=a"),
+        ("web_songs", "/songs"),
+        ("web_data", "/data"),
+        ("web_data_artist", "/data?artist=%s" % artist),
+        ("web_data_search", "/data?search=a"),
+        ("web_playlists", "/playlists"),
+        ("web_playlist", "/playlist?name=%s" % urllib.parse.quote_plus(playlist.filename)),
+        ("web_cover", "/img/cover/%d" % song['id']),
+        ("web_facets", "/facets"),
+        ("web_facets_filter", "/facets?language=Spanish&decade=1990&multi=0"),
+    ]
+
+    for name, url in routes:
+        def get(url=url):
+            response = client.get(url)
+            response.close()
+            if response.status_code != 200:
+                raise Exception("%s returned %d" % (url, response.status_code))
+        bench.run(name, get, repeat=repeat)
+
+    app.ultrastar_helper.db.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="Show the timings", action="count", default=0)
+    parser.add_argument("-n", "--songs", help="Number of songs to generate", type=int, default=1000)
+    parser.add_argument("--duets", help="Ratio of duets", type=float, default=0.1)
+    parser.add_argument("--missing", help="Ratio of songs with missing tags", type=float, default=0.05)
+    parser.add_argument("--encoding", help="Encoding of the song files", default="iso-8859-15")
+    parser.add_argument("--playlists", help="Number of playlists to generate", type=int, default=20)
+    parser.add_argument("--playlist-size", help="Songs per playlist", type=int, default=25)
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    parser.add_argument("--repeat", help="Runs per benchmark", type=int, default=3)
+    parser.add_argument("--no-web", help="Skip the web benchmarks", action="store_true")
+    parser.add_argument("--memory", help="Compare the ingest memory of dicts and SongRecord", action="store_true")
+    parser.add_argument("--memdb", help="Compare the web queries with the database on disk and in memory", action="store_true")
+    parser.add_argument("--library", help="Generate the library here and keep it")
+    parser.add_argument("-o", "--output", help="Store the results as json")
+    parser.add_argument("--compare", help="Compare with a previous json result")
+    parser.add_argument("--threshold", help="Allowed slowdown when comparing", type=float, default=0.2)
+    args = parser.parse_args()
+
+    root = args.library or tempfile.mkdtemp(prefix="ultrastar_bench_")
+    params = dict(songs=args.songs, duet_ratio=args.duets, missing_ratio=args.missing,
+                  encoding=args.encoding, playlists=args.playlists,
+                  playlist_size=args.playlist_size, seed=args.seed)
+    bench = Benchmark(params=params, verbose=args.verbose + 1)
+
+    try:
+        library = SyntheticLibrary(root, **params)
+        bench.run("generate_library", library.generate, repeat=1)
+        config_file = library.write_config(os.path.join(root, "config.cfg"))
+        config_www = library.write_config(os.path.join(root, "config_www.cfg"), read_from_db=True)
+
+        if args.memory:
+            bench_memory(bench, root, params)
+        bench_helper(bench, config_file, args.repeat)
+        if args.memdb:
+            bench_memdb(bench, config_www, args.repeat)
+        if not args.no_web:
+            bench_web(bench, config_www, args.repeat)
+    finally:
+        if not args.library:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.output:
+        bench.save(args.output)
+
+    if args.compare:
+        regressions = bench.compare(args.compare, args.threshold)
+        for name, old, new, ratio in regressions:
+            print("REGRESSION %s: %.3f ms -> %.3f ms (x%.2f)" % (name, old * 1000, new * 1000, ratio))
+        if regressions:
+            sys.exit(1)
@@ -15,6 +15,10 @@ import argparse
 from ultrastar.appenv import AppEnv
 from ultrastar.songhelper import UltraStarHelper
 from ultrastar.consolehelper import ConsoleHelper
+from ultrastar.similarity import SimilarityIndex
+from ultrastar.sprites import SpriteSheets
+from ultrastar.batch import BatchRunner
+import os
 import sys
 
 
@@ -24,22 +28,59 @@ if __name__ == "__main__":
     parser.add_argument("-v", "--verbose", help="Show data about file and processing", action="count")
     parser.add_argument("-r", "--restore-backup", help="Restore from backup config files", action="store_true")
     parser.add_argument("-d", "--delete-backup", help="Also delete backup files", action="store_true")
+    parser.add_argument("-n", "--dry-run", help="Show the files that would be restored, don't restore them", action="store_true")
     parser.add_argument("-c", "--console", help="Start the interactive console", action="store_true")
+    parser.add_argument("-b", "--build-catalog", help="Write the catalog for the web workers (use_catalog) and exit", action="store_true")
+    parser.add_argument("-e", "--execute", metavar="SCRIPT", help="Run the sql sentences and commands of the script (- for stdin) on the database, without loading the library, and exit")
+    parser.add_argument("-f", "--format", help="Output format of --execute", choices=sorted(BatchRunner.FORMATS.keys()), default="table")
+    parser.add_argument("-k", "--keep-going", help="With --execute, run the next statements after an error", action="store_true")
     parser.add_argument("config_file", help="Configuration File")
     args = parser.parse_args()
 
     AppEnv.config(args.config_file)
-    AppEnv.config_set("verbose",args.verbose)
-    AppEnv.print_config()
+    AppEnv.config_set("verbose",args.verbose or 0)
+    if not args.execute:
+        AppEnv.print_config()
 
     ultrastar_helper = UltraStarHelper(AppEnv.config())
 
+    if args.execute:
+        # batch mode: the database as is (no scan of the songs dir)
+        if not AppEnv.config().in_memory and not os.path.exists(AppEnv.config().dbfile):
+            print("database %s not found (load it first)" % AppEnv.config().dbfile, file=sys.stderr)
+            sys.exit(BatchRunner.EXIT_USAGE)
+        try:
+            script = sys.stdin if args.execute == "-" else open(args.execute, 'r', encoding='utf-8')
+        except OSError as e:
+            print("can't read %s: %s" % (args.execute, e), file=sys.stderr)
+            sys.exit(BatchRunner.EXIT_USAGE)
+        ultrastar_helper.store_in_db([], init=False)
+        with script:
+            status = BatchRunner(ConsoleHelper(ultrastar_helper), format=args.format,
+                                 keep_going=args.keep_going).run(script)
+        ultrastar_helper.persist_stop.set()
+        if ultrastar_helper.writes:
+            ultrastar_helper.persist()
+        ultrastar_helper.db.close()
+        sys.exit(status)
+
     if args.restore_backup:
         print("Restoring configuration from backup")
-        ultrastar_helper.restore_backup(args.delete_backup)
+        ultrastar_helper.restore_backup(args.delete_backup, args.dry_run)
         sys.exit(0)
 
     ultrastar_helper.load_db()
+
+    if args.build_catalog:
+        ultrastar_helper.build_catalog()
+        if SimilarityIndex.available():
+            # the workers read the vectors instead of building them
+            ultrastar_helper.similarity.build()
+        if SpriteSheets.available():
+            ultrastar_helper.sprites.update()
+        ultrastar_helper.db.close()
+        sys.exit(0)
+
     ultrastar_helper.test_db()
 
     # prepare console and run it with the data.
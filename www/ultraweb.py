@@ -2,13 +2,21 @@ from flask import Flask, render_template, abort, jsonify, send_from_directory, r
 
 
 from flask_bootstrap import  Bootstrap5
+from markupsafe import Markup
 import base64
+import functools
+import os
 import urllib
 import sys
 sys.path.append('..')
 from ultrastar.songhelper import UltraStarHelper
 from ultrastar.appenv import AppEnv
 from ultrastar.helper import Helper
+from ultrastar.catalog import Catalog
+from ultrastar.jobs import JobManager, JobRunningError
+from ultrastar.responsecache import ResponseCache
+from ultrastar.fragmentcache import FragmentCache
+from ultrastar.similarity import SimilarityIndex, IndexNotReady
 
 
 
@@ -24,7 +32,121 @@ def create_app(config_file):
 
     app.AppEnv = AppEnv
     app.ultrastar_helper =  UltraStarHelper(AppEnv.config())
-    app.ultrastar_helper.load_db()
+    app.catalog = None
+    if AppEnv.config().use_catalog:
+        # workers share the catalog built with ultrastar_console.py --build-catalog,
+        # and don't load nor write the database
+        app.ultrastar_helper.open_read_only()
+        app.catalog = Catalog(AppEnv.config().catalog_file)
+    else:
+        app.ultrastar_helper.load_db()
+        if AppEnv.config().scrub:
+            # check the library in the background (see IntegrityScrubber)
+            app.ultrastar_helper.scrubber.start()
+    app.metrics = app.ultrastar_helper.metrics
+    app.jobs = JobManager()
+    app.response_cache = ResponseCache(app.ultrastar_helper, AppEnv.config().response_cache_bytes)
+    app.fragment_cache = FragmentCache(app.ultrastar_helper, AppEnv.config().fragment_cache_entries)
+
+    def refresh_in_background(kind, index):
+        """update an index built from the data (sprites, similarity) in a
+        background job when the data changed. The requests use the current
+        one meanwhile. With use_catalog they are built with the catalog"""
+        if app.catalog or not index.stale():
+            return
+
+        def refresh(job):
+            changed = index.refresh()
+            if changed:
+                # the pages cached with the previous one
+                app.response_cache.clear()
+            return changed
+
+        try:
+            app.jobs.start(kind, refresh)
+        except JobRunningError:
+            pass
+
+    refresh_in_background("sprites", app.ultrastar_helper.sprites)
+    refresh_in_background("similarity", app.ultrastar_helper.similarity)
+
+    @app.before_request
+    def metrics_begin():
+        app.metrics.begin_request()
+        if app.catalog:
+            # map the new file if the catalog was built again
+            app.catalog = app.catalog.reopen()
+
+    def get_song_file(id, column):
+        "dirname and file name of the song (from the catalog if used)"
+        if app.catalog:
+            try:
+                item = app.catalog.get(id)
+            except ValueError:
+                item = None
+        else:
+            cursor = app.ultrastar_helper.db.cursor()
+            cursor.execute("select dirname,%s,has_cover from songs where id=?;" % column,(id,))
+            item = cursor.fetchone()
+            cursor.close()
+        if not item:
+            abort(404)
+        return item
+
+    @app.after_request
+    def metrics_end(response):
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        if response.status_code == 304:
+            app.metrics.cache_hit("http")
+        app.metrics.end_request(route, response.status_code, response.content_length)
+        return response
+
+    def send_cached(entry):
+        "the cached response, compressed if the client accepts it, or 304 if it has it"
+        encoding = app.response_cache.choose_encoding(entry, lambda name: request.accept_encodings[name])
+        etag = entry.etag if encoding is None else "%s-%s" % (entry.etag, encoding)
+        if request.if_none_match.star_tag or any(request.if_none_match.contains(tag) for tag in entry.etags()):
+            response = make_response("", 304)
+        else:
+            body = entry.body if encoding is None else app.response_cache.encode(entry, encoding)
+            response = make_response(body)
+            response.headers['Content-Type'] = entry.content_type
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        # the clients ask each time, and get a 304 if nothing changed
+        response.cache_control.no_cache = True
+        return response
+
+    def cached_response(extra=None):
+        """cache the body of the view until the data changes (the key is the
+        path, the arguments and extra(), e.g. the version of the playlist files)"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = (request.path, tuple(sorted(request.args.items(multi=True))),
+                       app.catalog.stat if app.catalog else None,
+                       extra() if extra else None)
+                entry, version = app.response_cache.get(key)
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    entry = app.response_cache.put(key, response.get_data(), response.content_type, version)
+                return send_cached(entry)
+            return wrapper
+        return decorator
+
+    def render_cards(template, items, version):
+        """the html of the cards of the items, rendered only when the values
+        they use (version(item)) changed"""
+        return [ Markup(app.fragment_cache.render(template, FragmentCache.version(version(item)),
+                                                  lambda item=item: render_template(template, item=item)))
+                 for item in items ]
+
+    def playlists_version():
+        return app.ultrastar_helper.playlists_version()
 
     @app.template_filter()
     def b64encode(s):
@@ -44,28 +166,42 @@ def create_app(config_file):
 
     @app.route("/")
     @app.route("/artists")
+    @cached_response()
     def artists():
         search = request.args.get('search', default = "", type = str)
         cursor = app.ultrastar_helper.db.cursor()
-        # using the ID to get the cover is somewhat crap
-        # but works (the cover of any of the song)
+        # the artists table is built on ingest, with a stable
+        # representative cover (see UltraStarHelper.update_artists)
+        sql = """select a.name as artist, a.cover_id as id, a.songs, a.duration, a.languages,
+                        s.dirname, s.cover from artists a left join songs s on s.id = a.cover_id"""
         if search:
             ## add like string format to ease the search
-            search = "%%%s%%" % search
-            cursor.execute("select artist, id, count(artist) as songs from songs where artist like ? group by(artist) order by artist;",(search,))
+            search = "%%%s%%" % Helper.normalize(search)
+            cursor.execute("%s where a.norm like ? order by a.sort_key;" % sql,(search,))
         else:
-            cursor.execute("select artist, id, count(artist) as songs from songs group by(artist) order by artist;")
+            cursor.execute("%s order by a.sort_key;" % sql)
         rows = cursor.fetchall()
         cursor.close()
-        artist_list = list(map(lambda x: dict(x),rows))
+        # the covers are drawn from the sprite sheets (if Pillow is installed)
+        sprites = app.ultrastar_helper.sprites
+        has_sprites = sprites.current() is not None
+        refresh_in_background("sprites", sprites)
+        artist_list = []
+        for row in rows:
+            item = dict(row)
+            item['sprite'] = sprites.tile(row['dirname'], row['cover']) if has_sprites and row['dirname'] else None
+            artist_list.append(item)
+        cards = render_cards("fragments/artist_card.html", artist_list,
+                             lambda item: (item['artist'], item['id'], item['songs'], item['sprite']))
         return render_template("artists.html", 
                                title="UltraStar Artist List", 
-                               items = artist_list,
+                               cards = cards,
                                search_action = "/")
 
 
 
     @app.route("/playlists")
+    @cached_response(extra=playlists_version)
     def playlists():
         search = request.args.get('search', default = "", type = str)
        
@@ -78,9 +214,12 @@ def create_app(config_file):
         else:
             playlist_list = app.ultrastar_helper.get_playlists()
 
+        cards = render_cards("fragments/playlist_card.html", playlist_list,
+                             lambda item: (item.name, item.filename, item.len,
+                                           [ (song['artist'], song['title']) for song in item.songs ]))
         return render_template("playlists.html", 
                                title="UltraStar Playlists", 
-                               items = playlist_list,
+                               cards = cards,
                                search_action = "/playlists")
 
 
@@ -115,11 +254,12 @@ def create_app(config_file):
         if artist_id:
             artist_id = uudecode(artist_id)
             cursor = app.ultrastar_helper.db.cursor()
-            cursor.execute("select artist from songs where artist=?",(artist_id,))
+            cursor.execute("select name from artists where norm=?",(Helper.normalize(artist_id),))
             artist = cursor.fetchone()
             cursor.close()
-            artist = dict(artist)
-            title = "Ultrastar song list for %s" % artist_id   
+            if not artist:
+                abort(404)
+            title = "Ultrastar song list for %s" % artist['name']
         
         
         return render_template("songs.html", 
@@ -131,6 +271,7 @@ def create_app(config_file):
     
     
     @app.route("/data")
+    @cached_response(extra=lambda: playlists_version() if request.args.get('playlist') else None)
     def data():
         artist_id = request.args.get('artist', default = "", type = str)
         playlist_id = request.args.get('playlist', default = "", type = str)
@@ -146,18 +287,21 @@ def create_app(config_file):
             rows = playlist.songs
     
             
+        elif app.catalog:
+            rows = app.catalog.songs(artist=artist_id, search=search)
+
         else:
 
             if not search:
                 if artist_id:
-                    cursor.execute("select * from songs where artist=? order by title",(artist_id,))
+                    cursor.execute("select * from songs where artist_norm=? order by title",(Helper.normalize(artist_id),))
                 else:
                     cursor.execute("select * from songs;")
             else:
                 ## add like string format to ease the search
                 search = "%%%s%%" % search
                 if artist_id:
-                    cursor.execute("select * from songs where artist=? and title like ? order by title",(artist_id,search))
+                    cursor.execute("select * from songs where artist_norm=? and title like ? order by title",(Helper.normalize(artist_id),search))
                 else:
                     cursor.execute("select * from songs where title like ?;", (search,))
             
@@ -175,16 +319,72 @@ def create_app(config_file):
     
 
 
+    @app.route("/facets")
+    def facets():
+        def range_arg(name):
+            low = request.args.get("%s_min" % name, default = None, type = float)
+            high = request.args.get("%s_max" % name, default = None, type = float)
+            return (low, high)
+
+        result = app.ultrastar_helper.facets.query(
+                    genre = request.args.getlist('genre'),
+                    edition = request.args.getlist('edition'),
+                    language = request.args.getlist('language'),
+                    decade = request.args.getlist('decade', type = int),
+                    year = range_arg('year'),
+                    duration = range_arg('duration'),
+                    multi = request.args.get('multi', default = None, type = str))
+        return jsonify(result)
+
+    @app.route('/similar/<int:id>')
+    def similar(id):
+        k = min(max(request.args.get('k', default=10, type=int), 1), 100)
+        similarity = app.ultrastar_helper.similarity
+        if not SimilarityIndex.available():
+            return jsonify(error="the similarity index needs numpy (pip install numpy)"), 501
+        refresh_in_background("similarity", similarity)
+        try:
+            songs = similarity.similar_songs(id, k)
+        except KeyError:
+            abort(404)
+        except IndexNotReady as e:
+            response = jsonify(error=str(e))
+            response.status_code = 503
+            response.headers["Retry-After"] = "5"
+            return response
+        return jsonify(data=songs)
+
+    @app.route('/img/sprites/<int:sheet>')
+    def serve_sprite(sheet):
+        sprites = app.ultrastar_helper.sprites
+        if not sprites.index or str(sheet) not in sprites.index['revisions']:
+            abort(404)
+        response = make_response(send_from_directory(sprites.sprite_dir, os.path.basename(sprites.sheet_file(sheet)),
+                                                     as_attachment=False))
+        # the url has the revision of the sheet (?v=)
+        response.cache_control.max_age = 86400
+        return response
+
+    @app.route('/img/sprites.json')
+    def serve_sprites_index():
+        sprites = app.ultrastar_helper.sprites
+        index = sprites.current()
+        refresh_in_background("sprites", sprites)
+        if index is None:
+            abort(404)
+        return jsonify(index)
+
     @app.route('/img/cover/<id>')
     
     def serve_img(id):
         # use the id of the song to get the cover
         # but use also the cover for the artist
-        cursor = app.ultrastar_helper.db.cursor()
-        cursor.execute("select dirname,cover from songs where id=?;",(id,))
-        item = cursor.fetchone()
-        if not item:
-            abort(404)
+        item = get_song_file(id, "cover")
+        if not item["has_cover"]:
+            # missing cover found when loading the song
+            response = make_response(send_from_directory(app.static_folder, "img/404.png", as_attachment=False))
+            response.cache_control.max_age = 300
+            return response
         response = make_response(send_from_directory(item["dirname"], item["cover"], as_attachment=False))
         response.cache_control.max_age = 300
         return response
@@ -193,15 +393,55 @@ def create_app(config_file):
     def serve_mp3(id):
         # use the id of the song to get the cover
         # but use also the cover for the artist
-        cursor = app.ultrastar_helper.db.cursor()
-        cursor.execute("select dirname,mp3 from songs where id=?;",(id,))
-        item = cursor.fetchone()
-        if not item:
-            abort(404)
+        item = get_song_file(id, "mp3")
         response = make_response(send_from_directory(item["dirname"], item["mp3"], as_attachment=False))
         response.cache_control.max_age = 300
         return response
 
+    @app.route('/admin/refresh', methods=['POST'])
+    def admin_refresh():
+        if app.catalog:
+            return jsonify(error="the database is read only (use_catalog), build the catalog again instead"), 403
+
+        def refresh(job):
+            def progress(counters):
+                job.progress = counters.as_dict()
+            return app.ultrastar_helper.rebuild(progress=progress).as_dict()
+
+        try:
+            job = app.jobs.start("refresh", refresh)
+        except JobRunningError as e:
+            return jsonify(error=str(e), job=e.job.as_dict()), 409
+        response = jsonify(job.as_dict())
+        response.status_code = 202
+        response.headers["Location"] = "/admin/jobs/%d" % job.id
+        return response
+
+    @app.route('/admin/jobs')
+    def admin_jobs():
+        return jsonify(jobs=[ job.as_dict() for job in app.jobs.list() ])
+
+    @app.route('/admin/jobs/<int:id>')
+    def admin_job(id):
+        job = app.jobs.get(id)
+        if not job:
+            abort(404)
+        return jsonify(job.as_dict())
+
+    @app.route('/admin/integrity')
+    def admin_integrity():
+        status = request.args.get('status', default="fail", type=str)
+        limit = request.args.get('limit', default=None, type=int)
+        report = app.ultrastar_helper.scrubber.report(None if status == "all" else status, limit)
+        return jsonify(report)
+
+    @app.route('/metrics')
+    def metrics():
+        response = make_response(app.metrics.render())
+        response.mimetype = "text/plain"
+        response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        return response
+
     @app.errorhandler(404)
     def page_not_found(error):
         return render_template("error.html", error="Page not found"), 404